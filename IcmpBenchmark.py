@@ -0,0 +1,253 @@
+# #################################################################################################################### #
+# Imports                                                                                                              #
+# #################################################################################################################### #
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from IcmpHelperLibrary import IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpBenchmark                                                                                                  #
+#                                                                                                                      #
+# End-to-end benchmarks of IcmpHelperLibrary, run against an IcmpSimulatedNetwork so they need neither root nor a      #
+# network. Each benchmark reports operations per second, CPU time per operation and, where it produces results,       #
+# the memory each retained result takes. Runs are appended to a JSON lines file and compared with the previous run.   #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpBenchmark:
+    # ################################################################################################################ #
+    # IcmpBenchmark Class Scope Variables                                                                              #
+    # ################################################################################################################ #
+    __regressionThreshold = 0.10                    # Throughput drop flagged when comparing runs
+    benchmarkNames = ("packetBuild", "checksum", "replyParse", "ping", "traceRoute", "traceRouteBatch", "sweep")
+
+    # ################################################################################################################ #
+    # IcmpBenchmark Constructors                                                                                       #
+    # ################################################################################################################ #
+    def __init__(self, scale=1.0):
+        # scale multiplies every benchmark's operation count, e.g. 0.1 for a quick check
+        self.__scale = scale
+
+    # ################################################################################################################ #
+    # IcmpBenchmark Private Functions                                                                                  #
+    # ################################################################################################################ #
+    def __count(self, operations):
+        return max(1, int(operations * self.__scale))
+
+    @staticmethod
+    def __measure(operations, function):
+        # Runs function (which performs the given number of operations) once and returns its metrics. With
+        # operations None, function returns the number of operations it performed.
+        gc.collect()
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        performed = function()
+        cpuSeconds = time.process_time() - cpuStart
+        wallSeconds = time.perf_counter() - wallStart
+        if operations is None:
+            operations = performed
+        return {
+            "operations": operations,
+            "seconds": wallSeconds,
+            "operationsPerSecond": operations / wallSeconds if wallSeconds > 0 else None,
+            "cpuMicrosecondsPerOperation": cpuSeconds / operations * 1e6,
+            "bytesPerResult": None,
+        }
+
+    @staticmethod
+    def __measureResultSize(function):
+        # Memory held per result by the list function returns, traced on a separate (slower) run
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            results = function()
+            gc.collect()
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return (after - before) / len(results) if results else None
+
+    @staticmethod
+    def __getVersion():
+        # The git revision of the working tree, when there is one
+        try:
+            return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return "unknown"
+
+    # ################################################################################################################ #
+    # IcmpBenchmark Public Functions                                                                                   #
+    # ################################################################################################################ #
+    def benchmarkPacketBuild(self):
+        # Echo requests prepared from the engine's template, one per identifier/sequence pair
+        operations = self.__count(200000)
+        template = IcmpHelperLibrary.IcmpEchoRequestTemplate()
+
+        def run():
+            for sequenceNumber in range(operations):
+                template.prepare(0x1234, sequenceNumber & 0xffff, 0.0)
+
+        return self.__measure(operations, run)
+
+    def benchmarkChecksum(self):
+        operations = self.__count(200000)
+        packet = bytes(IcmpHelperLibrary.IcmpEchoRequestTemplate().prepare(0x1234, 1, 0.0))
+
+        def run():
+            for _ in range(operations):
+                IcmpHelperLibrary.IcmpChecksum.calculate(packet)
+
+        return self.__measure(operations, run)
+
+    def benchmarkReplyParse(self):
+        # Echo replies wrapped and read the way the validation path reads them
+        operations = self.__count(200000)
+        echoRequest = bytearray(IcmpHelperLibrary.IcmpEchoRequestTemplate().prepare(0x1234, 1, 0.0))
+        echoRequest[0] = 0
+        reply = bytes(20) + bytes(echoRequest)
+
+        def run():
+            for _ in range(operations):
+                replyPacket = IcmpHelperLibrary.IcmpPacket_EchoReply(reply)
+                replyPacket.getIcmpIdentifier()
+                replyPacket.getIcmpSequenceNumber()
+                replyPacket.getIcmpDataBytes()
+
+        return self.__measure(operations, run)
+
+    def benchmarkPing(self):
+        # Sequential pings, each waiting for its reply
+        operations = self.__count(20000)
+        network = IcmpHelperLibrary.IcmpSimulatedNetwork(pathLength=8, seed=1)
+        library = IcmpHelperLibrary(network=network)
+        try:
+            metrics = self.__measure(operations, lambda: sum(1 for _ in library.pingRecords("192.0.2.1", operations,
+                                                                                          interval=0)))
+            metrics["bytesPerResult"] = self.__measureResultSize(
+                lambda: list(library.pingRecords("192.0.2.1", self.__count(2000), interval=0)))
+        finally:
+            library.close()
+        return metrics
+
+    def benchmarkTraceRoute(self):
+        # Pipelined traces of a 16 hop path; an operation is one probe
+        traces = self.__count(1000)
+        network = IcmpHelperLibrary.IcmpSimulatedNetwork(pathLength=16, seed=1)
+        library = IcmpHelperLibrary(network=network)
+        try:
+            def run():
+                for i in range(traces):
+                    sum(1 for _ in library.traceRouteRecords("192.0.2.%d" % (i % 250 + 1), maxTtl=16,
+                                                             resolveHopNames=False))
+
+            metrics = self.__measure(traces * 16, run)
+            metrics["bytesPerResult"] = self.__measureResultSize(
+                lambda: list(library.traceRouteRecords("192.0.2.1", maxTtl=16, resolveHopNames=False)))
+        finally:
+            library.close()
+        return metrics
+
+    def benchmarkTraceRouteBatch(self):
+        # Doubletree batch over destinations sharing their first hops; an operation is one reported hop
+        destinations = ["172.%d.%d.%d" % (16 + i // 62500, i // 250 % 250, i % 250 + 1)
+                        for i in range(self.__count(5000))]
+        network = IcmpHelperLibrary.IcmpSimulatedNetwork(pathLength=12, seed=1)
+        library = IcmpHelperLibrary(network=network)
+        try:
+            metrics = self.__measure(None, lambda: sum(1 for _ in library.traceRouteBatch(destinations)))
+            metrics["probesPerHop"] = network.getSentCount() / metrics["operations"] if metrics["operations"] else None
+        finally:
+            library.close()
+        return metrics
+
+    def benchmarkSweep(self):
+        targets = ["10.%d.%d.%d" % (i // 62500, i // 250 % 250, i % 250 + 1) for i in range(self.__count(100000))]
+        network = IcmpHelperLibrary.IcmpSimulatedNetwork(pathLength=8, seed=1)
+        library = IcmpHelperLibrary(network=network)
+        try:
+            metrics = self.__measure(len(targets), lambda: sum(1 for _ in library.sweep(targets,
+                                                                                       packetsPerSecond=1e7)))
+            metrics["bytesPerResult"] = self.__measureResultSize(
+                lambda: list(library.sweep(targets[:self.__count(10000)], packetsPerSecond=1e7)))
+        finally:
+            library.close()
+        return metrics
+
+    def run(self, names=None):
+        # Runs the named benchmarks (all by default) and returns one result entry
+        results = {}
+        for name in names or self.benchmarkNames:
+            benchmark = getattr(self, "benchmark" + name[0].upper() + name[1:])
+            results[name] = benchmark()
+        return {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "version": self.__getVersion(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "scale": self.__scale,
+            "results": results,
+        }
+
+    @staticmethod
+    def loadRuns(path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as resultsFile:
+            return [json.loads(line) for line in resultsFile if line.strip()]
+
+    @staticmethod
+    def saveRun(run, path):
+        with open(path, "a") as resultsFile:
+            resultsFile.write(json.dumps(run) + "\n")
+
+    @staticmethod
+    def printRun(run, previousRun=None):
+        # One line per benchmark, with the throughput change against previousRun where both have it
+        print("Benchmark (%s, Python %s, scale %g)" % (run["version"], run["python"], run["scale"]))
+        for name, metrics in run["results"].items():
+            line = "  %-16s %12.0f ops/s  %9.2f us cpu/op" % (name, metrics["operationsPerSecond"] or 0,
+                                                              metrics["cpuMicrosecondsPerOperation"])
+            if metrics.get("bytesPerResult") is not None:
+                line += "  %8.0f B/result" % metrics["bytesPerResult"]
+            previousMetrics = previousRun["results"].get(name) if previousRun is not None else None
+            if previousMetrics and previousMetrics.get("operationsPerSecond") and metrics["operationsPerSecond"]:
+                change = metrics["operationsPerSecond"] / previousMetrics["operationsPerSecond"] - 1
+                line += "  %+6.1f%% vs %s" % (change * 100, previousRun["version"])
+                if change < -IcmpBenchmark.__regressionThreshold:
+                    line += "  REGRESSION"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IcmpHelperLibrary against a simulated network")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="benchmarks to run (default: all): " + ", ".join(IcmpBenchmark.benchmarkNames))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies every operation count")
+    parser.add_argument("--results", default="IcmpBenchmarkResults.jsonl", help="JSON lines file of past runs")
+    parser.add_argument("--no-save", action="store_true", help="do not append this run to the results file")
+    arguments = parser.parse_args()
+    for name in arguments.benchmarks:
+        if name not in IcmpBenchmark.benchmarkNames:
+            parser.error("unknown benchmark: " + name)
+
+    benchmark = IcmpBenchmark(arguments.scale)
+    run = benchmark.run(arguments.benchmarks)
+    previousRuns = [previousRun for previousRun in IcmpBenchmark.loadRuns(arguments.results)
+                    if previousRun["scale"] == run["scale"]]
+    IcmpBenchmark.printRun(run, previousRuns[-1] if previousRuns else None)
+    if not arguments.no_save:
+        IcmpBenchmark.saveRun(run, arguments.results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,418 @@
 # #################################################################################################################### #
 # Imports                                                                                                              #
 # #################################################################################################################### #
+import array
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import csv
+import ctypes
+import errno
+import heapq
+import http.server
+import io
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
 import os
+import queue
+import random
+import re
 from socket import *
 import struct
+import sys
 import time
 import select
+import threading
+
+try:
+    import numpy                # Optional; IcmpResultStore queries and the bulk pcap analysis need it
+except ImportError:
+    numpy = None
 
 
 # #################################################################################################################### #
 # Class IcmpHelperLibrary                                                                                              #
 # #################################################################################################################### #
 class IcmpHelperLibrary:
+    # ################################################################################################################ #
+    # Class IcmpChecksum                                                                                               #
+    #                                                                                                                  #
+    # Internet checksum (RFC 1071) over a whole buffer, plus incremental updates (RFC 1624) so a packet whose          #
+    # sequence number or timestamp changed does not have to be rescanned. Values are the 16 bit checksum as it is      #
+    # packed into the header with format code "!H".                                                                    #
+    #                                                                                                                  #
+    # References:                                                                                                      #
+    # https://www.rfc-editor.org/rfc/rfc1071                                                                           #
+    # https://www.rfc-editor.org/rfc/rfc1624                                                                           #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpChecksum:
+        # ############################################################################################################ #
+        # IcmpChecksum Public Functions                                                                                #
+        # ############################################################################################################ #
+        @staticmethod
+        def calculate(data):
+            # The one's complement sum of the 16 bit words equals the whole buffer read as one big-endian integer
+            # reduced modulo 0xffff (since 2^16 = 1 mod 0xffff), so the sum is done in C by int.from_bytes and %.
+            if len(data) & 1:
+                data = bytes(data) + b'\x00'        # Odd length is padded with a zero byte
+            return IcmpHelperLibrary.IcmpChecksum.finish(int.from_bytes(data, "big"))
+
+        @staticmethod
+        def finish(total):
+            # Turns any non-negative sum of 16 bit words (or of word-aligned big-endian fields) into the checksum
+            folded = total % 0xffff
+            if folded == 0 and total != 0:
+                folded = 0xffff                     # One's complement "negative zero", as the end-around carry gives
+            return ~folded & 0xffff
+
+        @staticmethod
+        def update(checksum, oldWord, newWord):
+            # RFC 1624 eqn. 3: HC' = ~(~HC + ~m + m')
+            total = (~checksum & 0xffff) + (~oldWord & 0xffff) + newWord
+            total = (total & 0xffff) + (total >> 16)
+            total = (total & 0xffff) + (total >> 16)
+            if total == 0:
+                total = 0xffff                      # Keeps the result identical to a full recalculation
+            return ~total & 0xffff
+
+        @staticmethod
+        def updateField(checksum, oldBytes, newBytes):
+            # Incremental update for a field of any length that starts at an even offset in the packet
+            if len(oldBytes) != len(newBytes):
+                raise ValueError("Old and new field must be the same length")
+            if len(oldBytes) & 1:
+                oldBytes = bytes(oldBytes) + b'\x00'
+                newBytes = bytes(newBytes) + b'\x00'
+            oldWord = int.from_bytes(oldBytes, "big") % 0xffff
+            newWord = int.from_bytes(newBytes, "big") % 0xffff
+            return IcmpHelperLibrary.IcmpChecksum.update(checksum, oldWord, newWord)
+
+    # ################################################################################################################ #
+    # Class IcmpResolver                                                                                               #
+    #                                                                                                                  #
+    # Forward lookups go through a TTL-bounded LRU cache, so repeated probes to one name cost one lookup. Reverse      #
+    # lookups of hop addresses and bulk forward lookups run on a thread pool and never block the probe loop. The       #
+    # lookup functions can be replaced (e.g. with a local stub) for testing.                                           #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpResolver:
+        # ############################################################################################################ #
+        # IcmpResolver Class Scope Variables                                                                           #
+        # ############################################################################################################ #
+        __defaultResolver = None
+        __defaultResolverLock = threading.Lock()
+
+        # ############################################################################################################ #
+        # IcmpResolver Constructors                                                                                    #
+        # ############################################################################################################ #
+        def __init__(self, cacheSize=4096, cacheTtl=300, maxWorkers=16, forwardLookup=None, reverseLookup=None):
+            # forwardLookup(name) -> IPv4 address string; reverseLookup(address) -> host name. Both raise OSError
+            # on failure, like gethostbyname/gethostbyaddr which are the defaults.
+            self.__cacheSize = cacheSize
+            self.__cacheTtl = cacheTtl
+            self.__maxWorkers = maxWorkers
+            self.__forwardLookup = forwardLookup if forwardLookup is not None else gethostbyname
+            self.__reverseLookup = reverseLookup if reverseLookup is not None else (lambda a: gethostbyaddr(a)[0])
+            self.__forwardCache = collections.OrderedDict()     # name -> (address, expiry), least recent first
+            self.__reverseCache = collections.OrderedDict()     # address -> (Future of name, expiry)
+            self.__lock = threading.Lock()
+            self.__executor = None
+
+        # ############################################################################################################ #
+        # IcmpResolver Private Functions                                                                               #
+        # ############################################################################################################ #
+        @staticmethod
+        def __isIpAddress(host):
+            try:
+                inet_aton(host)
+            except OSError:
+                return False
+            return host.count(".") == 3         # inet_aton also accepts shorthand such as "10.1"
+
+        def __getExecutor(self):
+            with self.__lock:
+                if self.__executor is None:
+                    self.__executor = concurrent.futures.ThreadPoolExecutor(self.__maxWorkers,
+                                                                            thread_name_prefix="IcmpResolver")
+                return self.__executor
+
+        def __cacheGet(self, cache, key):
+            # Caller holds the lock
+            entry = cache.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del cache[key]
+                return None
+            cache.move_to_end(key)
+            return entry[0]
+
+        def __cachePut(self, cache, key, value):
+            # Caller holds the lock
+            cache[key] = (value, time.monotonic() + self.__cacheTtl)
+            cache.move_to_end(key)
+            while len(cache) > self.__cacheSize:
+                cache.popitem(last=False)
+
+        def __reverseResolveBlocking(self, address):
+            try:
+                return self.__reverseLookup(address)
+            except OSError:
+                return None
+
+        # ############################################################################################################ #
+        # IcmpResolver Public Functions                                                                                #
+        # ############################################################################################################ #
+        @staticmethod
+        def getDefaultResolver():
+            # Process-wide resolver used when no other one is given
+            resolverClass = IcmpHelperLibrary.IcmpResolver
+            with resolverClass.__defaultResolverLock:
+                if resolverClass.__defaultResolver is None:
+                    resolverClass.__defaultResolver = resolverClass()
+                return resolverClass.__defaultResolver
+
+        def getCached(self, host):
+            # Returns the address if it can be had without a lookup (an address literal or a cache hit), else None
+            host = host.strip()
+            if self.__isIpAddress(host):
+                return host
+            with self.__lock:
+                return self.__cacheGet(self.__forwardCache, host)
+
+        def resolve(self, host):
+            # Blocking forward lookup through the cache
+            address = self.getCached(host)
+            if address is not None:
+                return address
+
+            host = host.strip()
+            address = self.__forwardLookup(host)
+            with self.__lock:
+                self.__cachePut(self.__forwardCache, host, address)
+            return address
+
+        def resolveMany(self, hosts):
+            # Resolves a batch of names concurrently. Returns [(host, address or None)] in the order given.
+            hosts = list(hosts)
+            results = [self.getCached(host) for host in hosts]
+            missing = [i for i, address in enumerate(results) if address is None]
+
+            lookups = {}
+            if len(missing) > 1:
+                executor = self.__getExecutor()
+                lookups = {i: executor.submit(self.resolve, hosts[i]) for i in missing}
+
+            for i in missing:
+                try:
+                    results[i] = lookups[i].result() if i in lookups else self.resolve(hosts[i])
+                except OSError:
+                    results[i] = None
+            return list(zip(hosts, results))
+
+        def reverseResolve(self, address):
+            # Starts a reverse lookup on the thread pool and returns a concurrent.futures.Future of the host name
+            # (None when the address has no name). Lookups of the same address share one future.
+            with self.__lock:
+                future = self.__cacheGet(self.__reverseCache, address)
+                if future is not None:
+                    return future
+
+            future = self.__getExecutor().submit(self.__reverseResolveBlocking, address)
+            with self.__lock:
+                self.__cachePut(self.__reverseCache, address, future)
+            return future
+
+        def close(self):
+            with self.__lock:
+                executor = self.__executor
+                self.__executor = None
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    # ################################################################################################################ #
+    # Class IcmpPrefixIndex                                                                                            #
+    #                                                                                                                  #
+    # Longest-prefix-match index mapping IPv4 addresses to the origin ASN and prefix that routes them, built from a    #
+    # prefix dump ("1.0.0.0/24 13335", or CAIDA pfx2as "1.0.0.0<TAB>24<TAB>13335"). The prefixes are sorted by        #
+    # address, enclosing prefixes first, and walked once with a stack of the prefixes covering the current address;    #
+    # this splits the address space into sorted disjoint ranges, each held by its longest matching prefix, kept in     #
+    # flat arrays. A lookup is then one binary search, and save()/load() move the arrays to and from disk as raw bytes #
+    # so a full routing table loads in milliseconds.                                                                   #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpPrefixIndex:
+        # ############################################################################################################ #
+        # IcmpPrefixIndex Class Scope Variables                                                                        #
+        # ############################################################################################################ #
+        __fileHeaderStruct = struct.Struct("<4sHII")        # Magic, version, range count, prefix count
+        __fileMagic = b"IPFX"
+        __fileVersion = 1
+        __addressStruct = struct.Struct("!I")
+        __noPrefix = 0xffffffff                             # Range value for addresses no prefix covers
+        __asnPattern = re.compile(r"\D*(\d+)")              # First ASN of "13335", "AS13335", "13335_4826", "{1,2}"
+
+        # ############################################################################################################ #
+        # IcmpPrefixIndex Constructors                                                                                 #
+        # ############################################################################################################ #
+        def __init__(self, prefixes=()):
+            # prefixes is an iterable of ("a.b.c.d/len", asn); host bits are ignored and a repeated prefix keeps
+            # the last ASN given for it
+            self.__rangeStarts = array.array('I')   # First address of each range, ascending
+            self.__rangeValues = array.array('I')   # Prefix index covering each range, or __noPrefix
+            self.__asns = array.array('I')
+            self.__networks = array.array('I')
+            self.__lengths = array.array('B')
+            self.__compile(prefixes)
+
+        @staticmethod
+        def fromPrefixFile(path):
+            # Reads a prefix dump; blank lines, comments (# or ;) and IPv6 prefixes are skipped, and any other line
+            # that is not a valid IPv4 prefix and ASN raises ValueError naming the file and line
+            def readPrefixes():
+                with open(path) as prefixFile:
+                    for lineNumber, line in enumerate(prefixFile, 1):
+                        fields = line.split()
+                        if not fields or fields[0][0] in "#;" or ":" in fields[0]:
+                            continue
+                        prefix = IcmpHelperLibrary.IcmpPrefixIndex.__parsePrefixLine(fields)
+                        if prefix is None:
+                            raise ValueError("%s line %d: expected \"prefix/length asn\" or \"address length asn\", "
+                                             "got %r" % (path, lineNumber, line.strip()))
+                        yield prefix
+
+            return IcmpHelperLibrary.IcmpPrefixIndex(readPrefixes())
+
+        @staticmethod
+        def load(path):
+            # Reads an index written by save()
+            with open(path, "rb") as indexFile:
+                data = indexFile.read()
+            indexClass = IcmpHelperLibrary.IcmpPrefixIndex
+            magic, version, rangeCount, prefixCount = indexClass.__fileHeaderStruct.unpack_from(data)
+            if magic != indexClass.__fileMagic or version != indexClass.__fileVersion:
+                raise ValueError("%s is not a prefix index file" % path)
+
+            index = indexClass()
+            offset = indexClass.__fileHeaderStruct.size
+            for values, count in ((index.__rangeStarts, rangeCount), (index.__rangeValues, rangeCount),
+                                  (index.__asns, prefixCount), (index.__networks, prefixCount),
+                                  (index.__lengths, prefixCount)):
+                size = count * values.itemsize
+                values.frombytes(data[offset:offset + size])
+                offset += size
+                if sys.byteorder == "big":
+                    values.byteswap()
+            return index
+
+        # ############################################################################################################ #
+        # IcmpPrefixIndex Getters                                                                                      #
+        # ############################################################################################################ #
+        def getPrefixCount(self):
+            return len(self.__asns)
+
+        def getRangeCount(self):
+            return len(self.__rangeStarts)
+
+        # ############################################################################################################ #
+        # IcmpPrefixIndex Private Functions                                                                            #
+        # ############################################################################################################ #
+        @staticmethod
+        def __parsePrefixLine(fields):
+            # ("a.b.c.d/len", asn) from the fields of a "prefix/length asn" or "address length asn" line, or None
+            # if the line is not one of those
+            if "/" in fields[0] and len(fields) >= 2:
+                prefix, asnField = fields[0], fields[1]
+            elif "/" not in fields[0] and len(fields) >= 3:
+                prefix, asnField = fields[0] + "/" + fields[1], fields[2]
+            else:
+                return None
+            address, length = prefix.split("/", 1)
+            asnMatch = IcmpHelperLibrary.IcmpPrefixIndex.__asnPattern.match(asnField)
+            if not length.isdigit() or int(length) > 32 or asnMatch is None:
+                return None
+            try:
+                inet_aton(address)
+            except OSError:
+                return None
+            return prefix, int(asnMatch.group(1))
+
+        def __compile(self, prefixes):
+            prefixIds = {}                          # (network, length) -> index into the prefix arrays
+            for prefix, asn in prefixes:
+                address, _, length = prefix.partition("/")
+                if not length.isdigit() or not 0 <= int(length) <= 32:
+                    raise ValueError("Invalid prefix length in " + prefix)
+                length = int(length)
+                network = self.__addressStruct.unpack(inet_aton(address))[0] & (0xffffffff << (32 - length)) \
+                    & 0xffffffff
+                if not isinstance(asn, int):
+                    asnMatch = self.__asnPattern.match(asn)
+                    if asnMatch is None:
+                        raise ValueError("Invalid ASN %r for %s" % (asn, prefix))
+                    asn = int(asnMatch.group(1))
+                prefixId = prefixIds.get((network, length))
+                if prefixId is None:
+                    prefixIds[(network, length)] = len(self.__asns)
+                    self.__asns.append(asn)
+                    self.__networks.append(network)
+                    self.__lengths.append(length)
+                else:
+                    self.__asns[prefixId] = asn
+
+            # Walk the prefixes in address order, enclosing prefixes first. A stack holds the prefixes covering
+            # the current address; each one that starts or ends marks a range boundary where the innermost
+            # covering prefix, the longest match, changes.
+            covering = []                           # (end, prefix index), innermost last
+            for network, length in sorted(prefixIds):
+                while covering and covering[-1][0] <= network:
+                    end = covering.pop()[0]
+                    self.__addRange(end, covering[-1][1] if covering else self.__noPrefix)
+                self.__addRange(network, prefixIds[(network, length)])
+                covering.append((network + (1 << (32 - length)), prefixIds[(network, length)]))
+            while covering:
+                end = covering.pop()[0]
+                self.__addRange(end, covering[-1][1] if covering else self.__noPrefix)
+
+        def __addRange(self, start, value):
+            if start > 0xffffffff:
+                return                              # The end of a prefix reaching the top of the address space
+            if self.__rangeStarts and self.__rangeStarts[-1] == start:
+                self.__rangeValues[-1] = value      # A later boundary at the same address supersedes the earlier
+                if len(self.__rangeValues) > 1 and self.__rangeValues[-2] == value:
+                    self.__rangeStarts.pop()
+                    self.__rangeValues.pop()
+            elif not self.__rangeValues or self.__rangeValues[-1] != value:
+                self.__rangeStarts.append(start)
+                self.__rangeValues.append(value)
+
+        # ############################################################################################################ #
+        # IcmpPrefixIndex Public Functions                                                                             #
+        # ############################################################################################################ #
+        def lookup(self, address):
+            # (asn, "a.b.c.d/len") of the longest prefix containing the address, or None if no prefix does
+            i = bisect.bisect_right(self.__rangeStarts, self.__addressStruct.unpack(inet_aton(address))[0]) - 1
+            if i < 0 or self.__rangeValues[i] == self.__noPrefix:
+                return None
+            prefixId = self.__rangeValues[i]
+            return (self.__asns[prefixId], "%s/%d" % (inet_ntoa(self.__addressStruct.pack(self.__networks[prefixId])),
+                                                      self.__lengths[prefixId]))
+
+        def save(self, path):
+            with open(path, "wb") as indexFile:
+                indexFile.write(self.__fileHeaderStruct.pack(self.__fileMagic, self.__fileVersion,
+                                                             len(self.__rangeStarts), len(self.__asns)))
+                for values in (self.__rangeStarts, self.__rangeValues, self.__asns, self.__networks, self.__lengths):
+                    if sys.byteorder == "big":
+                        values = array.array(values.typecode, values)
+                        values.byteswap()
+                    values.tofile(indexFile)
+
     # ################################################################################################################ #
     # Class IcmpPacket                                                                                                 #
     #                                                                                                                  #
@@ -36,8 +437,6 @@ class IcmpHelperLibrary:
         __ipTimeout = 30
         __ttl = 255                     # Time to live
 
-        __DEBUG_IcmpPacket = False      # Allows for debug output
-
         # ############################################################################################################ #
         # IcmpPacket Class Getters                                                                                     #
         # ############################################################################################################ #
@@ -65,15 +464,24 @@ class IcmpHelperLibrary:
         def getTtl(self):
             return self.__ttl
 
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getPacketBytes(self):
+            return b''.join([self.__header, self.__data])
+
         # ############################################################################################################ #
         # IcmpPacket Class Setters                                                                                     #
         # ############################################################################################################ #
-        def setIcmpTarget(self, icmpTarget):
+        def setIcmpTarget(self, icmpTarget, resolver=None):
             self.__icmpTarget = icmpTarget
 
-            # Only attempt to get destination address if it is not whitespace
+            # Only attempt to get destination address if it is not whitespace. Lookups go through a caching
+            # IcmpResolver (the process-wide one unless another is given).
             if len(self.__icmpTarget.strip()) > 0:
-                self.__destinationIpAddress = gethostbyname(self.__icmpTarget.strip())
+                if resolver is None:
+                    resolver = IcmpHelperLibrary.IcmpResolver.getDefaultResolver()
+                self.__destinationIpAddress = resolver.resolve(self.__icmpTarget)
 
         def setIcmpType(self, icmpType):
             self.__icmpType = icmpType
@@ -97,39 +505,9 @@ class IcmpHelperLibrary:
         # IcmpPacket Class Private Functions                                                                           #
         # ############################################################################################################ #
         def __recalculateChecksum(self):
-            print("calculateChecksum Started...") if self.__DEBUG_IcmpPacket else 0
             packetAsByteData = b''.join([self.__header, self.__data])
-            checksum = 0
 
-            # This checksum function will work with pairs of values with two separate 16 bit segments. Any remaining
-            # 16 bit segment will be handled on the upper end of the 32 bit segment.
-            countTo = (len(packetAsByteData) // 2) * 2
-
-            # Calculate checksum for all paired segments
-            print(f'{"Count":10} {"Value":10} {"Sum":10}') if self.__DEBUG_IcmpPacket else 0
-            count = 0
-            while count < countTo:
-                thisVal = packetAsByteData[count + 1] * 256 + packetAsByteData[count]
-                checksum = checksum + thisVal
-                checksum = checksum & 0xffffffff        # Capture 16 bit checksum as 32 bit value
-                print(f'{count:10} {hex(thisVal):10} {hex(checksum):10}') if self.__DEBUG_IcmpPacket else 0
-                count = count + 2
-
-            # Calculate checksum for remaining segment (if there are any)
-            if countTo < len(packetAsByteData):
-                thisVal = packetAsByteData[len(packetAsByteData) - 1]
-                checksum = checksum + thisVal
-                checksum = checksum & 0xffffffff        # Capture as 32 bit value
-                print(count, "\t", hex(thisVal), "\t", hex(checksum)) if self.__DEBUG_IcmpPacket else 0
-
-            # Add 1's Complement Rotation to original checksum
-            checksum = (checksum >> 16) + (checksum & 0xffff)   # Rotate and add to base 16 bits
-            checksum = (checksum >> 16) + checksum              # Rotate and add
-
-            answer = ~checksum                  # Invert bits
-            answer = answer & 0xffff            # Trim to 16 bit value
-            answer = answer >> 8 | (answer << 8 & 0xff00)
-            print("Checksum: ", hex(answer)) if self.__DEBUG_IcmpPacket else 0
+            answer = IcmpHelperLibrary.IcmpChecksum.calculate(packetAsByteData)
 
             self.setPacketChecksum(answer)
 
@@ -157,6 +535,7 @@ class IcmpHelperLibrary:
 
         def __packAndRecalculateChecksum(self):
             # Checksum is calculated with the following sequence to confirm data in up to date
+            self.setPacketChecksum(0)           # The checksum field counts as zero while the checksum is calculated
             self.__packHeader()                 # packHeader() and encodeData() transfer data to their respective bit
                                                 # locations, otherwise, the bit sequences are empty or incorrect.
             self.__encodeData()
@@ -181,7 +560,7 @@ class IcmpHelperLibrary:
                 icmpReplyPacket.setIsValidIcmpIdentifier(True)
 
             # Checking raw data
-            if icmpReplyPacket.getIcmpData() != self.getDataRaw():
+            if icmpReplyPacket.getIcmpDataBytes() != self.__data[8:]:
                 is_valid = False
             else:
                 icmpReplyPacket.setIsValidRawData(True)
@@ -201,82 +580,100 @@ class IcmpHelperLibrary:
             self.__dataRaw = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
             self.__packAndRecalculateChecksum()
 
-        def sendEchoRequest(self):
+        def sendEchoRequest(self, probeEngine=None, statistics=None, retransmitTimer=None):
+            # statistics is an optional IcmpRttStatistics that records this packet and its echo reply RTT.
+            # retransmitTimer is an optional IcmpRetransmitTimer that sets how long to wait and learns from the
+            # response. Returns the ICMP type of the response, or None if the request timed out.
             if len(self.__icmpTarget.strip()) <= 0 | len(self.__destinationIpAddress.strip()) <= 0:
                 self.setIcmpTarget("127.0.0.1")
 
             ping_msg = "Pinging (" + self.__icmpTarget + ") " + self.__destinationIpAddress
             print(ping_msg, end=" ")
 
-            mySocket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)
-            mySocket.settimeout(self.__ipTimeout)
-            mySocket.bind(("", 0))
+            # A packet sent on its own gets a private engine. Callers sending many packets pass a shared engine so
+            # the socket is opened once and replies are routed to the packet that is waiting for them.
+            ownsProbeEngine = probeEngine is None
+            if ownsProbeEngine:
+                probeEngine = IcmpHelperLibrary.IcmpProbeEngine()
 
-            mySocket.setsockopt(IPPROTO_IP, IP_TTL, struct.pack('I', self.getTtl()))  # Unsigned int - 4 bytes
             try:
-                mySocket.sendto(b''.join([self.__header, self.__data]), (self.__destinationIpAddress, 0))
-                IcmpHelperLibrary.sent_packets += 1
-
-                timeLeft = 30
-                pingStartTime = time.time()
-                startedSelect = time.time()
-                whatReady = select.select([mySocket], [], [], timeLeft)
-                endSelect = time.time()
-                howLongInSelect = (endSelect - startedSelect)
-                if whatReady[0] == []:  # Timeout
+                probe = probeEngine.sendPacket(self)
+                if statistics is not None:
+                    statistics.recordSent()
+
+                timeout = retransmitTimer.getTimeout() if retransmitTimer is not None else self.__ipTimeout
+                probeEngine.waitFor([probe], timeout)
+                if not probe.isComplete():  # Timeout
                     print("  *        *        *        *        *      Request timed out.")
-                recvPacket, addr = mySocket.recvfrom(1024)  # recvPacket - bytes object representing data received
-                # addr  - address of socket sending data
-                timeReceived = time.time()
-                timeLeft = timeLeft - howLongInSelect
-                if timeLeft <= 0:
-                    print("  *        *        *        *        *      Request timed out (By no remaining time left).")
+                    return None
+                if retransmitTimer is not None:
+                    retransmitTimer.recordRtt(probe.getRtt() / 1000)
 
-                else:
-                    # Fetch the ICMP type and code from the received packet
-                    icmpType, icmpCode = recvPacket[20:22]
-
-                    if icmpType == 11:                          # Time Exceeded
-                        print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    %s" %
-                                (
-                                    self.getTtl(),
-                                    (timeReceived - pingStartTime) * 1000,
-                                    icmpType,
-                                    icmpCode,
-                                    addr[0]
-                                )
-                              , end=" ")
-                        print(f' {IcmpHelperLibrary.icmpCodes[icmpType][icmpCode]}')
-                        IcmpHelperLibrary.recv_packets += 1
-
-                    elif icmpType == 3:                         # Destination Unreachable
-                        print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    %s" %
-                                  (
-                                      self.getTtl(),
-                                      (timeReceived - pingStartTime) * 1000,
-                                      icmpType,
-                                      icmpCode,
-                                      addr[0]
-                                  )
-                              , end=" '")
-
-                        print(f' {IcmpHelperLibrary.icmpCodes[icmpType][icmpCode]}')
-                        IcmpHelperLibrary.recv_packets += 1
-
-                    elif icmpType == 0:                         # Echo Reply
-                        icmpReplyPacket = IcmpHelperLibrary.IcmpPacket_EchoReply(recvPacket)
-                        self.__validateIcmpReplyPacketWithOriginalPingData(icmpReplyPacket)
-                        icmpReplyPacket.printResultToConsole(self, self.getTtl(), timeReceived, addr)
-                        IcmpHelperLibrary.recv_packets += 1
-                        return icmpType     # Echo reply is the end and therefore should return
+                recvPacket = probe.getReplyPacket()     # recvPacket - bytes object representing data received
+                addr = probe.getResponderAddress()      # addr  - address of socket sending data
+                pingStartTime = probe.getTimeSent()
+                timeReceived = probe.getTimeReceived()
 
-                    else:
-                        print("error")
-            except timeout:
-                print(" " * len(ping_msg), end=" ")
-                print("  *        *        *        *        *      Request timed out (By Exception).")
+                # Fetch the ICMP type and code from the received packet
+                icmpType = probe.getIcmpType()
+                icmpCode = probe.getIcmpCode()
+
+                if icmpType == 11:                          # Time Exceeded
+                    print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    %s" %
+                            (
+                                self.getTtl(),
+                                (timeReceived - pingStartTime) * 1000,
+                                icmpType,
+                                icmpCode,
+                                addr[0]
+                            )
+                          , end=" ")
+                    print(f' {IcmpHelperLibrary.icmpCodes[icmpType][icmpCode]}')
+
+                elif icmpType == 3:                         # Destination Unreachable
+                    print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d    %s" %
+                              (
+                                  self.getTtl(),
+                                  (timeReceived - pingStartTime) * 1000,
+                                  icmpType,
+                                  icmpCode,
+                                  addr[0]
+                              )
+                          , end=" '")
+
+                    print(f' {IcmpHelperLibrary.icmpCodes[icmpType][icmpCode]}')
+
+                elif icmpType == 0:                         # Echo Reply
+                    icmpReplyPacket = IcmpHelperLibrary.IcmpPacket_EchoReply(recvPacket)
+                    self.__validateIcmpReplyPacketWithOriginalPingData(icmpReplyPacket)
+                    icmpReplyPacket.printResultToConsole(self, self.getTtl(), timeReceived, addr, probe.getRtt())
+                    if statistics is not None:
+                        statistics.recordRtt(probe.getRtt())
+                    return icmpType     # Echo reply is the end and therefore should return
+
+                else:
+                    print("error")
+                return icmpType
             finally:
-                mySocket.close()
+                if ownsProbeEngine:
+                    probeEngine.close()
+
+        def updatePacketSequenceNumber(self, sequenceNumber):
+            # Changes the sequence number of a built packet, adjusting the checksum instead of recalculating it
+            checksum = IcmpHelperLibrary.IcmpChecksum.update(self.getPacketChecksum(),
+                                                             self.getPacketSequenceNumber(),
+                                                             sequenceNumber)
+            self.setPacketSequenceNumber(sequenceNumber)
+            self.setPacketChecksum(checksum)
+            self.__packHeader()
+
+        def updateTimestamp(self):
+            # Restamps a built packet with the current time, adjusting the checksum instead of recalculating it
+            data_time = struct.pack("d", time.time())
+            checksum = IcmpHelperLibrary.IcmpChecksum.updateField(self.getPacketChecksum(), self.__data[:8], data_time)
+            self.__data = data_time + self.__data[8:]
+            self.setPacketChecksum(checksum)
+            self.__packHeader()
 
         def printIcmpPacketHeader_hex(self):
             print("Header Size: ", len(self.__header))
@@ -293,6 +690,89 @@ class IcmpHelperLibrary:
             self.printIcmpPacketHeader_hex()
             self.printIcmpPacketData_hex()
 
+    # ################################################################################################################ #
+    # Class IcmpEchoRequestTemplate                                                                                    #
+    #                                                                                                                  #
+    # A preallocated echo request. The type, code and payload never change, so their part of the checksum is summed    #
+    # once; each probe only patches the identifier, sequence number, timestamp and checksum in place.                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpEchoRequestTemplate:
+        # ############################################################################################################ #
+        # IcmpEchoRequestTemplate Class Scope Variables                                                                #
+        # ############################################################################################################ #
+        defaultPayload = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+        __headerStruct = struct.Struct("!BBHHH")        # Type, code, checksum, identifier, sequence number
+        __checksumStruct = struct.Struct("!H")
+        __probeIdStruct = struct.Struct("!HH")          # Identifier, sequence number
+        __timestampStruct = struct.Struct("d")          # Same encoding IcmpPacket uses for the send time
+        __timestampWordsStruct = struct.Struct("!Q")    # The timestamp bytes read back as words for the checksum
+
+        # ############################################################################################################ #
+        # IcmpEchoRequestTemplate Constructors                                                                         #
+        # ############################################################################################################ #
+        def __init__(self, payload=None, payloadSize=None):
+            # payloadSize repeats or truncates the payload pattern to the given number of bytes
+            payload = IcmpHelperLibrary.IcmpEchoRequestTemplate.defaultPayload if payload is None else bytes(payload)
+            if payloadSize is not None:
+                if payloadSize > 0 and len(payload) == 0:
+                    raise ValueError("An empty payload pattern cannot fill payloadSize bytes")
+                payload = (payload * (payloadSize // max(len(payload), 1) + 1))[:payloadSize]
+
+            self.__payload = payload
+            self.__packet = bytearray(16 + len(payload))
+            self.__headerStruct.pack_into(self.__packet, 0, 8, 0, 0, 0, 0)
+            self.__packet[16:] = payload
+
+            # Sum of every word that stays the same between probes (identifier, sequence and timestamp are zero here)
+            self.__constantSum = int.from_bytes(self.__packet + (b'\x00' if len(self.__packet) & 1 else b''), "big")
+            self.__isPayloadPatched = False     # Set while the first payload word holds a checksum compensation
+
+        # ############################################################################################################ #
+        # IcmpEchoRequestTemplate Getters                                                                              #
+        # ############################################################################################################ #
+        def getPayload(self):
+            return self.__payload
+
+        def getPacketSize(self):
+            return len(self.__packet)
+
+        # ############################################################################################################ #
+        # IcmpEchoRequestTemplate Public Functions                                                                     #
+        # ############################################################################################################ #
+        def prepare(self, identifier, sequenceNumber, timeSent, instrumentation=None, checksum=None):
+            # Patches the template for one probe and returns the shared buffer; it is only valid until the next call.
+            # instrumentation is an optional IcmpInstrumentation that times the checksum update.
+            #
+            # checksum forces the packet's checksum to the given value (anything but 0xffff) by overwriting the first
+            # payload word after the timestamp. Load balancers hash ICMP flows on the type, code and checksum, so
+            # probes sharing a checksum follow one path whatever their identifier and sequence number.
+            packet = self.__packet
+            self.__probeIdStruct.pack_into(packet, 4, identifier, sequenceNumber)
+            self.__timestampStruct.pack_into(packet, 8, timeSent)
+
+            if instrumentation is not None:
+                checksumStart = time.perf_counter_ns()
+            total = (self.__constantSum + identifier + sequenceNumber
+                     + self.__timestampWordsStruct.unpack_from(packet, 8)[0])
+            if checksum is None:
+                if self.__isPayloadPatched:
+                    packet[16:18] = self.__payload[:2]
+                    self.__isPayloadPatched = False
+                self.__checksumStruct.pack_into(packet, 2, IcmpHelperLibrary.IcmpChecksum.finish(total))
+            else:
+                if len(self.__payload) < 2 or not 0 <= checksum < 0xffff:
+                    raise ValueError("A fixed checksum needs a payload of 2 bytes or more and a value below 0xffff")
+                # The word that brings the one's complement sum to ~checksum, with the original word taken out
+                total -= int.from_bytes(self.__payload[:2], "big")
+                self.__checksumStruct.pack_into(packet, 16, ((~checksum & 0xffff) - total) % 0xffff)
+                self.__isPayloadPatched = True
+                self.__checksumStruct.pack_into(packet, 2, checksum)
+            if instrumentation is not None:
+                instrumentation.recordStage("checksum", time.perf_counter_ns() - checksumStart)
+            return packet
+
     # ################################################################################################################ #
     # Class IcmpPacket_EchoReply                                                                                       #
     #                                                                                                                  #
@@ -304,14 +784,20 @@ class IcmpHelperLibrary:
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Class Scope Variables                                                                   #
         # ############################################################################################################ #
-        __recvPacket = b''
+        __slots__ = ("__recvPacket", "__ipHeaderLength", "__header",
+                     "__isValidResponse", "__isValidSequenceNum", "__isValidIcmpIdentifier", "__isValidRawData")
 
+        __icmpHeaderStruct = struct.Struct("!BBHHH")    # Type, code, checksum, identifier, sequence number
+        __timeSentStruct = struct.Struct("d")           # Encoded the same way IcmpPacket stores it
 
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Constructors                                                                            #
         # ############################################################################################################ #
         def __init__(self, recvPacket):
+            # recvPacket is the whole IP datagram; any bytes-like object works, including a memoryview
             self.__recvPacket = recvPacket
+            self.__ipHeaderLength = (recvPacket[0] & 0x0f) * 4     # IHL counts 32 bit words; options make it > 20
+            self.__header = None                                    # Parsed on first use
             self.__isValidResponse = False
             self.__isValidSequenceNum = False
             self.__isValidIcmpIdentifier = False
@@ -320,54 +806,35 @@ class IcmpHelperLibrary:
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Getters                                                                                 #
         # ############################################################################################################ #
-        def getIcmpType(self):
-            # Method 1
-            # bytes = struct.calcsize("B")        # Format code B is 1 byte
-            # return struct.unpack("!B", self.__recvPacket[20:20 + bytes])[0]
+        def getIpHeaderLength(self):
+            return self.__ipHeaderLength
 
-            # Method 2
-            return self.__unpackByFormatAndPosition("B", 20)
+        def getIcmpType(self):
+            return self.__parseHeader()[0]
 
         def getIcmpCode(self):
-            # Method 1
-            # bytes = struct.calcsize("B")        # Format code B is 1 byte
-            # return struct.unpack("!B", self.__recvPacket[21:21 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("B", 21)
+            return self.__parseHeader()[1]
 
         def getIcmpHeaderChecksum(self):
-            # Method 1
-            # bytes = struct.calcsize("H")        # Format code H is 2 bytes
-            # return struct.unpack("!H", self.__recvPacket[22:22 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("H", 22)
+            return self.__parseHeader()[2]
 
         def getIcmpIdentifier(self):
-            # Method 1
-            # bytes = struct.calcsize("H")        # Format code H is 2 bytes
-            # return struct.unpack("!H", self.__recvPacket[24:24 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("H", 24)
+            return self.__parseHeader()[3]
 
         def getIcmpSequenceNumber(self):
-            # Method 1
-            # bytes = struct.calcsize("H")        # Format code H is 2 bytes
-            # return struct.unpack("!H", self.__recvPacket[26:26 + bytes])[0]
-
-            # Method 2
-            return self.__unpackByFormatAndPosition("H", 26)
+            return self.__parseHeader()[4]
 
         def getDateTimeSent(self):
-            # This accounts for bytes 28 through 35 = 64 bits
-            return self.__unpackByFormatAndPosition("d", 28)   # Used to track overall round trip time
-                                                               # time.time() creates a 64 bit value of 8 bytes
+            # The 8 bytes after the ICMP header; time.time() creates a 64 bit value of 8 bytes
+            return self.__timeSentStruct.unpack_from(self.__recvPacket, self.__ipHeaderLength + 8)[0]
+
+        def getIcmpDataBytes(self):
+            # Payload after the timestamp, as raw bytes
+            return bytes(self.__recvPacket[self.__ipHeaderLength + 16:])
 
         def getIcmpData(self):
-            # This accounts for bytes 36 to the end of the packet.
-            return self.__recvPacket[36:].decode('utf-8')
+            # Payload after the timestamp, decoded for display
+            return self.getIcmpDataBytes().decode('utf-8', errors='replace')
 
         def isValidResponse(self):
             return self.__isValidResponse
@@ -399,18 +866,20 @@ class IcmpHelperLibrary:
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Private Functions                                                                       #
         # ############################################################################################################ #
-        def __unpackByFormatAndPosition(self, formatCode, basePosition):
-            numberOfbytes = struct.calcsize(formatCode)
-            return struct.unpack("!" + formatCode, self.__recvPacket[basePosition:basePosition + numberOfbytes])[0]
+        def __parseHeader(self):
+            # All five header fields are unpacked together the first time any of them is needed
+            if self.__header is None:
+                self.__header = self.__icmpHeaderStruct.unpack_from(self.__recvPacket, self.__ipHeaderLength)
+            return self.__header
 
         # ############################################################################################################ #
         # IcmpPacket_EchoReply Public Functions                                                                        #
         # ############################################################################################################ #
-        def printResultToConsole(self, sentPack, ttl, timeReceived, addr):
-            bytes = struct.calcsize("d")
-            timeSent = struct.unpack("d", self.__recvPacket[28:28 + bytes])[0]
-            rtt = (timeReceived - timeSent) * 1000
-            IcmpHelperLibrary.roundTripTimes.append(rtt)    # Adding the round trip time to our list for tracking
+        def printResultToConsole(self, sentPack, ttl, timeReceived, addr, rtt=None):
+            # Without a measured rtt, it is worked out from the wall clock send time carried in the payload
+            if rtt is None:
+                timeSent = self.getDateTimeSent()
+                rtt = (timeReceived - timeSent) * 1000
 
             print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d        Identifier=%d    Sequence Number=%d    %s" %
                   (
@@ -437,112 +906,3790 @@ class IcmpHelperLibrary:
                     print(f'  [Invalid Raw Data]: Received: {self.getIcmpData()} Expected: {sentPack.getDataRaw()}')
 
     # ################################################################################################################ #
-    # Class IcmpHelperLibrary                                                                                          #
+    # Class IcmpProbe                                                                                                  #
+    #                                                                                                                  #
+    # One echo request handed to an IcmpProbeEngine. The engine fills in the response when it arrives.                 #
+    #                                                                                                                  #
     # ################################################################################################################ #
+    class IcmpProbe:
+        # ############################################################################################################ #
+        # IcmpProbe Class Scope Variables                                                                              #
+        # ############################################################################################################ #
+        __slots__ = ("__identifier", "__sequenceNumber", "__destinationIpAddress", "__ttl", "__timeSent",
+                     "__timeReceived", "__replyPacket", "__responderAddress", "__icmpType", "__icmpCode")
 
-    # ################################################################################################################ #
-    # IcmpHelperLibrary Class Scope Variables                                                                          #
-    # ################################################################################################################ #
-    __DEBUG_IcmpHelperLibrary = False               # Allows for debug output
-    roundTripTimes = []                             # List we are going to use to track the RTT to get min/max/avg
-    sent_packets = 0                                # Used for packet loss tracking # of sent packets
-    recv_packets = 0                                # Used for packet loss tracking # of received packets
+        # ############################################################################################################ #
+        # IcmpProbe Constructors                                                                                       #
+        # ############################################################################################################ #
+        def __init__(self, identifier, sequenceNumber, destinationIpAddress, ttl, timeSent):
+            self.__identifier = identifier
+            self.__sequenceNumber = sequenceNumber
+            self.__destinationIpAddress = destinationIpAddress
+            self.__ttl = ttl
+            self.__timeSent = timeSent
+            self.__timeReceived = None
+            self.__replyPacket = None
+            self.__responderAddress = None
+            self.__icmpType = None
+            self.__icmpCode = None
 
-    # Reference: https://www.iana.org/assignments/icmp-parameters/icmp-parameters.xhtml
-    icmpCodes = {
-        3 : {
-            0 : 'Net Unreachable',
-            1 : 'Host Unreachable',
-            2 : 'Protocol Unreachable',
-            3 : 'Port Unreachable',
-            4 : 'Fragmentation Needed and Don\'t Fragment was Set',
-            5 : 'Source Route Failed',
-            6 : 'Destination Network Unknown',
-            7 : 'Destination Host Unknown',
-            8 : 'Source Host Isolated',
-            9 : 'Communication with Destination Network is Administratively Prohibited',
-            10 : 'Communication with Destination Host is Administratively Prohibited',
-            11 : 'Destination Network Unreachable for Type of Service',
-            12 : 'Destination Host Unreachable for Type of Service',
-            13 : 'Communication Administratively Prohibited',
-            14 : 'Host Precedence Violation',
-            15 : 'Precedence cutoff in effect'
-        },
-        11 : {
-            0 : 'Time to Live exceeded in Transit',
-            1 : 'Fragment Reassembly Time Exceeded'
-        }
-    }
+        # ############################################################################################################ #
+        # IcmpProbe Getters                                                                                            #
+        # ############################################################################################################ #
+        def getIdentifier(self):
+            return self.__identifier
+
+        def getSequenceNumber(self):
+            return self.__sequenceNumber
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getTtl(self):
+            return self.__ttl
+
+        def getTimeSent(self):
+            return self.__timeSent
+
+        def getTimeReceived(self):
+            return self.__timeReceived
+
+        def getReplyPacket(self):
+            return self.__replyPacket
+
+        def getResponderAddress(self):
+            return self.__responderAddress
+
+        def getIcmpType(self):
+            return self.__icmpType
+
+        def getIcmpCode(self):
+            return self.__icmpCode
+
+        def getEchoReply(self):
+            # Wraps the reply in an IcmpPacket_EchoReply on request; None unless an echo reply was received
+            if self.__icmpType != 0:
+                return None
+            return IcmpHelperLibrary.IcmpPacket_EchoReply(self.__replyPacket)
+
+        def getRtt(self):
+            # Round trip time in milliseconds, or None while no response has been received
+            if self.__timeReceived is None:
+                return None
+            return (self.__timeReceived - self.__timeSent) * 1000
+
+        def isComplete(self):
+            return self.__timeReceived is not None
+
+        # ############################################################################################################ #
+        # IcmpProbe Public Functions                                                                                   #
+        # ############################################################################################################ #
+        def complete(self, replyPacket, responderAddress, icmpType, icmpCode, timeReceived):
+            self.__replyPacket = replyPacket
+            self.__responderAddress = responderAddress
+            self.__icmpType = icmpType
+            self.__icmpCode = icmpCode
+            self.__timeReceived = timeReceived
 
     # ################################################################################################################ #
-    # IcmpHelperLibrary Private Functions                                                                              #
+    # Class IcmpProbeEngine                                                                                            #
+    #                                                                                                                  #
+    # Owns a single raw ICMP socket for its whole lifetime. Identifiers are reserved per engine so that no two         #
+    # engines in this process share one, and sequence numbers are handed out so that no two outstanding probes share   #
+    # an identifier/sequence pair. Every received packet goes through one receive loop which routes it to the probe    #
+    # that is waiting for it; anything else is counted as stray and dropped.                                           #
+    #                                                                                                                  #
     # ################################################################################################################ #
-    def __sendIcmpEchoRequest(self, host):
-        print("sendIcmpEchoRequest Started...") if self.__DEBUG_IcmpHelperLibrary else 0
+    class IcmpProbeEngine:
+        # ############################################################################################################ #
+        # IcmpProbeEngine Class Scope Variables                                                                        #
+        # ############################################################################################################ #
+        __identifierLock = threading.Lock()
+        __identifiersInUse = set()              # Identifiers reserved by live engines in this process
+        __recvBufferSize = 65535
+        __probeIdStruct = struct.Struct("!HH")          # Identifier, sequence number
+        __timespecStruct = struct.Struct("ll")          # struct timespec carried by SCM_TIMESTAMPNS
+        __ipHeaderStruct = struct.Struct("!BBHHHBBH4s4s")
+        __extendedErrorStruct = struct.Struct("=IBBBBII")   # struct sock_extended_err
+        __bpfInstructionStruct = struct.Struct("HBBI")      # struct sock_filter
+        __ancillaryBufferSize = 256
+        __socketReceiveBufferSize = 4 * 1024 * 1024     # Room for a burst of replies queued while we are sending
+        __lateReplyWindow = 4096                        # Given-up probes remembered to tell late replies from strays
 
-        for i in range(4):
-            # Build packet
-            icmpPacket = IcmpHelperLibrary.IcmpPacket()
+        # Linux socket option values the socket module does not export
+        __SO_TIMESTAMPNS = 35
+        __SO_ATTACH_FILTER = 26
+        __SOL_RAW = 255
+        __ICMP_FILTER = 1
+        __IP_RECVERR = 11
+        __SO_EE_ORIGIN_ICMP = 2
+
+        # ############################################################################################################ #
+        # IcmpProbeEngine Constructors                                                                                 #
+        # ############################################################################################################ #
+        def __init__(self, identifierCount=1, payload=None, payloadSize=None, kernelTimestamps=False,
+                     datagramSocket=False, kernelFilter=True, identifiers=None, transport=None, instrumentation=None,
+                     capture=None):
+            # Probe send and receive times are time.monotonic() values. With kernelTimestamps the receive time is
+            # the kernel's SO_TIMESTAMPNS stamp instead of the moment Python got around to reading the packet.
+            #
+            # datagramSocket uses an unprivileged SOCK_DGRAM ICMP socket (Linux, see net.ipv4.ping_group_range)
+            # instead of SOCK_RAW. The kernel then picks the identifier and only delivers replies carrying it, so
+            # identifierCount does not apply. With a raw socket, kernelFilter installs ICMP_FILTER and a BPF program
+            # so the kernel drops packets that cannot belong to this engine before they wake the process.
+            #
+            # identifiers lists the exact identifiers to use instead of identifierCount picked from the pid, e.g. so
+            # worker processes can be given disjoint ranges. Keeping them contiguous keeps the kernel filter tight.
+            #
+            # transport replaces the raw socket with any object offering the calls made on it here (sendto,
+            # recvfrom_into, setsockopt, setblocking, fileno, close) and carrying whole IP datagrams the way a raw
+            # socket does, e.g. IcmpSimulatedNetwork.createSocket().
+            #
+            # instrumentation is an optional IcmpInstrumentation timing the build, checksum, send, wait, receive and
+            # parse stages and counting sent, received, completed, stray, late and timed out probes.
+            #
+            # capture is an optional IcmpPcapWriter that records every request sent and every packet received.
+            self.__datagramSocket = datagramSocket
+            self.__instrumentation = instrumentation
+            self.__capture = capture
+            self.__cancelledProbeIds = collections.OrderedDict()   # Recently given-up keys, only kept when instrumented
+            self.__echoRequestTemplate = IcmpHelperLibrary.IcmpEchoRequestTemplate(payload, payloadSize)
+            self.__nextProbeId = 0              # Index into the identifier x sequence space
+            self.__pendingProbes = {}           # (identifier, sequenceNumber) -> IcmpProbe
+            self.__strayPackets = 0
+            self.__currentTtl = None
+            self.__eventLoop = None             # Set while the socket is registered with an asyncio event loop
+            self.__probeFutures = {}            # IcmpProbe -> asyncio.Future resolved when the probe finishes
+            self.__recvBuffer = bytearray(self.__recvBufferSize)   # Reused by every recvfrom_into()
+            self.__recvView = memoryview(self.__recvBuffer)
+
+            self.__kernelFilter = False
+            if datagramSocket:
+                self.__socket = socket(AF_INET, SOCK_DGRAM, IPPROTO_ICMP)
+                self.__socket.bind(("", 0))
+                self.__identifiers = [self.__socket.getsockname()[1]]  # The kernel rewrites every request to this
+                # Time Exceeded and Unreachable messages are only delivered through the socket error queue
+                self.__socket.setsockopt(IPPROTO_IP, self.__IP_RECVERR, 1)
+            else:
+                self.__identifiers = IcmpHelperLibrary.IcmpProbeEngine.__reserveIdentifiers(identifierCount,
+                                                                                            identifiers)
+                if transport is not None:
+                    self.__socket = transport
+                else:
+                    self.__socket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)
+                    self.__socket.bind(("", 0))
+                    if kernelFilter:
+                        self.__kernelFilter = self.__installKernelFilter()
+            self.__socket.setblocking(False)
+            self.__socket.setsockopt(SOL_SOCKET, SO_RCVBUF, self.__socketReceiveBufferSize)
 
-            randomIdentifier = (os.getpid() & 0xffff)      # Get as 16 bit number - Limit based on ICMP header standards
-                                                           # Some PIDs are larger than 16 bit
+            self.__kernelTimestamps = False
+            if kernelTimestamps:
+                try:
+                    self.__socket.setsockopt(SOL_SOCKET, self.__SO_TIMESTAMPNS, 1)
+                    self.__kernelTimestamps = True
+                except OSError:
+                    pass                        # Not supported here; receive times fall back to the monotonic clock
 
-            packetIdentifier = randomIdentifier
-            packetSequenceNumber = i
+        def __enter__(self):
+            return self
 
-            icmpPacket.buildPacket_echoRequest(packetIdentifier, packetSequenceNumber)  # Build ICMP for IP payload
-            icmpPacket.setIcmpTarget(host)
-            icmpPacket.sendEchoRequest()                                                # Build IP
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
 
-            icmpPacket.printIcmpPacketHeader_hex() if self.__DEBUG_IcmpHelperLibrary else 0
-            icmpPacket.printIcmpPacket_hex() if self.__DEBUG_IcmpHelperLibrary else 0
-            # we should be confirming values are correct, such as identifier and sequence number and data
+        # ############################################################################################################ #
+        # IcmpProbeEngine Getters                                                                                      #
+        # ############################################################################################################ #
+        def getIdentifiers(self):
+            return list(self.__identifiers)
 
-        # Calculating and displaying RTT statistics
-        min_rtt = round(min(IcmpHelperLibrary.roundTripTimes)) if IcmpHelperLibrary.roundTripTimes else 0
-        max_rtt = round(max(IcmpHelperLibrary.roundTripTimes)) if IcmpHelperLibrary.roundTripTimes else 0
-        # Reference: https://www.geeksforgeeks.org/find-average-list-python/
-        avg_rtt = round(sum(IcmpHelperLibrary.roundTripTimes) / len(IcmpHelperLibrary.roundTripTimes)) if IcmpHelperLibrary.roundTripTimes else 0
-        
-        packet_loss = ((self.sent_packets - self.recv_packets) / self.sent_packets) * 100
+        def getEchoRequestTemplate(self):
+            return self.__echoRequestTemplate
 
-        print(f'Ping Complete - Min RTT:{min_rtt} ms, Max RTT: {max_rtt} ms, Avg RTT: {avg_rtt} ms, Packet Loss: {packet_loss} %')
+        def getPendingProbeCount(self):
+            return len(self.__pendingProbes)
 
-    def __sendIcmpTraceRoute(self, host):
-        print("sendIcmpTraceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
-        # Build code for trace route here
+        def getStrayPacketCount(self):
+            return self.__strayPackets
 
-        trace_counter = 1
-        icmpType = -1
+        def getInstrumentation(self):
+            return self.__instrumentation
 
-        while icmpType != 0:
+        def getCapture(self):
+            return self.__capture
 
-            icmpPacket = IcmpHelperLibrary.IcmpPacket()
-            icmpPacket.setTtl(trace_counter)
+        def isUsingKernelTimestamps(self):
+            return self.__kernelTimestamps
 
-            packetIdentifier = (os.getpid() & 0xffff)
-            packetSequenceNumber = trace_counter
+        def isUsingKernelFilter(self):
+            return self.__kernelFilter
 
-            icmpPacket.buildPacket_echoRequest(packetIdentifier, packetSequenceNumber)
-            icmpPacket.setIcmpTarget(host)
-            icmpType = icmpPacket.sendEchoRequest()
+        def isDatagramSocket(self):
+            return self.__datagramSocket
 
-            icmpPacket.printIcmpPacketHeader_hex() if self.__DEBUG_IcmpHelperLibrary else 0
-            icmpPacket.printIcmpPacket_hex() if self.__DEBUG_IcmpHelperLibrary else 0
+        def fileno(self):
+            return self.__socket.fileno()
 
-            trace_counter += 1
-            time.sleep(2)
+        # ############################################################################################################ #
+        # IcmpProbeEngine Setters                                                                                      #
+        # ############################################################################################################ #
+        def setInstrumentation(self, instrumentation):
+            self.__instrumentation = instrumentation
+            self.__cancelledProbeIds.clear()
 
-    # ################################################################################################################ #
-    # IcmpHelperLibrary Public Functions                                                                               #
-    # ################################################################################################################ #
-    def sendPing(self, targetHost):
-        print("ping Started...") if self.__DEBUG_IcmpHelperLibrary else 0
-        self.__sendIcmpEchoRequest(targetHost)
+        def setCapture(self, capture):
+            self.__capture = capture
+
+        # ############################################################################################################ #
+        # IcmpProbeEngine Private Functions                                                                            #
+        # ############################################################################################################ #
+        @staticmethod
+        def __reserveIdentifiers(identifierCount, identifiers=None):
+            # Start from the pid so separate processes tend to pick different identifiers, then walk forward past any
+            # identifier another engine in this process already holds. Explicit identifiers must all be free.
+            engineClass = IcmpHelperLibrary.IcmpProbeEngine
+            with engineClass.__identifierLock:
+                if identifiers is not None:
+                    identifiers = [identifier & 0xffff for identifier in identifiers]
+                    for identifier in identifiers:
+                        if identifier in engineClass.__identifiersInUse:
+                            raise ValueError("ICMP identifier %d is already in use in this process" % identifier)
+                    engineClass.__identifiersInUse.update(identifiers)
+                    return identifiers
+
+                if len(engineClass.__identifiersInUse) + identifierCount > 0x10000:
+                    raise RuntimeError("No free ICMP identifiers left in this process")
+
+                identifiers = []
+                candidate = os.getpid() & 0xffff
+                while len(identifiers) < identifierCount:
+                    if candidate not in engineClass.__identifiersInUse:
+                        engineClass.__identifiersInUse.add(candidate)
+                        identifiers.append(candidate)
+                    candidate = (candidate + 1) & 0xffff
+                return identifiers
+
+        def __installKernelFilter(self):
+            # ICMP_FILTER: a bit mask of ICMP types (below 32) the raw socket should not receive
+            wantedTypes = (1 << 0) | (1 << 3) | (1 << 11)   # Echo Reply, Destination Unreachable, Time Exceeded
+            icmpFilter = struct.pack("I", ~wantedTypes & 0xffffffff)
+            try:
+                self.__socket.setsockopt(self.__SOL_RAW, self.__ICMP_FILTER, icmpFilter)
+            except OSError:
+                return False
+
+            # Classic BPF over the IP datagram: accept echo replies, and errors quoting an echo request, whose
+            # identifier falls within this engine's range. The dispatcher still checks the exact pair.
+            lowest = min(self.__identifiers)
+            highest = max(self.__identifiers)
+            program = [
+                (0xb1, 0, 0, 0),            # 0: ldxb 4*([0]&0xf)       X = IP header length
+                (0x50, 0, 0, 0),            # 1: ldb [x+0]              A = ICMP type
+                (0x15, 10, 0, 0),           # 2: jeq #0 -> 13
+                (0x15, 1, 0, 3),            # 3: jeq #3 -> 5
+                (0x15, 0, 12, 11),          # 4: jeq #11 -> 5, else reject
+                (0x50, 0, 0, 8),            # 5: ldb [x+8]              First byte of the quoted IP header
+                (0x54, 0, 0, 0x0f),         # 6: and #0xf
+                (0x64, 0, 0, 2),            # 7: lsh #2                 A = quoted IP header length
+                (0x0c, 0, 0, 0),            # 8: add x
+                (0x04, 0, 0, 8),            # 9: add #8
+                (0x07, 0, 0, 0),            # 10: tax                   X = offset of the quoted ICMP header
+                (0x50, 0, 0, 0),            # 11: ldb [x+0]
+                (0x15, 0, 4, 8),            # 12: jeq #8, else reject   Quoted packet must be an echo request
+                (0x48, 0, 0, 4),            # 13: ldh [x+4]             A = identifier
+                (0x35, 0, 2, lowest),       # 14: jge #lowest, else reject
+                (0x25, 1, 0, highest),      # 15: jgt #highest -> reject
+                (0x06, 0, 0, 0xffff),       # 16: ret #0xffff           accept
+                (0x06, 0, 0, 0),            # 17: ret #0                reject
+            ]
+            instructions = b''.join(self.__bpfInstructionStruct.pack(*instruction) for instruction in program)
+            instructionBuffer = ctypes.create_string_buffer(instructions)
+            socketFilterProgram = struct.pack("HL", len(program), ctypes.addressof(instructionBuffer))  # sock_fprog
+            try:
+                self.__socket.setsockopt(SOL_SOCKET, self.__SO_ATTACH_FILTER, socketFilterProgram)
+            except OSError:
+                pass                    # ICMP_FILTER alone still drops other processes' echo requests
+            return True
+
+        def __synthesizeIpHeader(self, sourceAddress, destinationAddress, payloadLength):
+            # Datagram sockets strip the IP header; a minimal one is rebuilt so replies look the same in either mode
+            return self.__ipHeaderStruct.pack(0x45, 0, 20 + payloadLength, 0, 0, 0, IPPROTO_ICMP, 0,
+                                              inet_aton(sourceAddress), inet_aton(destinationAddress))
+
+        @staticmethod
+        def __parseIcmpResponse(recvBuffer, nbytes):
+            # Returns (icmpType, icmpCode, identifier, sequenceNumber) for a received IP datagram. For error messages
+            # (Destination Unreachable / Time Exceeded) the identifier and sequence number are taken from the original
+            # echo request quoted inside the error, which is how the response is mapped back to its probe.
+            engineClass = IcmpHelperLibrary.IcmpProbeEngine
+            ipHeaderLength = (recvBuffer[0] & 0x0f) * 4
+            if nbytes < ipHeaderLength + 8:
+                return None
+
+            icmpType = recvBuffer[ipHeaderLength]
+            if icmpType == 3 or icmpType == 11:
+                # Error payload: 8 byte ICMP header, then the original IP header, then the first 8 bytes of the request
+                quotedIpStart = ipHeaderLength + 8
+                if nbytes < quotedIpStart + 1:
+                    return None
+                quotedIcmpStart = quotedIpStart + (recvBuffer[quotedIpStart] & 0x0f) * 4
+                if nbytes < quotedIcmpStart + 8 or recvBuffer[quotedIcmpStart] != 8:
+                    return None         # Quoted packet is not an echo request
+                identifier, sequenceNumber = engineClass.__probeIdStruct.unpack_from(recvBuffer, quotedIcmpStart + 4)
+            elif icmpType == 0:
+                identifier, sequenceNumber = engineClass.__probeIdStruct.unpack_from(recvBuffer, ipHeaderLength + 4)
+            else:
+                return None             # Includes our own echo requests when probing the loopback
+
+            return icmpType, recvBuffer[ipHeaderLength + 1], identifier, sequenceNumber
+
+        def __sendProbe(self, packet, key, destinationIpAddress, ttl):
+            if ttl != self.__currentTtl:
+                self.__socket.setsockopt(IPPROTO_IP, IP_TTL, struct.pack('I', ttl))  # Unsigned int - 4 bytes
+                self.__currentTtl = ttl
+
+            probe = IcmpHelperLibrary.IcmpProbe(key[0], key[1], destinationIpAddress, ttl, time.monotonic())
+            self.__pendingProbes[key] = probe
+            instrumentation = self.__instrumentation
+            if instrumentation is not None:
+                sendStart = time.perf_counter_ns()
+            try:
+                self.__socket.sendto(packet, (destinationIpAddress, 0))
+            except OSError:
+                del self.__pendingProbes[key]
+                raise
+            if instrumentation is not None:
+                instrumentation.recordStage("send", time.perf_counter_ns() - sendStart)
+                instrumentation.increment("sent")
+                self.__cancelledProbeIds.pop(key, None)
+            if self.__capture is not None:
+                self.__capture.writeSent(probe.getTimeSent(), destinationIpAddress, ttl, packet)
+            return probe
+
+        def __countUnmatched(self, key):
+            # A packet that completes no probe. When instrumented, a reply to a probe given up on recently is counted
+            # as late rather than stray.
+            self.__strayPackets += 1
+            instrumentation = self.__instrumentation
+            if instrumentation is not None:
+                if key is not None and self.__cancelledProbeIds.pop(key, False):
+                    instrumentation.increment("late")
+                else:
+                    instrumentation.increment("stray")
+
+        def __dispatch(self, nbytes, addr, timeReceived):
+            # Parses the packet straight out of the receive buffer; only a packet that completes a probe is copied
+            if self.__datagramSocket:
+                # Only echo replies carrying our identifier arrive here, starting at the ICMP header
+                if nbytes < 8 or self.__recvBuffer[0] != 0:
+                    self.__countUnmatched(None)
+                    return None
+                response = (0, self.__recvBuffer[1]) + self.__probeIdStruct.unpack_from(self.__recvBuffer, 4)
+            else:
+                response = self.__parseIcmpResponse(self.__recvBuffer, nbytes)
+                if response is None:
+                    self.__countUnmatched(None)
+                    return None
+
+            icmpType, icmpCode, identifier, sequenceNumber = response
+            probe = self.__pendingProbes.pop((identifier, sequenceNumber), None)
+            if probe is None:
+                self.__countUnmatched((identifier, sequenceNumber))  # Another process' reply, or one we gave up on
+                return None
+
+            replyPacket = bytes(self.__recvView[:nbytes])
+            if self.__datagramSocket:
+                replyPacket = self.__synthesizeIpHeader(addr[0], "0.0.0.0", nbytes) + replyPacket
+            probe.complete(replyPacket, (addr[0], 0), icmpType, icmpCode, timeReceived)
+            return probe
+
+        def __dispatchQueuedError(self, nbytes, ancdata, timeReceived):
+            # A datagram socket reports Time Exceeded / Unreachable on its error queue: the data is the echo request
+            # we sent and the ancillary data says which router answered with which type and code.
+            for level, messageType, data in ancdata:
+                if level != IPPROTO_IP or messageType != self.__IP_RECVERR:
+                    continue
+                errno, origin, icmpType, icmpCode, pad, info, extra = self.__extendedErrorStruct.unpack_from(data)
+                if origin != self.__SO_EE_ORIGIN_ICMP or nbytes < 8:
+                    break
+                responderAddress = inet_ntoa(data[self.__extendedErrorStruct.size + 4:
+                                                  self.__extendedErrorStruct.size + 8])   # sockaddr_in.sin_addr
+
+                key = self.__probeIdStruct.unpack_from(self.__recvBuffer, 4)
+                probe = self.__pendingProbes.pop(key, None)
+                if probe is None:
+                    self.__countUnmatched(key)
+                    return None
+
+                # Rebuilt as the IP datagram a raw socket would have seen: error header, quoted IP header, request
+                originalRequest = bytes(self.__recvView[:nbytes])
+                replyPacket = b''.join([
+                    self.__synthesizeIpHeader(responderAddress, "0.0.0.0", 8 + 20 + nbytes),
+                    struct.pack("!BBHI", icmpType, icmpCode, 0, 0),
+                    self.__synthesizeIpHeader("0.0.0.0", probe.getDestinationIpAddress(), nbytes),
+                    originalRequest
+                ])
+                probe.complete(replyPacket, (responderAddress, 0), icmpType, icmpCode, timeReceived)
+                if self.__capture is not None:
+                    self.__capture.writePacket(timeReceived, replyPacket)
+                return probe
+
+            self.__countUnmatched(None)
+            return None
+
+        def __drain(self):
+            # Reads every packet already queued on the non-blocking socket and returns the probes they completed
+            completedProbes = []
+            instrumentation = self.__instrumentation
+            if self.__kernelTimestamps:
+                # Kernel stamps are wall clock; they are moved onto the monotonic clock with an offset sampled once
+                # per batch, so a wall clock jump only matters if it lands between the kernel stamp and this read.
+                clockOffset = time.time() - time.monotonic()
+            while True:
+                if self.__datagramSocket:
+                    try:
+                        nbytes, ancdata, flags, addr = self.__socket.recvmsg_into([self.__recvBuffer],
+                                                                                  self.__ancillaryBufferSize,
+                                                                                  MSG_ERRQUEUE)
+                        timeReceived = self.__getKernelReceiveTime(ancdata, clockOffset) \
+                            if self.__kernelTimestamps else time.monotonic()
+                        probe = self.__dispatchQueuedError(nbytes, ancdata, timeReceived)
+                        if probe is not None:
+                            completedProbes.append(probe)
+                        if instrumentation is not None:
+                            instrumentation.increment("received")
+                        continue
+                    except (BlockingIOError, InterruptedError):
+                        pass            # Error queue is empty; read ordinary replies
+                try:
+                    if instrumentation is not None:
+                        receiveStart = time.perf_counter_ns()
+                    if self.__kernelTimestamps:
+                        nbytes, ancdata, flags, addr = self.__socket.recvmsg_into([self.__recvBuffer],
+                                                                                  self.__ancillaryBufferSize)
+                        timeReceived = self.__getKernelReceiveTime(ancdata, clockOffset)
+                    else:
+                        nbytes, addr = self.__socket.recvfrom_into(self.__recvBuffer)
+                        timeReceived = time.monotonic()
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    if self.__datagramSocket:
+                        continue        # A pending ICMP error is reported once here; its details are on the error queue
+                    raise
+                if self.__capture is not None:
+                    self.__captureReceived(nbytes, addr, timeReceived)
+                if instrumentation is None:
+                    probe = self.__dispatch(nbytes, addr, timeReceived)
+                else:
+                    parseStart = time.perf_counter_ns()
+                    instrumentation.recordStage("receive", parseStart - receiveStart)
+                    probe = self.__dispatch(nbytes, addr, timeReceived)
+                    instrumentation.recordStage("parse", time.perf_counter_ns() - parseStart)
+                    instrumentation.increment("received")
+                if probe is not None:
+                    completedProbes.append(probe)
+
+            if instrumentation is not None and completedProbes:
+                instrumentation.increment("completed", len(completedProbes))
+            if self.__probeFutures:
+                for probe in completedProbes:
+                    self.__resolveProbeFuture(probe)
+            return completedProbes
+
+        def __captureReceived(self, nbytes, addr, timeReceived):
+            if self.__datagramSocket:
+                self.__capture.writePacket(timeReceived, self.__synthesizeIpHeader(addr[0], "0.0.0.0", nbytes)
+                                           + self.__recvView[:nbytes])
+            elif nbytes <= 20 or self.__recvBuffer[(self.__recvBuffer[0] & 0x0f) * 4] != 8:
+                self.__capture.writePacket(timeReceived, self.__recvView[:nbytes])
+            # Otherwise it is one of our own echo requests looped back, already captured when it was sent
+
+        def __getKernelReceiveTime(self, ancdata, clockOffset):
+            for level, messageType, data in ancdata:
+                if level == SOL_SOCKET and messageType == self.__SO_TIMESTAMPNS:
+                    seconds, nanoseconds = self.__timespecStruct.unpack_from(data)
+                    return seconds + nanoseconds / 1e9 - clockOffset
+            return time.monotonic()
+
+        def __resolveProbeFuture(self, probe):
+            probeFuture = self.__probeFutures.pop(probe, None)
+            if probeFuture is not None and not probeFuture.done():
+                probeFuture.set_result(probe)
+
+        # ############################################################################################################ #
+        # IcmpProbeEngine Public Functions                                                                             #
+        # ############################################################################################################ #
+        def allocateProbeId(self):
+            # Returns an (identifier, sequenceNumber) pair that no outstanding probe of this engine is using
+            identifierCount = len(self.__identifiers)
+            for attempt in range(identifierCount * 0x10000):
+                probeId = self.__nextProbeId
+                self.__nextProbeId = (probeId + 1) % (identifierCount * 0x10000)
+                key = (self.__identifiers[probeId >> 16], probeId & 0xffff)
+                if key not in self.__pendingProbes:
+                    return key
+            raise RuntimeError("Every identifier/sequence pair of this engine is in flight")
+
+        def sendPacket(self, icmpPacket):
+            # Sends an already built echo request and registers it so its response can be routed back
+            key = (icmpPacket.getPacketIdentifier(), icmpPacket.getPacketSequenceNumber())
+            if key in self.__pendingProbes:
+                raise ValueError("Identifier %d / sequence %d is already in flight" % key)
+            if self.__datagramSocket and key[0] not in self.__identifiers:
+                raise ValueError("A datagram socket can only send identifier %d" % self.__identifiers[0])
+
+            return self.__sendProbe(icmpPacket.getPacketBytes(), key, icmpPacket.getDestinationIpAddress(),
+                                    icmpPacket.getTtl())
+
+        def sendEchoRequest(self, destinationIpAddress, ttl=255, checksum=None):
+            # Sends an echo request with a fresh identifier/sequence pair. The packet is patched into the engine's
+            # preallocated template, so nothing is built or allocated per probe apart from the send itself. checksum
+            # pins the ICMP checksum, and with it the load-balanced path, as IcmpEchoRequestTemplate.prepare does.
+            key = self.allocateProbeId()
+            instrumentation = self.__instrumentation
+            if instrumentation is None:
+                packet = self.__echoRequestTemplate.prepare(key[0], key[1], time.time(), checksum=checksum)
+            else:
+                buildStart = time.perf_counter_ns()
+                packet = self.__echoRequestTemplate.prepare(key[0], key[1], time.time(), instrumentation, checksum)
+                instrumentation.recordStage("build", time.perf_counter_ns() - buildStart)
+            return self.__sendProbe(packet, key, destinationIpAddress, ttl)
+
+        def receive(self, timeout):
+            # Waits up to timeout seconds for the socket to become readable, then drains every queued packet through
+            # the dispatcher. Returns the probes completed by this call.
+            if self.__instrumentation is None:
+                whatReady = select.select([self.__socket], [], [], max(timeout, 0))
+            else:
+                waitStart = time.perf_counter_ns()
+                whatReady = select.select([self.__socket], [], [], max(timeout, 0))
+                self.__instrumentation.recordStage("wait", time.perf_counter_ns() - waitStart)
+            if whatReady[0] == []:  # Timeout
+                return []
+            return self.__drain()
+
+        def waitFor(self, probes, timeout):
+            # Runs the receive loop until every given probe has completed or the timeout expires. Probes still
+            # outstanding at the deadline are given up on so their identifier/sequence pairs can be reused.
+            deadline = time.monotonic() + timeout
+            while not all(probe.isComplete() for probe in probes):
+                timeLeft = deadline - time.monotonic()
+                if timeLeft <= 0:
+                    break
+                self.receive(timeLeft)
+
+            for probe in probes:
+                if not probe.isComplete():
+                    self.cancel(probe)
+
+        def cancel(self, probe):
+            key = (probe.getIdentifier(), probe.getSequenceNumber())
+            if self.__pendingProbes.get(key) is probe:
+                del self.__pendingProbes[key]
+                if self.__instrumentation is not None:
+                    self.__instrumentation.increment("timedOut")
+                    self.__cancelledProbeIds[key] = True
+                    if len(self.__cancelledProbeIds) > self.__lateReplyWindow:
+                        self.__cancelledProbeIds.popitem(last=False)
+            self.__resolveProbeFuture(probe)   # Wakes any coroutine waiting on it; the probe stays incomplete
+
+        def attachEventLoop(self, eventLoop):
+            # Registers the socket with an asyncio event loop so replies are dispatched from its reader callback
+            if self.__eventLoop is eventLoop:
+                return
+            if self.__eventLoop is not None:
+                self.detachEventLoop()
+            eventLoop.add_reader(self.__socket.fileno(), self.__drain)
+            self.__eventLoop = eventLoop
+
+        def detachEventLoop(self):
+            if self.__eventLoop is None:
+                return
+            if not self.__eventLoop.is_closed():
+                self.__eventLoop.remove_reader(self.__socket.fileno())
+            self.__eventLoop = None
+            for probeFuture in self.__probeFutures.values():
+                probeFuture.cancel()
+            self.__probeFutures.clear()
+
+        def getProbeFuture(self, probe):
+            # Returns a future that resolves with the probe once its response arrives or it is cancelled. The engine
+            # must be attached to the running event loop.
+            if self.__eventLoop is None:
+                raise RuntimeError("IcmpProbeEngine is not attached to an event loop")
+
+            probeFuture = self.__probeFutures.get(probe)
+            if probeFuture is None:
+                probeFuture = self.__eventLoop.create_future()
+                key = (probe.getIdentifier(), probe.getSequenceNumber())
+                if probe.isComplete() or self.__pendingProbes.get(key) is not probe:
+                    probeFuture.set_result(probe)
+                else:
+                    self.__probeFutures[probe] = probeFuture
+            return probeFuture
+
+        async def waitForAsync(self, probes, timeout):
+            # Coroutine version of waitFor(). Many callers can wait at once; they all share the one reader callback.
+            if probes:
+                await asyncio.wait([self.getProbeFuture(probe) for probe in probes], timeout=timeout)
+            for probe in probes:
+                if not probe.isComplete():
+                    self.cancel(probe)
+
+        def close(self):
+            if self.__socket is None:
+                return
+            self.detachEventLoop()
+            self.__socket.close()
+            self.__socket = None
+            self.__pendingProbes.clear()
+
+            if not self.__datagramSocket:
+                IcmpHelperLibrary.IcmpProbeEngine.releaseIdentifiers(self.__identifiers)
+
+        @staticmethod
+        def reserveIdentifiers(identifierCount):
+            # Claims identifiers for probes sent from elsewhere, such as worker processes, so that no engine in this
+            # process picks them; give them back with releaseIdentifiers
+            return IcmpHelperLibrary.IcmpProbeEngine.__reserveIdentifiers(identifierCount)
+
+        @staticmethod
+        def releaseIdentifiers(identifiers):
+            engineClass = IcmpHelperLibrary.IcmpProbeEngine
+            with engineClass.__identifierLock:
+                engineClass.__identifiersInUse.difference_update(identifiers)
+
+    # ################################################################################################################ #
+    # Class IcmpInstrumentation                                                                                        #
+    #                                                                                                                  #
+    # Per-stage timings and event counters. Pass one to IcmpHelperLibrary (or an IcmpProbeEngine) to switch it on;     #
+    # without one, each hook costs a single None check. Timings go into power-of-two nanosecond buckets, so            #
+    # percentiles are within a factor of two. Nothing is kept per event: a timing only adds to its stage's count,      #
+    # total and bucket, so memory stays the same however many events are recorded.                                     #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpInstrumentation:
+        # ############################################################################################################ #
+        # IcmpInstrumentation Class Scope Variables                                                                    #
+        # ############################################################################################################ #
+        stageNames = ("resolve", "build", "checksum", "send", "wait", "receive", "parse", "validate", "report")
+        counterNames = ("sent", "received", "completed", "stray", "late", "invalid", "timedOut")
+        __bucketCount = 48                              # Bucket i holds durations below 2**i ns; the last is open
+
+        # ############################################################################################################ #
+        # IcmpInstrumentation Constructors                                                                             #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.reset()
+
+        # ############################################################################################################ #
+        # IcmpInstrumentation Getters                                                                                  #
+        # ############################################################################################################ #
+        def getCounter(self, name):
+            return self.__counters.get(name, 0)
+
+        def getSnapshot(self):
+            # Plain dict copy of everything recorded so far, safe to serialize or compare with a later snapshot
+            stages = {}
+            for stage, histogram in self.__histograms.items():
+                count = self.__stageCounts[stage]
+                stages[stage] = {
+                    "count": count,
+                    "totalSeconds": self.__stageTotals[stage] / 1e9,
+                    "meanSeconds": self.__stageTotals[stage] / count / 1e9 if count else None,
+                    "p50Seconds": self.__getPercentile(histogram, count, 0.5),
+                    "p99Seconds": self.__getPercentile(histogram, count, 0.99),
+                    "histogram": list(histogram),
+                }
+            return {"stages": stages, "counters": dict(self.__counters)}
+
+        # ############################################################################################################ #
+        # IcmpInstrumentation Private Functions                                                                        #
+        # ############################################################################################################ #
+        def __addStage(self, stage):
+            self.__stageCounts[stage] = 0
+            self.__stageTotals[stage] = 0
+            self.__histograms[stage] = [0] * self.__bucketCount
+
+        @staticmethod
+        def __getPercentile(histogram, count, fraction):
+            # Upper bound of the bucket holding the given fraction of samples, in seconds
+            if not count:
+                return None
+            seen = 0
+            for bucket, bucketCount in enumerate(histogram):
+                seen += bucketCount
+                if seen >= count * fraction:
+                    return (1 << bucket) / 1e9
+
+        # ############################################################################################################ #
+        # IcmpInstrumentation Public Functions                                                                         #
+        # ############################################################################################################ #
+        def recordStage(self, stage, elapsedNs):
+            # Adds one timing, in nanoseconds (time.perf_counter_ns differences); stages outside stageNames are
+            # created on first use
+            if stage not in self.__stageCounts:
+                self.__addStage(stage)
+            self.__stageCounts[stage] += 1
+            self.__stageTotals[stage] += elapsedNs
+            self.__histograms[stage][min(elapsedNs.bit_length(), self.__bucketCount - 1)] += 1
+
+        def increment(self, name, count=1):
+            self.__counters[name] = self.__counters.get(name, 0) + count
+
+        def reset(self):
+            self.__stageCounts = {}
+            self.__stageTotals = {}
+            self.__histograms = {}
+            for stage in self.stageNames:
+                self.__addStage(stage)
+            self.__counters = dict.fromkeys(self.counterNames, 0)
+
+    # ################################################################################################################ #
+    # Class IcmpRetransmitTimer                                                                                        #
+    #                                                                                                                  #
+    # How long to wait for a response, learnt the way TCP sets its retransmission timeout (RFC 6298): a smoothed RTT   #
+    # plus four times the smoothed RTT variation, doubled after each unanswered probe and kept within min/max bounds.  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpRetransmitTimer:
+        # ############################################################################################################ #
+        # IcmpRetransmitTimer Class Scope Variables                                                                    #
+        # ############################################################################################################ #
+        __alpha = 1 / 8                                 # Gain of the smoothed RTT
+        __beta = 1 / 4                                  # Gain of the RTT variation
+        __k = 4                                         # Variations allowed above the smoothed RTT
+
+        # ############################################################################################################ #
+        # IcmpRetransmitTimer Constructors                                                                             #
+        # ############################################################################################################ #
+        def __init__(self, initialTimeout=1.0, minTimeout=1.0, maxTimeout=30.0):
+            # All values in seconds. The 1 s floor is the one RFC 6298 recommends; it also leaves room for hops
+            # further along a path, which are slower than the ones the estimate was learnt from.
+            self.__minTimeout = minTimeout
+            self.__maxTimeout = maxTimeout
+            self.__smoothedRtt = None
+            self.__rttVariation = None
+            self.__timeout = min(maxTimeout, max(minTimeout, initialTimeout))
+
+        # ############################################################################################################ #
+        # IcmpRetransmitTimer Getters                                                                                  #
+        # ############################################################################################################ #
+        def getTimeout(self):
+            return self.__timeout
+
+        def getSmoothedRtt(self):
+            return self.__smoothedRtt
+
+        def getRttVariation(self):
+            return self.__rttVariation
+
+        # ############################################################################################################ #
+        # IcmpRetransmitTimer Public Functions                                                                         #
+        # ############################################################################################################ #
+        def recordRtt(self, rtt):
+            # rtt in seconds of a probe that was answered; also undoes any back off
+            if self.__smoothedRtt is None:
+                self.__smoothedRtt = rtt
+                self.__rttVariation = rtt / 2
+            else:
+                self.__rttVariation += (abs(self.__smoothedRtt - rtt) - self.__rttVariation) * self.__beta
+                self.__smoothedRtt += (rtt - self.__smoothedRtt) * self.__alpha
+            timeout = self.__smoothedRtt + self.__k * self.__rttVariation
+            self.__timeout = min(self.__maxTimeout, max(self.__minTimeout, timeout))
+
+        def backOff(self):
+            # A probe went unanswered
+            self.__timeout = min(self.__maxTimeout, self.__timeout * 2)
+
+        def copy(self):
+            # An independent timer starting from everything learnt so far
+            retransmitTimer = IcmpHelperLibrary.IcmpRetransmitTimer(self.__timeout, self.__minTimeout,
+                                                                     self.__maxTimeout)
+            retransmitTimer.__smoothedRtt = self.__smoothedRtt
+            retransmitTimer.__rttVariation = self.__rttVariation
+            return retransmitTimer
+
+    # ################################################################################################################ #
+    # Class IcmpRttStatistics                                                                                          #
+    #                                                                                                                  #
+    # Running RTT summary for one target. Every sample is folded in as it arrives, so memory does not grow with the    #
+    # number of pings: mean and deviation use Welford's method and percentiles come from a log-bucketed histogram      #
+    # whose estimates are within 1% of the true value. Two summaries can be merged, e.g. from separate runs.           #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpRttStatistics:
+        # ############################################################################################################ #
+        # IcmpRttStatistics Class Scope Variables                                                                      #
+        # ############################################################################################################ #
+        __relativeAccuracy = 0.01                       # Percentile estimates are within 1% of the sample
+        __gamma = (1 + __relativeAccuracy) / (1 - __relativeAccuracy)
+        __logGamma = math.log(__gamma)
+        __minBucket = math.ceil(math.log(0.001) / __logGamma)      # 1 us; anything faster shares this bucket
+        __maxBucket = math.ceil(math.log(100000.0) / __logGamma)   # 100 s; anything slower shares this bucket
+        __jitterGain = 1 / 16                           # Smoothing used for interarrival jitter in RFC 3550
+
+        # ############################################################################################################ #
+        # IcmpRttStatistics Constructors                                                                               #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.__sentCount = 0
+            self.__receivedCount = 0
+            self.__minRtt = None
+            self.__maxRtt = None
+            self.__mean = 0.0
+            self.__sumOfSquares = 0.0                   # Sum of squared differences from the mean
+            self.__jitter = 0.0
+            self.__lastRtt = None
+            self.__buckets = {}                         # bucket index -> count, at most 922 entries
+
+        # ############################################################################################################ #
+        # IcmpRttStatistics Getters                                                                                    #
+        # ############################################################################################################ #
+        def getSentCount(self):
+            return self.__sentCount
+
+        def getReceivedCount(self):
+            return self.__receivedCount
+
+        def getLostCount(self):
+            return max(0, self.__sentCount - self.__receivedCount)
+
+        def getPacketLoss(self):
+            # Percentage of sent probes without a recorded RTT
+            if self.__sentCount == 0:
+                return 0.0
+            return self.getLostCount() / self.__sentCount * 100
+
+        def getMinRtt(self):
+            return self.__minRtt
+
+        def getMaxRtt(self):
+            return self.__maxRtt
+
+        def getAvgRtt(self):
+            return self.__mean if self.__receivedCount else None
+
+        def getStdDevRtt(self):
+            if not self.__receivedCount:
+                return None
+            return math.sqrt(self.__sumOfSquares / self.__receivedCount)
+
+        def getJitter(self):
+            # Smoothed difference between consecutive RTTs, in ms
+            return self.__jitter if self.__receivedCount > 1 else None
+
+        def getPercentile(self, percentile):
+            # Estimated RTT below which the given percentage (0-100) of samples fall
+            if not self.__receivedCount:
+                return None
+            rank = percentile / 100 * (self.__receivedCount - 1)
+            seen = 0
+            for index in sorted(self.__buckets):
+                seen += self.__buckets[index]
+                if seen > rank:
+                    break
+            estimate = 2 * self.__gamma ** index / (self.__gamma + 1)
+            return min(self.__maxRtt, max(self.__minRtt, estimate))
+
+        def getState(self):
+            # Plain tuple of the summary, e.g. to hand it to another process; see fromState
+            return (self.__sentCount, self.__receivedCount, self.__minRtt, self.__maxRtt, self.__mean,
+                    self.__sumOfSquares, self.__jitter, self.__lastRtt, dict(self.__buckets))
+
+        @staticmethod
+        def fromState(state):
+            statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            statistics.__sentCount, statistics.__receivedCount, statistics.__minRtt, statistics.__maxRtt, \
+                statistics.__mean, statistics.__sumOfSquares, statistics.__jitter, statistics.__lastRtt, \
+                buckets = state
+            statistics.__buckets = dict(buckets)
+            return statistics
+
+        @staticmethod
+        def fromArrays(groups, rtts, groupCount):
+            # Summaries of many groups at once from NumPy arrays, one entry per probe sent: groups holds each probe's
+            # group (0 to groupCount - 1) and rtts its RTT in ms, NaN if it was not answered. Gives the same result
+            # as recording the probes one at a time in array order, up to floating point rounding.
+            rttStatistics = IcmpHelperLibrary.IcmpRttStatistics
+            sentCounts = numpy.bincount(groups, minlength=groupCount)
+            answered = ~numpy.isnan(rtts)
+            # By group, in array order within each; packing the entry number below the group makes the sort stable
+            order = (numpy.sort(groups[answered].astype(numpy.uint64) << 32 |
+                                numpy.arange(numpy.count_nonzero(answered), dtype=numpy.uint64)) & 0xffffffff).astype(
+                numpy.int64)
+            answeredGroups = groups[answered][order]
+            answeredRtts = rtts[answered][order]
+            presentGroups, starts, receivedCounts = numpy.unique(answeredGroups, return_index=True,
+                                                                 return_counts=True)
+
+            states = [(sentCount, 0, None, None, 0.0, 0.0, 0.0, None, {}) for sentCount in sentCounts.tolist()]
+            if len(answeredRtts):
+                means = numpy.add.reduceat(answeredRtts, starts) / receivedCounts
+                sumsOfSquares = numpy.add.reduceat((answeredRtts - numpy.repeat(means, receivedCounts)) ** 2, starts)
+                minRtts = numpy.minimum.reduceat(answeredRtts, starts)
+                maxRtts = numpy.maximum.reduceat(answeredRtts, starts)
+                lastRtts = answeredRtts[starts + receivedCounts - 1]
+
+                # Jitter is an exponential average of the differences between consecutive RTTs, so each difference
+                # is weighted by the gain decayed once for every later difference in the group
+                positions = numpy.arange(len(answeredRtts))
+                differences = numpy.abs(numpy.diff(answeredRtts, prepend=answeredRtts[:1]))
+                differences[starts] = 0
+                decay = numpy.repeat(starts + receivedCounts - 1, receivedCounts) - positions
+                jitters = numpy.add.reduceat(differences * rttStatistics.__jitterGain *
+                                             (1 - rttStatistics.__jitterGain) ** decay, starts)
+
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    bucketIndexes = numpy.ceil(numpy.log(answeredRtts) / rttStatistics.__logGamma)
+                bucketIndexes = numpy.clip(numpy.nan_to_num(bucketIndexes, nan=rttStatistics.__minBucket),
+                                           rttStatistics.__minBucket, rttStatistics.__maxBucket).astype(numpy.int64)
+                bucketKeys, bucketCounts = numpy.unique(answeredGroups * 0x10000 + bucketIndexes -
+                                                        rttStatistics.__minBucket, return_counts=True)
+                buckets = collections.defaultdict(dict)
+                for bucketKey, bucketCount in zip(bucketKeys.tolist(), bucketCounts.tolist()):
+                    buckets[bucketKey >> 16][(bucketKey & 0xffff) + rttStatistics.__minBucket] = bucketCount
+
+                for i, group in enumerate(presentGroups.tolist()):
+                    states[group] = (states[group][0], int(receivedCounts[i]), float(minRtts[i]), float(maxRtts[i]),
+                                     float(means[i]), float(sumsOfSquares[i]), float(jitters[i]), float(lastRtts[i]),
+                                     buckets[group])
+            return [rttStatistics.fromState(state) for state in states]
+
+        # ############################################################################################################ #
+        # IcmpRttStatistics Private Functions                                                                          #
+        # ############################################################################################################ #
+        def __getBucketIndex(self, rtt):
+            if rtt <= 0:
+                return self.__minBucket
+            index = math.ceil(math.log(rtt) / self.__logGamma)
+            return min(self.__maxBucket, max(self.__minBucket, index))
+
+        # ############################################################################################################ #
+        # IcmpRttStatistics Public Functions                                                                           #
+        # ############################################################################################################ #
+        def recordSent(self, count=1):
+            self.__sentCount += count
+
+        def recordRtt(self, rtt):
+            # rtt in ms for a probe that was answered
+            self.__receivedCount += 1
+            self.__minRtt = rtt if self.__minRtt is None else min(self.__minRtt, rtt)
+            self.__maxRtt = rtt if self.__maxRtt is None else max(self.__maxRtt, rtt)
+
+            delta = rtt - self.__mean
+            self.__mean += delta / self.__receivedCount
+            self.__sumOfSquares += delta * (rtt - self.__mean)
+
+            if self.__lastRtt is not None:
+                self.__jitter += (abs(rtt - self.__lastRtt) - self.__jitter) * self.__jitterGain
+            self.__lastRtt = rtt
+
+            index = self.__getBucketIndex(rtt)
+            self.__buckets[index] = self.__buckets.get(index, 0) + 1
+
+        def merge(self, other):
+            # Folds another summary into this one. Counts, extremes, mean, deviation and percentiles combine
+            # exactly; jitter is weighted by each side's sample count since the order between them is unknown.
+            receivedCount = self.__receivedCount + other.__receivedCount
+            if other.__receivedCount:
+                delta = other.__mean - self.__mean
+                self.__sumOfSquares += other.__sumOfSquares + \
+                    delta * delta * self.__receivedCount * other.__receivedCount / receivedCount
+                self.__mean += delta * other.__receivedCount / receivedCount
+                self.__jitter = (self.__jitter * self.__receivedCount + other.__jitter * other.__receivedCount) / \
+                    receivedCount
+                self.__minRtt = other.__minRtt if self.__minRtt is None else min(self.__minRtt, other.__minRtt)
+                self.__maxRtt = other.__maxRtt if self.__maxRtt is None else max(self.__maxRtt, other.__maxRtt)
+                if self.__lastRtt is None:
+                    self.__lastRtt = other.__lastRtt
+                for index, count in other.__buckets.items():
+                    self.__buckets[index] = self.__buckets.get(index, 0) + count
+            self.__sentCount += other.__sentCount
+            self.__receivedCount = receivedCount
+            return self
+
+    # ################################################################################################################ #
+    # Class IcmpPingResult                                                                                             #
+    #                                                                                                                  #
+    # Outcome of one ping run against a single target, returned by the async API instead of console output.            #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpPingResult:
+        # ############################################################################################################ #
+        # IcmpPingResult Constructors                                                                                  #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, probes):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__probes = probes
+
+        # ############################################################################################################ #
+        # IcmpPingResult Getters                                                                                       #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getProbes(self):
+            return self.__probes
+
+        def getRtts(self):
+            return [probe.getRtt() for probe in self.__probes if probe.getIcmpType() == 0]
+
+        def getSentCount(self):
+            return len(self.__probes)
+
+        def getReceivedCount(self):
+            return len(self.getRtts())
+
+        def getPacketLoss(self):
+            # Percentage of probes that did not get an echo reply
+            if not self.__probes:
+                return 0.0
+            return (self.getSentCount() - self.getReceivedCount()) / self.getSentCount() * 100
+
+        def getMinRtt(self):
+            rtts = self.getRtts()
+            return min(rtts) if rtts else None
+
+        def getMaxRtt(self):
+            rtts = self.getRtts()
+            return max(rtts) if rtts else None
+
+        def getAvgRtt(self):
+            rtts = self.getRtts()
+            return sum(rtts) / len(rtts) if rtts else None
+
+        def getStatistics(self):
+            # IcmpRttStatistics for this run, including deviation, jitter and percentiles
+            statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            statistics.recordSent(len(self.__probes))
+            for rtt in self.getRtts():
+                statistics.recordRtt(rtt)
+            return statistics
+
+    # ################################################################################################################ #
+    # Class IcmpTraceRouteResult                                                                                       #
+    #                                                                                                                  #
+    # Outcome of one trace: one probe per TTL in hop order, ending at the hop that answered for the destination.       #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpTraceRouteResult:
+        # ############################################################################################################ #
+        # IcmpTraceRouteResult Constructors                                                                            #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, hops, hopNames=None):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__hops = hops
+            self.__hopNames = hopNames if hopNames is not None else [None] * len(hops)
+
+        # ############################################################################################################ #
+        # IcmpTraceRouteResult Getters                                                                                 #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getHops(self):
+            # IcmpProbe per TTL starting at 1; probes that were never answered are incomplete
+            return self.__hops
+
+        def getHopNames(self):
+            # Reverse DNS name per hop, None where it was not requested, not found or not answered in time
+            return self.__hopNames
+
+        def isDestinationReached(self):
+            return len(self.__hops) > 0 and self.__hops[-1].getIcmpType() in (0, 3)
+
+    # ################################################################################################################ #
+    # Class IcmpHopGraph                                                                                               #
+    #                                                                                                                  #
+    # Result of a multipath trace: every interface seen at each TTL and the links between interfaces at consecutive    #
+    # TTLs. A link is known when one flow was answered by both ends, since a flow keeps to one path.                   #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpHopGraph:
+        # ############################################################################################################ #
+        # IcmpHopGraph Constructors                                                                                    #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__interfaces = {}          # ttl -> {address: [IcmpRttStatistics, icmpType of the first answer]}
+            self.__successors = {}          # (ttl, address) -> set of addresses at ttl + 1
+            self.__probeCount = 0
+            self.__flowCount = 0
+
+        # ############################################################################################################ #
+        # IcmpHopGraph Getters                                                                                         #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getTtls(self):
+            # TTLs probed, in order, including those where nothing answered
+            return sorted(self.__interfaces)
+
+        def getInterfaces(self, ttl):
+            return sorted(self.__interfaces.get(ttl, {}))
+
+        def getIcmpType(self, ttl, address):
+            return self.__interfaces[ttl][address][1]
+
+        def getStatistics(self, ttl, address):
+            # IcmpRttStatistics of the answers this interface gave at this TTL
+            return self.__interfaces[ttl][address][0]
+
+        def getSuccessors(self, ttl, address):
+            return sorted(self.__successors.get((ttl, address), ()))
+
+        def getEdges(self):
+            # [((ttl, address), (ttl + 1, address))] in TTL order
+            return [((ttl, address), (ttl + 1, successor)) for (ttl, address), successors in
+                    sorted(self.__successors.items()) for successor in sorted(successors)]
+
+        def getProbeCount(self):
+            return self.__probeCount
+
+        def getFlowCount(self):
+            return self.__flowCount
+
+        def getPathCount(self):
+            # Number of distinct interface paths from the first TTL to the last, following known links
+            pathCounts = {}
+            for ttl in reversed(self.getTtls()):
+                for address in self.__interfaces[ttl]:
+                    successors = self.__successors.get((ttl, address))
+                    pathCounts[(ttl, address)] = sum(pathCounts[(ttl + 1, successor)] for successor in successors) \
+                        if successors else 1
+            ttls = self.getTtls()
+            return sum(pathCounts[(ttls[0], address)] for address in self.__interfaces[ttls[0]]) if ttls else 0
+
+        def isDestinationReached(self):
+            return any(interface[1] in (0, 3) for interfaces in self.__interfaces.values()
+                       for interface in interfaces.values())
+
+        # ############################################################################################################ #
+        # IcmpHopGraph Setters                                                                                         #
+        # ############################################################################################################ #
+        def setFlowCount(self, flowCount):
+            self.__flowCount = flowCount
+
+        # ############################################################################################################ #
+        # IcmpHopGraph Public Functions                                                                                #
+        # ############################################################################################################ #
+        def addProbes(self, ttl, probes):
+            # Adds the answers of the probes sent at ttl; an empty TTL is kept so silent hops show up
+            interfaces = self.__interfaces.setdefault(ttl, {})
+            for probe in probes:
+                self.__probeCount += 1
+                if not probe.isComplete():
+                    continue
+                interface = interfaces.get(probe.getResponderAddress()[0])
+                if interface is None:
+                    interface = interfaces[probe.getResponderAddress()[0]] = [IcmpHelperLibrary.IcmpRttStatistics(),
+                                                                              probe.getIcmpType()]
+                interface[0].recordSent()
+                interface[0].recordRtt(probe.getRtt())
+
+        def addEdge(self, ttl, address, successor):
+            self.__successors.setdefault((ttl, address), set()).add(successor)
+
+    # ################################################################################################################ #
+    # Class IcmpResultRecord                                                                                           #
+    #                                                                                                                  #
+    # One probe outcome as plain values, yielded by pingRecords and traceRouteRecords. It holds no reference to the    #
+    # received packet, so records can be kept or passed to a writer in bulk.                                           #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpResultRecord:
+        # ############################################################################################################ #
+        # IcmpResultRecord Class Scope Variables                                                                       #
+        # ############################################################################################################ #
+        __slots__ = ("__target", "__destinationIpAddress", "__hop", "__ttl", "__identifier", "__sequenceNumber",
+                     "__responder", "__responderName", "__rtt", "__icmpType", "__icmpCode", "__isValidRawData",
+                     "__receivedData", "__expectedData", "__responderAsn", "__responderPrefix")
+
+        # Names of the values returned by getValues, in order; used as the NDJSON keys and the CSV header
+        fieldNames = ("target", "destinationIpAddress", "hop", "ttl", "identifier", "sequenceNumber", "responder",
+                      "responderName", "rtt", "icmpType", "icmpCode", "isValidRawData", "receivedData", "expectedData",
+                      "responderAsn", "responderPrefix")
+
+        # ############################################################################################################ #
+        # IcmpResultRecord Constructors                                                                                #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, hop, ttl, identifier, sequenceNumber, responder=None,
+                     responderName=None, rtt=None, icmpType=None, icmpCode=None, isValidRawData=None,
+                     receivedData=None, expectedData=None, responderAsn=None, responderPrefix=None):
+            # hop is the position in a trace (None for pings); isValidRawData is None unless an echo reply was
+            # received, and receivedData and expectedData hold both payloads as text only when they differ.
+            # responderAsn and responderPrefix are set when the library has an IcmpPrefixIndex.
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__hop = hop
+            self.__ttl = ttl
+            self.__identifier = identifier
+            self.__sequenceNumber = sequenceNumber
+            self.__responder = responder
+            self.__responderName = responderName
+            self.__rtt = rtt
+            self.__icmpType = icmpType
+            self.__icmpCode = icmpCode
+            self.__isValidRawData = isValidRawData
+            self.__receivedData = receivedData
+            self.__expectedData = expectedData
+            self.__responderAsn = responderAsn
+            self.__responderPrefix = responderPrefix
+
+        @staticmethod
+        def fromProbe(target, probe, hop=None, responderName=None, expectedPayload=None, responderAsn=None,
+                      responderPrefix=None):
+            # Echo replies are checked against the payload that was sent, when given. Their identifier and sequence
+            # number are not checked: the probe engine matched the reply to this probe by those two values.
+            isValidRawData = receivedData = expectedData = None
+            echoReply = probe.getEchoReply()
+            if echoReply is not None:
+                isValidRawData = expectedPayload is None or echoReply.getIcmpDataBytes() == bytes(expectedPayload)
+                if not isValidRawData:
+                    receivedData = echoReply.getIcmpDataBytes().decode("utf-8", "backslashreplace")
+                    expectedData = bytes(expectedPayload).decode("utf-8", "backslashreplace")
+
+            responder = probe.getResponderAddress()
+            return IcmpHelperLibrary.IcmpResultRecord(target, probe.getDestinationIpAddress(), hop, probe.getTtl(),
+                                                      probe.getIdentifier(), probe.getSequenceNumber(),
+                                                      responder[0] if responder is not None else None,
+                                                      responderName, probe.getRtt(), probe.getIcmpType(),
+                                                      probe.getIcmpCode(), isValidRawData, receivedData, expectedData,
+                                                      responderAsn, responderPrefix)
+
+        # ############################################################################################################ #
+        # IcmpResultRecord Getters                                                                                     #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getHop(self):
+            return self.__hop
+
+        def getTtl(self):
+            return self.__ttl
+
+        def getIdentifier(self):
+            return self.__identifier
+
+        def getSequenceNumber(self):
+            return self.__sequenceNumber
+
+        def getResponder(self):
+            # Address that answered, or None if the probe timed out
+            return self.__responder
+
+        def getResponderName(self):
+            return self.__responderName
+
+        def getResponderAsn(self):
+            return self.__responderAsn
+
+        def getResponderPrefix(self):
+            return self.__responderPrefix
+
+        def getRtt(self):
+            # Round trip time in milliseconds, or None if the probe timed out
+            return self.__rtt
+
+        def getIcmpType(self):
+            return self.__icmpType
+
+        def getIcmpCode(self):
+            return self.__icmpCode
+
+        def isTimedOut(self):
+            return self.__icmpType is None
+
+        def getReceivedData(self):
+            # Payload of an echo reply that failed the raw data check, else None
+            return self.__receivedData
+
+        def getExpectedData(self):
+            # Payload that was sent, when an echo reply failed the raw data check, else None
+            return self.__expectedData
+
+        def isValidRawData(self):
+            return self.__isValidRawData
+
+        def isValidResponse(self):
+            # False only when an echo reply failed its check
+            return self.__isValidRawData is not False
+
+        def getValues(self):
+            # Tuple of every field in fieldNames order
+            return (self.__target, self.__destinationIpAddress, self.__hop, self.__ttl, self.__identifier,
+                    self.__sequenceNumber, self.__responder, self.__responderName, self.__rtt, self.__icmpType,
+                    self.__icmpCode, self.__isValidRawData, self.__receivedData, self.__expectedData,
+                    self.__responderAsn, self.__responderPrefix)
+
+    # ################################################################################################################ #
+    # Class IcmpConsoleWriter                                                                                          #
+    #                                                                                                                  #
+    # Prints result records in the same layout sendPing and traceRoute have always used. Ping records (no hop) are     #
+    # printed as ping lines and trace records as hop lines.                                                            #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpConsoleWriter:
+        # ############################################################################################################ #
+        # IcmpConsoleWriter Constructors                                                                               #
+        # ############################################################################################################ #
+        def __init__(self, stream=None):
+            # stream defaults to standard output
+            self.__stream = stream
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpConsoleWriter Private Functions                                                                          #
+        # ############################################################################################################ #
+        def __printIcmpError(self, record, responder):
+            icmpType = record.getIcmpType()
+            icmpCode = record.getIcmpCode()
+            rtt = "%.0f ms" % record.getRtt() if record.getRtt() is not None else "cached"   # Copied, not probed
+            print("  TTL=%d    RTT=%s    Type=%d    Code=%d    %s" %
+                  (record.getTtl(), rtt, icmpType, icmpCode, responder),
+                  end=" ", file=self.__stream)
+            print(f' {IcmpHelperLibrary.icmpCodes[icmpType][icmpCode]}' if icmpType in IcmpHelperLibrary.icmpCodes
+                  and icmpCode in IcmpHelperLibrary.icmpCodes[icmpType] else '', file=self.__stream)
+
+        def __writePing(self, record):
+            print("Pinging (" + record.getTarget() + ") " + record.getDestinationIpAddress(), end=" ",
+                  file=self.__stream)
+            if record.isTimedOut():
+                print("  *        *        *        *        *      Request timed out.", file=self.__stream)
+                return
+
+            if record.getIcmpType() != 0:
+                self.__printIcmpError(record, record.getResponder())
+                return
+
+            print("  TTL=%d    RTT=%.0f ms    Type=%d    Code=%d        Identifier=%d    Sequence Number=%d    %s" %
+                  (
+                      record.getTtl(),
+                      record.getRtt(),
+                      record.getIcmpType(),
+                      record.getIcmpCode(),
+                      record.getIdentifier(),
+                      record.getSequenceNumber(),
+                      record.getResponder()
+                  ), file=self.__stream)
+
+            # Checking if valid, if not printing out the reasons why
+            if not record.isValidRawData():
+                print(f'  [Invalid Raw Data]: Received: {record.getReceivedData()} '
+                      f'Expected: {record.getExpectedData()}', file=self.__stream)
+
+        def __writeHop(self, record):
+            if record.isTimedOut():
+                print("  TTL=%d    *        *        *        *        *      Request timed out." % record.getTtl(),
+                      file=self.__stream)
+                return
+
+            responder = record.getResponder()
+            if record.getResponderName() is not None:
+                responder = "%s (%s)" % (record.getResponderName(), responder)
+            if record.getResponderAsn() is not None:
+                responder += " [AS%d %s]" % (record.getResponderAsn(), record.getResponderPrefix())
+            self.__printIcmpError(record, responder)
+
+        # ############################################################################################################ #
+        # IcmpConsoleWriter Public Functions                                                                           #
+        # ############################################################################################################ #
+        def write(self, record):
+            if record.getHop() is None:
+                self.__writePing(record)
+            else:
+                self.__writeHop(record)
+
+        def writeAll(self, records):
+            # Consumes an iterable of records, e.g. a pingRecords generator; returns how many were written
+            count = 0
+            for record in records:
+                self.write(record)
+                count += 1
+            return count
+
+        def flush(self):
+            if self.__stream is not None:
+                self.__stream.flush()
+
+        def close(self):
+            self.flush()
+
+    # ################################################################################################################ #
+    # Class IcmpNdjsonWriter                                                                                           #
+    #                                                                                                                  #
+    # Writes result records as newline-delimited JSON, one object per record keyed by IcmpResultRecord.fieldNames.     #
+    # Lines are collected and written batchSize at a time so large runs cost one write call per batch.                 #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpNdjsonWriter:
+        # ############################################################################################################ #
+        # IcmpNdjsonWriter Constructors                                                                                #
+        # ############################################################################################################ #
+        def __init__(self, stream, batchSize=1024):
+            # stream is any text stream; it is flushed but not closed by close()
+            self.__stream = stream
+            self.__batchSize = batchSize
+            self.__lines = []
+            self.__encoder = json.JSONEncoder(separators=(",", ":"))
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpNdjsonWriter Public Functions                                                                            #
+        # ############################################################################################################ #
+        def write(self, record):
+            self.__lines.append(self.__encoder.encode(dict(zip(IcmpHelperLibrary.IcmpResultRecord.fieldNames,
+                                                               record.getValues()))))
+            if len(self.__lines) >= self.__batchSize:
+                self.flush()
+
+        def writeAll(self, records):
+            count = 0
+            for record in records:
+                self.write(record)
+                count += 1
+            return count
+
+        def flush(self):
+            if self.__lines:
+                self.__lines.append("")         # Terminates the last line
+                self.__stream.write("\n".join(self.__lines))
+                self.__lines.clear()
+            self.__stream.flush()
+
+        def close(self):
+            self.flush()
+
+    # ################################################################################################################ #
+    # Class IcmpCsvWriter                                                                                              #
+    #                                                                                                                  #
+    # Writes result records as CSV rows with a header of IcmpResultRecord.fieldNames. Rows are formatted into an       #
+    # in-memory buffer and written to the stream batchSize at a time.                                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpCsvWriter:
+        # ############################################################################################################ #
+        # IcmpCsvWriter Constructors                                                                                   #
+        # ############################################################################################################ #
+        def __init__(self, stream, batchSize=1024, writeHeader=True):
+            # stream is a text stream opened with newline=''; it is flushed but not closed by close()
+            self.__stream = stream
+            self.__batchSize = batchSize
+            self.__buffer = io.StringIO()
+            self.__csvWriter = csv.writer(self.__buffer)
+            self.__bufferedRows = 0
+            if writeHeader:
+                self.__csvWriter.writerow(IcmpHelperLibrary.IcmpResultRecord.fieldNames)
+                self.__bufferedRows += 1
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpCsvWriter Public Functions                                                                               #
+        # ############################################################################################################ #
+        def write(self, record):
+            self.__csvWriter.writerow(record.getValues())
+            self.__bufferedRows += 1
+            if self.__bufferedRows >= self.__batchSize:
+                self.flush()
+
+        def writeAll(self, records):
+            count = 0
+            for record in records:
+                self.write(record)
+                count += 1
+            return count
+
+        def flush(self):
+            if self.__bufferedRows:
+                self.__stream.write(self.__buffer.getvalue())
+                self.__buffer.seek(0)
+                self.__buffer.truncate()
+                self.__bufferedRows = 0
+            self.__stream.flush()
+
+        def close(self):
+            self.flush()
+
+    # ################################################################################################################ #
+    # Class IcmpPcapWriter                                                                                             #
+    #                                                                                                                  #
+    # Capture sink for the probe engine: every echo request sent and every ICMP packet received is appended to a pcap  #
+    # file (nanosecond timestamps, LINKTYPE_RAW so each record is a bare IPv4 datagram). Records are packed into an    #
+    # in-memory buffer and written bufferSize bytes at a time, so the probe loop never waits on the file.              #
+    #                                                                                                                  #
+    # References:                                                                                                      #
+    # https://www.ietf.org/archive/id/draft-ietf-opsawg-pcap-04.html                                                   #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpPcapWriter:
+        # ############################################################################################################ #
+        # IcmpPcapWriter Class Scope Variables                                                                         #
+        # ############################################################################################################ #
+        __fileHeaderStruct = struct.Struct("=IHHiIII")      # Magic, version, zone, sigfigs, snaplen, link type
+        __recordHeaderStruct = struct.Struct("=IIII")       # Seconds, nanoseconds, captured and original length
+        __ipHeaderStruct = struct.Struct("!BBHHHBBH4s4s")
+        __nanosecondMagic = 0xa1b23c4d
+        __LINKTYPE_RAW = 101
+
+        # ############################################################################################################ #
+        # IcmpPcapWriter Constructors                                                                                  #
+        # ############################################################################################################ #
+        def __init__(self, file, bufferSize=1024 * 1024, snapLength=65535):
+            # file is a path, or a binary stream that is flushed but not closed by close()
+            self.__ownsStream = isinstance(file, (str, bytes, os.PathLike))
+            self.__stream = open(file, "wb") if self.__ownsStream else file
+            self.__bufferSize = bufferSize
+            self.__snapLength = snapLength
+            self.__buffer = bytearray(self.__fileHeaderStruct.pack(self.__nanosecondMagic, 2, 4, 0, 0, snapLength,
+                                                                   self.__LINKTYPE_RAW))
+            self.__packetCount = 0
+            # The engine stamps packets with time.monotonic(); pcap wants wall clock time
+            self.__clockOffset = time.time() - time.monotonic()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpPcapWriter Getters                                                                                       #
+        # ############################################################################################################ #
+        def getPacketCount(self):
+            return self.__packetCount
+
+        # ############################################################################################################ #
+        # IcmpPcapWriter Public Functions                                                                              #
+        # ############################################################################################################ #
+        def writePacket(self, timestamp, datagram):
+            # timestamp is a time.monotonic() value; datagram is an IPv4 datagram (any bytes-like object)
+            timestampNs = round((timestamp + self.__clockOffset) * 1e9)
+            capturedLength = min(len(datagram), self.__snapLength)
+            self.__buffer += self.__recordHeaderStruct.pack(timestampNs // 1000000000, timestampNs % 1000000000,
+                                                            capturedLength, len(datagram))
+            self.__buffer += datagram[:capturedLength] if capturedLength < len(datagram) else datagram
+            self.__packetCount += 1
+            if len(self.__buffer) >= self.__bufferSize:
+                self.__stream.write(self.__buffer)
+                self.__buffer.clear()
+
+        def writeSent(self, timestamp, destinationIpAddress, ttl, icmpPacket):
+            # A raw socket sends only the ICMP message; the IP header the kernel adds is reconstructed around it
+            # (the source address is left as 0.0.0.0, since the kernel picks it per route)
+            ipHeader = bytearray(self.__ipHeaderStruct.pack(0x45, 0, 20 + len(icmpPacket), 0, 0, ttl, IPPROTO_ICMP,
+                                                            0, b'\x00\x00\x00\x00', inet_aton(destinationIpAddress)))
+            struct.pack_into("!H", ipHeader, 10, IcmpHelperLibrary.IcmpChecksum.calculate(ipHeader))
+            self.writePacket(timestamp, ipHeader + icmpPacket)
+
+        def flush(self):
+            if self.__buffer:
+                self.__stream.write(self.__buffer)
+                self.__buffer.clear()
+            self.__stream.flush()
+
+        def close(self):
+            if self.__stream is None:
+                return
+            self.flush()
+            if self.__ownsStream:
+                self.__stream.close()
+            self.__stream = None
+
+    # ################################################################################################################ #
+    # Class IcmpPcapAnalysis                                                                                           #
+    #                                                                                                                  #
+    # Offline replay of a capture: the file is memory-mapped and echo requests are matched to the echo replies and    #
+    # ICMP errors that answer them by (identifier, sequence number), the same way the probe engine does. With NumPy    #
+    # the fields of every packet are read as arrays straight from the mapping and requests are matched by sorting, so  #
+    # no Python object is made per packet; only walking from one record header to the next is done packet by packet.  #
+    # Without NumPy the capture is scanned one packet at a time, keeping only per-destination aggregates and the       #
+    # requests still awaiting an answer. Reads pcap files in either byte order and resolution, with raw IP, Ethernet   #
+    # or Linux cooked link types, so captures taken with tcpdump work as well as those from IcmpPcapWriter.            #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpPcapAnalysis:
+        # ############################################################################################################ #
+        # IcmpPcapAnalysis Class Scope Variables                                                                       #
+        # ############################################################################################################ #
+        __linkHeaderLengths = {1: 14, 101: 0, 113: 16, 228: 0}     # Ethernet, raw, Linux cooked, raw IPv4
+        __probeIdStruct = struct.Struct("!HH")
+        __addressStruct = struct.Struct("!I")
+        __duplicateWindow = 1e-3                                    # Seconds within which a request is seen twice
+        __chunkSize = 1 << 20                                       # Packets whose fields are read at once
+
+        # ############################################################################################################ #
+        # IcmpPcapAnalysis Constructors                                                                                #
+        # ############################################################################################################ #
+        def __init__(self, path):
+            self.__path = path
+            self.__packetCount = 0
+            self.__requestCount = 0
+            self.__unmatchedReplyCount = 0
+            # Addresses are kept packed, as read from the capture, and only converted when asked for
+            self.__statistics = {}          # destination -> IcmpRttStatistics of the probes that could reach it
+            self.__hops = {}                # destination -> {ttl: [IcmpRttStatistics, {responder: answer count}]}
+            self.__rtts = array.array('d')  # Every RTT in milliseconds, in the order the answers were captured
+
+        # ############################################################################################################ #
+        # IcmpPcapAnalysis Getters                                                                                     #
+        # ############################################################################################################ #
+        def getPacketCount(self):
+            return self.__packetCount
+
+        def getRequestCount(self):
+            return self.__requestCount
+
+        def getUnmatchedReplyCount(self):
+            # Answers whose echo request is not in the capture
+            return self.__unmatchedReplyCount
+
+        def getStatistics(self, destinationIpAddress):
+            # Echo requests to the destination, excluding those a router answered with Time Exceeded
+            return self.__statistics.get(inet_aton(destinationIpAddress))
+
+        def getAllStatistics(self):
+            return {inet_ntoa(destination): statistics for destination, statistics in self.__statistics.items()}
+
+        def getDestinations(self):
+            return [inet_ntoa(destination) for destination in self.__hops]
+
+        def getHops(self, destinationIpAddress):
+            # {ttl: (IcmpRttStatistics of every probe sent with that TTL, {responder address: answer count})}
+            hops = self.__hops.get(inet_aton(destinationIpAddress), {})
+            return {ttl: (hops[ttl][0], {inet_ntoa(responder): count for responder, count in hops[ttl][1].items()})
+                    for ttl in sorted(hops)}
+
+        def getRtts(self):
+            return self.__rtts
+
+        # ############################################################################################################ #
+        # IcmpPcapAnalysis Private Functions                                                                           #
+        # ############################################################################################################ #
+        def __finishRequest(self, request, rtt, icmpType, responder):
+            # request is (timestamp, destination, ttl); rtt and icmpType are None if it was never answered
+            timeSent, destination, ttl = request
+            hopsToDestination = self.__hops.get(destination)
+            if hopsToDestination is None:
+                hopsToDestination = self.__hops[destination] = {}
+            hop = hopsToDestination.get(ttl)
+            if hop is None:
+                hop = hopsToDestination[ttl] = [IcmpHelperLibrary.IcmpRttStatistics(), {}]
+            hop[0].recordSent()
+            if rtt is not None:
+                hop[0].recordRtt(rtt)
+                hop[1][responder] = hop[1].get(responder, 0) + 1
+                self.__rtts.append(rtt)
+
+            if icmpType != 11:
+                statistics = self.__statistics.get(destination)
+                if statistics is None:
+                    statistics = self.__statistics[destination] = IcmpHelperLibrary.IcmpRttStatistics()
+                statistics.recordSent()
+                if icmpType == 0:
+                    statistics.recordRtt(rtt)
+
+        def __readFileHeader(self, capture):
+            # Returns (byte order, seconds per timestamp fraction, link header length)
+            if len(capture) < 24:
+                raise ValueError("%s is not a pcap file" % self.__path)
+            magic = struct.unpack_from("<I", capture)[0]
+            if magic in (0xa1b2c3d4, 0xa1b23c4d):
+                byteOrder = "<"
+            elif magic in (0xd4c3b2a1, 0x4d3cb2a1):
+                byteOrder = ">"
+            else:
+                raise ValueError("%s is not a pcap file" % self.__path)
+            fractionScale = 1e-9 if magic in (0xa1b23c4d, 0x4d3cb2a1) else 1e-6
+            linkType = struct.unpack_from(byteOrder + "I", capture, 20)[0] & 0x0fffffff
+            if linkType not in self.__linkHeaderLengths:
+                raise ValueError("Unsupported pcap link type %d" % linkType)
+            return byteOrder, fractionScale, self.__linkHeaderLengths[linkType]
+
+        def __scanPackets(self, capture, byteOrder, fractionScale, linkHeaderLength):
+            size = len(capture)
+            recordHeaderUnpack = struct.Struct(byteOrder + "IIII").unpack_from
+            probeIdUnpack = self.__probeIdStruct.unpack_from
+            pendingRequests = {}            # (identifier, sequenceNumber) -> (timestamp, destination, ttl)
+            offset = 24
+            while offset + 16 <= size:
+                seconds, fraction, capturedLength, originalLength = recordHeaderUnpack(capture, offset)
+                ipStart = offset + 16 + linkHeaderLength
+                offset += 16 + capturedLength
+                self.__packetCount += 1
+                if capturedLength < linkHeaderLength + 28 or offset > size:
+                    continue
+                if linkHeaderLength and capture[ipStart - 2:ipStart] != b'\x08\x00':
+                    continue                # Not IPv4
+                if capture[ipStart] >> 4 != 4 or capture[ipStart + 9] != IPPROTO_ICMP:
+                    continue
+                icmpStart = ipStart + (capture[ipStart] & 0x0f) * 4
+                if icmpStart + 8 > offset:
+                    continue
+                timestamp = seconds + fraction * fractionScale
+                icmpType = capture[icmpStart]
+
+                if icmpType == 8:
+                    key = probeIdUnpack(capture, icmpStart + 4)
+                    request = pendingRequests.get(key)
+                    if request is not None:
+                        if request[1] == capture[ipStart + 16:ipStart + 20] and \
+                                timestamp - request[0] < self.__duplicateWindow:
+                            continue        # The same request seen twice, e.g. looped back on the capture host
+                        self.__finishRequest(request, None, None, None)
+                    pendingRequests[key] = (timestamp, capture[ipStart + 16:ipStart + 20], capture[ipStart + 8])
+                    self.__requestCount += 1
+                    continue
+
+                if icmpType == 0:
+                    key = probeIdUnpack(capture, icmpStart + 4)
+                elif icmpType == 3 or icmpType == 11:
+                    quotedIcmpStart = icmpStart + 8 + (capture[icmpStart + 8] & 0x0f) * 4
+                    if quotedIcmpStart + 8 > offset or capture[quotedIcmpStart] != 8:
+                        continue            # Quoted packet is not an echo request
+                    key = probeIdUnpack(capture, quotedIcmpStart + 4)
+                else:
+                    continue
+                request = pendingRequests.pop(key, None)
+                if request is None:
+                    self.__unmatchedReplyCount += 1
+                    continue
+                self.__finishRequest(request, (timestamp - request[0]) * 1000, icmpType,
+                                     capture[ipStart + 12:ipStart + 16])
+
+            for request in pendingRequests.values():
+                self.__finishRequest(request, None, None, None)
+
+        @staticmethod
+        def __readBytes(data, positions):
+            # Positions past the end of the file read its last byte; the packets they belong to are left out
+            return data[numpy.minimum(positions, len(data) - 1)]
+
+        @staticmethod
+        def __readWords(words, positions):
+            # words is a view of the file with a 32 bit value starting at every byte; see __scanBulk
+            return words[numpy.minimum(positions, len(words) - 1)]
+
+        def __readEntries(self, data, recordWords, networkWords, offsets, firstPacket, fractionScale,
+                          linkHeaderLength):
+            # Reads the echo requests and their answers from the records at the given offsets, as the columns
+            # (packet number, is a request, identifier and sequence number, destination of a request or responder of
+            # an answer, TTL, ICMP type, timestamp)
+            readBytes = self.__readBytes
+            readWords = self.__readWords
+            capturedLengths = readWords(recordWords, offsets + 8).astype(numpy.int64)
+            ends = offsets + 16 + capturedLengths
+            ipStarts = offsets + 16 + linkHeaderLength
+            valid = (capturedLengths >= linkHeaderLength + 28) & (ends <= len(data))
+            if linkHeaderLength:
+                valid &= (readBytes(data, ipStarts - 2) == 0x08) & (readBytes(data, ipStarts - 1) == 0x00)   # IPv4
+            versionAndLengths = readBytes(data, ipStarts)
+            valid &= (versionAndLengths >> 4 == 4) & (readBytes(data, ipStarts + 9) == IPPROTO_ICMP)
+            icmpStarts = ipStarts + (versionAndLengths & 0x0f).astype(numpy.int64) * 4
+            valid &= icmpStarts + 8 <= ends
+            icmpTypes = readBytes(data, icmpStarts)
+            quotedIcmpStarts = icmpStarts + 8 + (readBytes(data, icmpStarts + 8) & 0x0f).astype(numpy.int64) * 4
+            isError = valid & ((icmpTypes == 3) | (icmpTypes == 11)) & (quotedIcmpStarts + 8 <= ends) & \
+                (readBytes(data, quotedIcmpStarts) == 8)             # Quoted packet must be an echo request
+            isRequest = valid & (icmpTypes == 8)
+
+            entries = numpy.flatnonzero(isRequest | isError | (valid & (icmpTypes == 0)))
+            keyStarts = numpy.where(isError[entries], quotedIcmpStarts[entries], icmpStarts[entries]) + 4
+            isRequest = isRequest[entries]
+            ipStarts = ipStarts[entries]
+            offsets = offsets[entries]
+            return (entries + firstPacket, isRequest, readWords(networkWords, keyStarts),
+                    readWords(networkWords, ipStarts + numpy.where(isRequest, 16, 12)), readBytes(data, ipStarts + 8),
+                    icmpTypes[entries], readWords(recordWords, offsets) +
+                    readWords(recordWords, offsets + 4) * fractionScale)
+
+        def __scanBulk(self, capture, byteOrder, fractionScale, linkHeaderLength):
+            # Each record header holds the length of its record, so only finding where the records start is done one
+            # packet at a time. Every field is then read a chunk of packets at a time, and just the columns of the
+            # requests and answers are kept.
+            size = len(capture)
+            data = numpy.frombuffer(capture, numpy.uint8)
+            # Unaligned views with a 32 bit value starting at every byte, in the file's byte order for record headers
+            # and in network byte order for packet fields, so any word is read with a single gather
+            recordWords = numpy.ndarray((size - 3,), byteOrder + "u4", capture, 0, (1,))
+            networkWords = numpy.ndarray((size - 3,), ">u4", capture, 0, (1,))
+            capturedLengthUnpack = struct.Struct(byteOrder + "I").unpack_from
+            chunks = []
+            offset = 24
+            while offset + 16 <= size:
+                recordOffsets = array.array('q')
+                for _ in range(self.__chunkSize):
+                    if offset + 16 > size:
+                        break
+                    recordOffsets.append(offset)
+                    offset += 16 + capturedLengthUnpack(capture, offset + 8)[0]
+                chunks.append(self.__readEntries(data, recordWords, networkWords,
+                                                 numpy.frombuffer(recordOffsets, numpy.int64), self.__packetCount,
+                                                 fractionScale, linkHeaderLength))
+                self.__packetCount += len(recordOffsets)
+            if not chunks:
+                return
+
+            # Sorted by (identifier, sequence number) and in capture order within each, so the answer to a request
+            # is the entry right after it
+            packets, isRequest, keys, addresses, ttls, icmpTypes, timestamps = (numpy.concatenate(column)
+                                                                                for column in zip(*chunks))
+            del chunks
+            if not len(keys):
+                return
+            # The entry number packed below each key keeps the sort stable, which is faster than a stable argsort
+            order = (numpy.sort(keys.astype(numpy.uint64) << 32 | numpy.arange(len(keys), dtype=numpy.uint64)) &
+                     0xffffffff).astype(numpy.int64)
+            packets, isRequest, keys, addresses, ttls, icmpTypes, timestamps = (column[order] for column in (
+                packets, isRequest, keys, addresses, ttls, icmpTypes, timestamps))
+
+            # A request to the same destination as the pending request with its key, within the duplicate window of
+            # it, is that request seen twice and is dropped. Whether an earlier copy is itself pending depends on the
+            # copies before it, so this is repeated until nothing changes, which takes one pass unless copies come in
+            # runs of three or more.
+            positions = numpy.arange(len(keys))
+            sameKey = numpy.concatenate(([False], keys[1:] == keys[:-1]))
+            candidates = isRequest & sameKey & numpy.concatenate(([False], isRequest[:-1]))
+            isCopy = numpy.zeros(len(keys), bool)
+            while True:
+                pending = numpy.concatenate(([0], numpy.maximum.accumulate(numpy.where(isCopy, 0, positions))[:-1]))
+                wasCopy = isCopy
+                isCopy = candidates & (addresses == addresses[pending]) & \
+                    (timestamps - timestamps[pending] < self.__duplicateWindow)
+                if numpy.array_equal(isCopy, wasCopy):
+                    break
+            packets, isRequest, keys, addresses, ttls, icmpTypes, timestamps = (column[~isCopy] for column in (
+                packets, isRequest, keys, addresses, ttls, icmpTypes, timestamps))
+
+            # An answer right after a request with its key answers it; any other answer is unmatched. A request ends
+            # at the next entry with its key, answered if that is an answer and lost if it is another request, or at
+            # the end of the capture. Requests are taken in the order they end, as the packet scan would.
+            sameKey = numpy.concatenate((keys[1:] == keys[:-1], [False]))    # Same key as the entry after
+            isAnswered = isRequest & sameKey & ~numpy.concatenate((isRequest[1:], [True]))
+            self.__requestCount += int(numpy.count_nonzero(isRequest))
+            self.__unmatchedReplyCount += int(numpy.count_nonzero(~isRequest)) - int(numpy.count_nonzero(isAnswered))
+            requests = numpy.flatnonzero(isRequest)
+            endPackets = numpy.where(sameKey[requests], packets[numpy.minimum(requests + 1, len(packets) - 1)],
+                                     self.__packetCount)
+            requests = requests[numpy.argsort(endPackets << 32 | packets[requests])]
+            answered = isAnswered[requests]
+            answers = requests[answered] + 1
+            rtts = numpy.full(len(requests), numpy.nan)
+            rtts[answered] = (timestamps[answers] - timestamps[requests[answered]]) * 1000
+            answerTypes = numpy.full(len(requests), -1)
+            answerTypes[answered] = icmpTypes[answers]
+            destinations = addresses[requests]
+            self.__rtts.frombytes(rtts[answered].tobytes())
+
+            def numberInOrder(values):
+                # Numbers the distinct values in the order they first appear; returns (number per entry, values)
+                distinctValues, firstEntries, inverse = numpy.unique(values, return_index=True, return_inverse=True)
+                order = numpy.argsort(firstEntries)
+                numbers = numpy.empty(len(order), numpy.int64)
+                numbers[order] = numpy.arange(len(order))
+                return numbers[inverse.ravel()], distinctValues[order].tolist()
+
+            # Echo requests to each destination, excluding those a router answered with Time Exceeded
+            toDestination = answerTypes != 11
+            groups, groupDestinations = numberInOrder(destinations[toDestination])
+            groupStatistics = IcmpHelperLibrary.IcmpRttStatistics.fromArrays(
+                groups, numpy.where(answerTypes[toDestination] == 0, rtts[toDestination], numpy.nan),
+                len(groupDestinations))
+            for destination, statistics in zip(groupDestinations, groupStatistics):
+                self.__statistics[self.__addressStruct.pack(destination)] = statistics
+
+            # Every request per (destination, TTL), with the responders that answered them
+            groups, groupHops = numberInOrder(destinations.astype(numpy.int64) << 8 | ttls[requests])
+            groupStatistics = IcmpHelperLibrary.IcmpRttStatistics.fromArrays(groups, rtts, len(groupHops))
+            hops = []
+            for hop, statistics in zip(groupHops, groupStatistics):
+                hopsToDestination = self.__hops.setdefault(self.__addressStruct.pack(hop >> 8), {})
+                hops.append(hopsToDestination.setdefault(hop & 0xff, [statistics, {}]))
+            answerGroups, answerResponders = numberInOrder(groups[answered].astype(numpy.int64) << 32 |
+                                                           addresses[answers])
+            for groupAndResponder, answerCount in zip(answerResponders, numpy.bincount(answerGroups).tolist()):
+                hops[groupAndResponder >> 32][1][self.__addressStruct.pack(groupAndResponder & 0xffffffff)] = \
+                    answerCount
+
+        # ############################################################################################################ #
+        # IcmpPcapAnalysis Public Functions                                                                            #
+        # ############################################################################################################ #
+        def run(self):
+            # Scans the whole capture once and returns self. Requests never answered count as lost; a request whose
+            # identifier/sequence pair is reused before an answer arrives is counted as lost at that point.
+            with open(self.__path, "rb") as captureFile:
+                with mmap.mmap(captureFile.fileno(), 0, access=mmap.ACCESS_READ) as capture:
+                    if numpy is not None:
+                        self.__scanBulk(capture, *self.__readFileHeader(capture))
+                    else:
+                        self.__scanPackets(capture, *self.__readFileHeader(capture))
+            return self
+
+    # ################################################################################################################ #
+    # Class IcmpResultStore                                                                                            #
+    #                                                                                                                  #
+    # Append-only columnar store for IcmpResultRecords, kept as one flat file of fixed-width values per column in a    #
+    # directory. It is a writer like IcmpCsvWriter, buffering batchSize rows before appending them. For analysis the   #
+    # columns are memory-mapped as NumPy arrays, so queries over tens of millions of probes run vectorized without     #
+    # creating a Python object per row. NumPy is only needed for the query functions.                                  #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpResultStore:
+        # ############################################################################################################ #
+        # IcmpResultStore Class Scope Variables                                                                        #
+        # ############################################################################################################ #
+        # (column, array typecode, NumPy dtype); addresses are IPv4 addresses as integers, 0 for none
+        __columns = (("time", "d", "f8"),               # Seconds since the epoch when the record was written
+                     ("destination", "I", "u4"),
+                     ("ttl", "B", "u1"),
+                     ("responder", "I", "u4"),
+                     ("rtt", "f", "f4"),                # Milliseconds; NaN if the probe timed out or hop was copied
+                     ("icmpType", "B", "u1"),
+                     ("icmpCode", "B", "u1"))
+        noResponse = 255                                # icmpType and icmpCode of a probe that timed out
+        __addressStruct = struct.Struct("!I")
+
+        # ############################################################################################################ #
+        # IcmpResultStore Constructors                                                                                 #
+        # ############################################################################################################ #
+        def __init__(self, directory, batchSize=65536):
+            os.makedirs(directory, exist_ok=True)
+            self.__directory = directory
+            self.__batchSize = batchSize
+            self.__buffers = [array.array(typecode) for column, typecode, dtype in self.__columns]
+            self.__storedRowCount = self.__repair()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, excType, excValue, traceback):
+            self.close()
+
+        # ############################################################################################################ #
+        # IcmpResultStore Getters                                                                                      #
+        # ############################################################################################################ #
+        def getRowCount(self):
+            return self.__storedRowCount + len(self.__buffers[0])
+
+        def getColumns(self):
+            # {column: read-only NumPy array} over the rows written so far, memory-mapped rather than read
+            self.__requireNumpy()
+            self.flush()
+            columns = {}
+            for column, typecode, dtype in self.__columns:
+                if self.__storedRowCount == 0:
+                    columns[column] = numpy.empty(0, dtype)
+                else:
+                    columns[column] = numpy.memmap(self.__getPath(column), dtype, "r", shape=(self.__storedRowCount,))
+            return columns
+
+        def getDestinations(self):
+            columns = self.getColumns()
+            return [self.__unpackAddress(destination) for destination in numpy.unique(columns["destination"])]
+
+        # ############################################################################################################ #
+        # IcmpResultStore Private Functions                                                                            #
+        # ############################################################################################################ #
+        @staticmethod
+        def __requireNumpy():
+            if numpy is None:
+                raise ImportError("IcmpResultStore queries need NumPy (pip install numpy)")
+
+        def __getPath(self, column):
+            return os.path.join(self.__directory, column + ".col")
+
+        def __repair(self):
+            # Returns the number of complete rows. A crash part way through an append can leave some columns
+            # longer than others; they are cut back so every column has the same number of rows again.
+            rowCount = None
+            for column, typecode, dtype in self.__columns:
+                path = self.__getPath(column)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                columnRows = size // array.array(typecode).itemsize
+                rowCount = columnRows if rowCount is None else min(rowCount, columnRows)
+            for column, typecode, dtype in self.__columns:
+                path = self.__getPath(column)
+                if os.path.exists(path) and os.path.getsize(path) != rowCount * array.array(typecode).itemsize:
+                    os.truncate(path, rowCount * array.array(typecode).itemsize)
+            return rowCount
+
+        @staticmethod
+        def __packAddress(address):
+            return IcmpHelperLibrary.IcmpResultStore.__addressStruct.unpack(inet_aton(address))[0] if address else 0
+
+        @staticmethod
+        def __unpackAddress(address):
+            return inet_ntoa(IcmpHelperLibrary.IcmpResultStore.__addressStruct.pack(int(address))) if address else None
+
+        def __select(self, columns, destinationIpAddress, start, end):
+            # Boolean mask of the rows for the destination (all if None) written between start and end
+            mask = numpy.ones(len(columns["time"]), bool)
+            if destinationIpAddress is not None:
+                mask &= columns["destination"] == self.__packAddress(destinationIpAddress)
+            if start is not None:
+                mask &= columns["time"] >= start
+            if end is not None:
+                mask &= columns["time"] < end
+            return mask
+
+        # ############################################################################################################ #
+        # IcmpResultStore Public Functions                                                                             #
+        # ############################################################################################################ #
+        def write(self, record, timestamp=None):
+            # Records without a destination (the target did not resolve) carry nothing to store and are skipped
+            if record.getDestinationIpAddress() is None:
+                return
+            icmpType = record.getIcmpType()
+            rtt = record.getRtt()
+            values = (time.time() if timestamp is None else timestamp,
+                      self.__packAddress(record.getDestinationIpAddress()),
+                      record.getTtl(),
+                      self.__packAddress(record.getResponder()),
+                      rtt if rtt is not None else math.nan,
+                      icmpType if icmpType is not None else self.noResponse,
+                      record.getIcmpCode() if icmpType is not None else self.noResponse)
+            for buffer, value in zip(self.__buffers, values):
+                buffer.append(value)
+            if len(self.__buffers[0]) >= self.__batchSize:
+                self.flush()
+
+        def writeAll(self, records):
+            count = 0
+            for record in records:
+                self.write(record)
+                count += 1
+            return count
+
+        def flush(self):
+            rowCount = len(self.__buffers[0])
+            if rowCount == 0:
+                return
+            for (column, typecode, dtype), buffer in zip(self.__columns, self.__buffers):
+                with open(self.__getPath(column), "ab") as columnFile:
+                    buffer.tofile(columnFile)
+                del buffer[:]
+            self.__storedRowCount += rowCount
+
+        def close(self):
+            self.flush()
+
+        def getHopPercentiles(self, destinationIpAddress, percentiles=(50, 90, 99), start=None, end=None):
+            # {ttl: [RTT at each percentile, in ms]} over the answered probes to the destination (nearest rank)
+            columns = self.getColumns()
+            mask = self.__select(columns, destinationIpAddress, start, end) & ~numpy.isnan(columns["rtt"])
+            ttls = columns["ttl"][mask]
+            rtts = columns["rtt"][mask]
+            order = numpy.lexsort((rtts, ttls))     # By TTL, then RTT within each TTL
+            ttls, firstRows, rowCounts = numpy.unique(ttls[order], return_index=True, return_counts=True)
+            rtts = rtts[order]
+            values = [rtts[firstRows + ((rowCounts - 1) * (percentile / 100)).astype(numpy.int64)]
+                      for percentile in percentiles]
+            return {int(ttl): [float(value[i]) for value in values] for i, ttl in enumerate(ttls)}
+
+        def getLossOverTime(self, bucketSeconds=3600, destinationIpAddress=None, start=None, end=None):
+            # (bucket start times, probes sent, probes unanswered) per bucketSeconds, as NumPy arrays
+            columns = self.getColumns()
+            mask = self.__select(columns, destinationIpAddress, start, end)
+            times = columns["time"][mask]
+            if len(times) == 0:
+                return numpy.empty(0), numpy.empty(0, numpy.int64), numpy.empty(0, numpy.int64)
+            firstBucketStart = numpy.floor(times.min() / bucketSeconds) * bucketSeconds
+            buckets = ((times - firstBucketStart) // bucketSeconds).astype(numpy.int64)
+            sent = numpy.bincount(buckets)
+            lost = numpy.bincount(buckets, weights=columns["icmpType"][mask] == self.noResponse,
+                                  minlength=len(sent)).astype(numpy.int64)
+            return firstBucketStart + numpy.arange(len(sent)) * bucketSeconds, sent, lost
+
+        def getPathChanges(self, destinationIpAddress, start=None, end=None):
+            # [(time, ttl, previous responder, responder)] for every time the address answering at a TTL of the
+            # path to the destination differs from the one that answered there before, in TTL then time order
+            columns = self.getColumns()
+            mask = self.__select(columns, destinationIpAddress, start, end) & (columns["responder"] != 0)
+            ttls = columns["ttl"][mask]
+            times = columns["time"][mask]
+            responders = columns["responder"][mask]
+            order = numpy.lexsort((times, ttls))
+            ttls, times, responders = ttls[order], times[order], responders[order]
+            changes = numpy.nonzero((ttls[1:] == ttls[:-1]) & (responders[1:] != responders[:-1]))[0] + 1
+            return [(float(times[i]), int(ttls[i]), self.__unpackAddress(responders[i - 1]),
+                     self.__unpackAddress(responders[i])) for i in changes]
+
+    # ################################################################################################################ #
+    # Class IcmpMonitorTarget                                                                                          #
+    #                                                                                                                  #
+    # State the monitor keeps per target: a ring of the last historySize RTTs (NaN for a lost probe) and lifetime      #
+    # IcmpRttStatistics. Both are fixed in size, so memory stays flat however long the monitor runs.                   #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMonitorTarget:
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Class Scope Variables                                                                      #
+        # ############################################################################################################ #
+        __slots__ = ("__target", "__destinationIpAddress", "__history", "__historyPosition", "__historyCount",
+                     "__statistics", "__missedCount")
+
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Constructors                                                                               #
+        # ############################################################################################################ #
+        def __init__(self, target, destinationIpAddress, historySize):
+            self.__target = target
+            self.__destinationIpAddress = destinationIpAddress
+            self.__history = array.array("d", bytes(8 * historySize))
+            self.__historyPosition = 0
+            self.__historyCount = 0
+            self.__statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            self.__missedCount = 0                      # Send slots skipped because the monitor fell behind
+
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Getters                                                                                    #
+        # ############################################################################################################ #
+        def getTarget(self):
+            return self.__target
+
+        def getDestinationIpAddress(self):
+            return self.__destinationIpAddress
+
+        def getStatistics(self):
+            # Lifetime IcmpRttStatistics for the target
+            return self.__statistics
+
+        def getMissedCount(self):
+            return self.__missedCount
+
+        def getRecentRtts(self):
+            # The last historySize results, oldest first: RTT in ms, or None for a lost probe
+            size = len(self.__history)
+            start = (self.__historyPosition - self.__historyCount) % size
+            return [None if math.isnan(self.__history[(start + i) % size]) else self.__history[(start + i) % size]
+                    for i in range(self.__historyCount)]
+
+        # ############################################################################################################ #
+        # IcmpMonitorTarget Public Functions                                                                           #
+        # ############################################################################################################ #
+        def record(self, rtt):
+            # rtt in ms, or None for a probe that timed out
+            self.__history[self.__historyPosition] = rtt if rtt is not None else math.nan
+            self.__historyPosition = (self.__historyPosition + 1) % len(self.__history)
+            self.__historyCount = min(self.__historyCount + 1, len(self.__history))
+            self.__statistics.recordSent()
+            if rtt is not None:
+                self.__statistics.recordRtt(rtt)
+
+        def recordMissed(self, count):
+            self.__missedCount += count
+
+    # ################################################################################################################ #
+    # Class IcmpMonitor                                                                                                #
+    #                                                                                                                  #
+    # Long-running pinger. Each target is probed every interval seconds on a fixed schedule kept in a heap, with the   #
+    # targets' first probes spread across one interval so sends are evenly paced. Aggregates over the recent results   #
+    # are served in the Prometheus text format by an optional HTTP endpoint running on its own thread.                 #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpMonitor:
+        # ############################################################################################################ #
+        # IcmpMonitor Class Scope Variables                                                                            #
+        # ############################################################################################################ #
+        __quantiles = (0.5, 0.9, 0.99)                  # Reported over each target's recent results
+
+        # ############################################################################################################ #
+        # IcmpMonitor Constructors                                                                                     #
+        # ############################################################################################################ #
+        def __init__(self, probeEngine, resolver, interval=1.0, timeout=1.0, historySize=300):
+            # timeout should not exceed interval, or probes to a slow target overlap
+            self.__probeEngine = probeEngine
+            self.__resolver = resolver
+            self.__interval = interval
+            self.__timeout = timeout
+            self.__historySize = historySize
+            self.__targets = {}                         # target -> IcmpMonitorTarget
+            self.__unresolvedTargets = []
+            self.__schedule = []                        # heap of (send time, sequence, IcmpMonitorTarget)
+            self.__scheduleCounter = itertools.count()  # Breaks send time ties without comparing targets
+            self.__running = False
+            self.__metricsServer = None
+
+        # ############################################################################################################ #
+        # IcmpMonitor Getters                                                                                          #
+        # ############################################################################################################ #
+        def getTargets(self):
+            return list(self.__targets.values())
+
+        def getTarget(self, target):
+            return self.__targets.get(target)
+
+        def getUnresolvedTargets(self):
+            return list(self.__unresolvedTargets)
+
+        def isRunning(self):
+            return self.__running
+
+        def getMetricsAddress(self):
+            # (host, port) the metrics endpoint is listening on, or None
+            return self.__metricsServer.server_address if self.__metricsServer is not None else None
+
+        # ############################################################################################################ #
+        # IcmpMonitor Private Functions                                                                                #
+        # ############################################################################################################ #
+        @staticmethod
+        def __escapeLabel(value):
+            return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        def __runLoop(self, endTime):
+            probeEngine = self.__probeEngine
+            schedule = self.__schedule
+            interval = self.__interval
+            expiryQueue = collections.deque()   # (deadline, probe) in send order, so deadlines are sorted
+            monitorTargets = {}                 # IcmpProbe -> IcmpMonitorTarget for probes in flight
+
+            while self.__running and (endTime is None or time.monotonic() < endTime):
+                now = time.monotonic()
+                while schedule and schedule[0][0] <= now:
+                    sendTime, _, monitorTarget = heapq.heappop(schedule)
+                    probe = probeEngine.sendEchoRequest(monitorTarget.getDestinationIpAddress())
+                    monitorTargets[probe] = monitorTarget
+                    expiryQueue.append((now + self.__timeout, probe))
+
+                    # Stay on the fixed grid; slots that have already passed are skipped rather than sent late
+                    sendTime += interval
+                    if sendTime <= now:
+                        missed = math.ceil((now - sendTime) / interval)
+                        monitorTarget.recordMissed(missed)
+                        sendTime += missed * interval
+                    heapq.heappush(schedule, (sendTime, next(self.__scheduleCounter), monitorTarget))
+
+                # Wait for replies, but no longer than the next send or the oldest probe's deadline
+                waitTime = interval
+                if schedule:
+                    waitTime = min(waitTime, schedule[0][0] - now)
+                if expiryQueue:
+                    waitTime = min(waitTime, expiryQueue[0][0] - now)
+                if endTime is not None:
+                    waitTime = min(waitTime, endTime - now)
+
+                finishedProbes = probeEngine.receive(waitTime)
+
+                # Probes past their deadline time out. A probe can also have been completed by another caller's
+                # receive on the shared engine; it is recorded here all the same.
+                now = time.monotonic()
+                while expiryQueue and (expiryQueue[0][1].isComplete() or expiryQueue[0][0] <= now):
+                    probe = expiryQueue.popleft()[1]
+                    if not probe.isComplete():
+                        probeEngine.cancel(probe)
+                    finishedProbes.append(probe)
+
+                for probe in finishedProbes:
+                    monitorTarget = monitorTargets.pop(probe, None)
+                    if monitorTarget is not None:
+                        monitorTarget.record(probe.getRtt() if probe.isComplete() and probe.getIcmpType() == 0
+                                             else None)
+
+            # Probes still in flight when the monitor stops are not counted
+            for probe in monitorTargets:
+                probeEngine.cancel(probe)
+
+        # ############################################################################################################ #
+        # IcmpMonitor Public Functions                                                                                 #
+        # ############################################################################################################ #
+        def addTargets(self, targets):
+            # Resolves the targets (concurrently, through the resolver) and schedules them. Targets that do not
+            # resolve are listed by getUnresolvedTargets. Call before run, or between runs.
+            targets = [target for target in targets if target not in self.__targets]
+            start = time.monotonic()
+            for i, (target, destinationIpAddress) in enumerate(self.__resolver.resolveMany(targets)):
+                if destinationIpAddress is None:
+                    self.__unresolvedTargets.append(target)
+                    continue
+                monitorTarget = IcmpHelperLibrary.IcmpMonitorTarget(target, destinationIpAddress, self.__historySize)
+                self.__targets[target] = monitorTarget
+                sendTime = start + self.__interval * i / len(targets)
+                heapq.heappush(self.__schedule, (sendTime, next(self.__scheduleCounter), monitorTarget))
+
+        def run(self, duration=None):
+            # Probes the targets until stop is called (from another thread) or duration seconds have passed
+            self.__running = True
+            try:
+                self.__runLoop(time.monotonic() + duration if duration is not None else None)
+            finally:
+                self.__running = False
+
+        def stop(self):
+            self.__running = False
+
+        def getMetrics(self):
+            # Prometheus text exposition of every target. The loss ratio and RTT quantiles cover the recent
+            # results in each target's ring; the counters cover the whole run.
+            lines = []
+            metricTargets = list(self.__targets.values())
+            samples = [(self.__escapeLabel(monitorTarget.getTarget()), monitorTarget)
+                       for monitorTarget in metricTargets]
+
+            lines.append("# HELP icmp_probes_sent_total Echo requests sent to the target.")
+            lines.append("# TYPE icmp_probes_sent_total counter")
+            for label, monitorTarget in samples:
+                lines.append('icmp_probes_sent_total{target="%s"} %d' %
+                             (label, monitorTarget.getStatistics().getSentCount()))
+
+            lines.append("# HELP icmp_probes_received_total Echo replies received from the target.")
+            lines.append("# TYPE icmp_probes_received_total counter")
+            for label, monitorTarget in samples:
+                lines.append('icmp_probes_received_total{target="%s"} %d' %
+                             (label, monitorTarget.getStatistics().getReceivedCount()))
+
+            lines.append("# HELP icmp_probes_missed_total Send slots skipped because the monitor fell behind.")
+            lines.append("# TYPE icmp_probes_missed_total counter")
+            for label, monitorTarget in samples:
+                lines.append('icmp_probes_missed_total{target="%s"} %d' % (label, monitorTarget.getMissedCount()))
+
+            lines.append("# HELP icmp_packet_loss_ratio Fraction of the recent probes that got no echo reply.")
+            lines.append("# TYPE icmp_packet_loss_ratio gauge")
+            recentRtts = []
+            for label, monitorTarget in samples:
+                results = monitorTarget.getRecentRtts()
+                rtts = sorted(rtt for rtt in results if rtt is not None)
+                recentRtts.append(rtts)
+                lossRatio = (len(results) - len(rtts)) / len(results) if results else 0.0
+                lines.append('icmp_packet_loss_ratio{target="%s"} %s' % (label, repr(lossRatio)))
+
+            lines.append("# HELP icmp_rtt_seconds Round trip time; quantiles cover the recent echo replies.")
+            lines.append("# TYPE icmp_rtt_seconds summary")
+            for (label, monitorTarget), rtts in zip(samples, recentRtts):
+                for quantile in self.__quantiles:
+                    value = rtts[round(quantile * (len(rtts) - 1))] / 1000 if rtts else math.nan
+                    lines.append('icmp_rtt_seconds{target="%s",quantile="%s"} %s' % (label, quantile, repr(value)))
+                statistics = monitorTarget.getStatistics()
+                rttSum = 0.0
+                if statistics.getReceivedCount():
+                    rttSum = statistics.getAvgRtt() * statistics.getReceivedCount() / 1000
+                lines.append('icmp_rtt_seconds_sum{target="%s"} %s' % (label, repr(rttSum)))
+                lines.append('icmp_rtt_seconds_count{target="%s"} %d' % (label, statistics.getReceivedCount()))
+
+            lines.append("# HELP icmp_monitor_targets Targets being monitored.")
+            lines.append("# TYPE icmp_monitor_targets gauge")
+            lines.append("icmp_monitor_targets %d" % len(metricTargets))
+            lines.append("# HELP icmp_monitor_unresolved_targets Targets whose name did not resolve.")
+            lines.append("# TYPE icmp_monitor_unresolved_targets gauge")
+            lines.append("icmp_monitor_unresolved_targets %d" % len(self.__unresolvedTargets))
+            lines.append("# HELP icmp_monitor_stray_packets_total ICMP packets that matched no outstanding probe.")
+            lines.append("# TYPE icmp_monitor_stray_packets_total counter")
+            lines.append("icmp_monitor_stray_packets_total %d" % self.__probeEngine.getStrayPacketCount())
+            lines.append("")
+            return "\n".join(lines)
+
+        def startMetricsServer(self, port=9100, address="127.0.0.1"):
+            # Serves getMetrics at /metrics from a daemon thread. Port 0 picks a free port; see getMetricsAddress.
+            monitor = self
+
+            class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = monitor.getMetrics().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass                                # Scrapes are not worth a line each
+
+            self.__metricsServer = http.server.ThreadingHTTPServer((address, port), MetricsRequestHandler)
+            self.__metricsServer.daemon_threads = True
+            threading.Thread(target=self.__metricsServer.serve_forever, name="IcmpMonitorMetrics",
+                             daemon=True).start()
+
+        def stopMetricsServer(self):
+            if self.__metricsServer is not None:
+                self.__metricsServer.shutdown()
+                self.__metricsServer.server_close()
+                self.__metricsServer = None
+
+    # ################################################################################################################ #
+    # Class IcmpShardPool                                                                                              #
+    #                                                                                                                  #
+    # Spreads a sweep or a batch of traces across worker processes. Each worker runs its own IcmpHelperLibrary with    #
+    # its own socket and its own block of identifiers, so workers never claim each other's replies. The blocks are     #
+    # reserved in this process's identifier registry until close, so engines here never use them either. Workers send #
+    # results back in batches of plain tuples over a multiprocessing queue, and the parent rebuilds them as            #
+    # IcmpResultRecords and merges the workers' statistics.                                                            #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpShardPool:
+        # ############################################################################################################ #
+        # IcmpShardPool Class Scope Variables                                                                          #
+        # ############################################################################################################ #
+        __batchSize = 512                               # Records per message from a worker
+        __pollInterval = 1                              # Seconds between checks that the workers are still alive
+
+        # ############################################################################################################ #
+        # IcmpShardPool Constructors                                                                                   #
+        # ############################################################################################################ #
+        def __init__(self, workers=None, identifiersPerWorker=1, kernelTimestamps=False):
+            self.__workers = workers if workers is not None else os.cpu_count() or 1
+            self.__identifiersPerWorker = identifiersPerWorker
+            self.__kernelTimestamps = kernelTimestamps
+            self.__statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            self.__strayPacketCount = 0
+            self.__identifiers = None           # Reserved for the workers on first use, released by close
+
+        # ############################################################################################################ #
+        # IcmpShardPool Getters                                                                                        #
+        # ############################################################################################################ #
+        def getWorkerCount(self):
+            return self.__workers
+
+        def getStatistics(self):
+            # IcmpRttStatistics merged from every worker of the last run. For sweeps it covers every probe; for
+            # traces, each trace counts as one probe answered if the destination sent an echo reply.
+            return self.__statistics
+
+        def getStrayPacketCount(self):
+            return self.__strayPacketCount
+
+        # ############################################################################################################ #
+        # IcmpShardPool Private Functions                                                                              #
+        # ############################################################################################################ #
+        def __getWorkerIdentifiers(self, workerIndex):
+            # One block per worker, all reserved through the probe engines' registry before the first worker starts
+            if self.__identifiers is None:
+                self.__identifiers = IcmpHelperLibrary.IcmpProbeEngine.reserveIdentifiers(
+                    self.__workers * self.__identifiersPerWorker)
+            first = workerIndex * self.__identifiersPerWorker
+            return self.__identifiers[first:first + self.__identifiersPerWorker]
+
+        def __run(self, task, targets, getOptions):
+            # Stripes the targets across the workers and yields IcmpResultRecords as batches come back. With fewer
+            # targets than workers, fewer workers are started; getOptions(workerCount) gives each one's options.
+            targets = list(targets)
+            workerCount = max(1, min(self.__workers, len(targets)))
+            options = getOptions(workerCount)
+            self.__statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            self.__strayPacketCount = 0
+
+            resultQueue = multiprocessing.Queue()
+            processes = []
+            for workerIndex in range(workerCount):
+                process = multiprocessing.Process(target=IcmpHelperLibrary.IcmpShardPool.runShard,
+                                                  args=(task, targets[workerIndex::workerCount], options,
+                                                        self.__getWorkerIdentifiers(workerIndex),
+                                                        self.__kernelTimestamps, workerIndex, resultQueue),
+                                                  name="IcmpShard-%d" % workerIndex, daemon=True)
+                process.start()
+                processes.append(process)
+
+            try:
+                finishedWorkers = set()
+                while len(finishedWorkers) < workerCount:
+                    try:
+                        message = resultQueue.get(timeout=self.__pollInterval)
+                    except queue.Empty:
+                        for workerIndex, process in enumerate(processes):
+                            if workerIndex not in finishedWorkers and not process.is_alive() and \
+                                    process.exitcode != 0:
+                                raise RuntimeError("Shard %d exited with code %s" % (workerIndex, process.exitcode))
+                        continue
+
+                    if message[0] == "records":
+                        for values in message[1]:
+                            yield IcmpHelperLibrary.IcmpResultRecord(*values)
+                    elif message[0] == "done":
+                        finishedWorkers.add(message[1])
+                        self.__statistics.merge(IcmpHelperLibrary.IcmpRttStatistics.fromState(message[2]))
+                        self.__strayPacketCount += message[3]
+                    else:
+                        raise RuntimeError("Shard %d failed: %s" % (message[1], message[2]))
+            finally:
+                for process in processes:
+                    if process.is_alive():
+                        process.terminate()
+                    process.join()
+                resultQueue.close()
+
+        # ############################################################################################################ #
+        # IcmpShardPool Public Functions                                                                               #
+        # ############################################################################################################ #
+        def sweep(self, targets, count=1, window=1024, packetsPerSecond=10000, timeout=2):
+            # IcmpHelperLibrary.sweep split across the workers; yields one IcmpResultRecord per probe (targets that
+            # do not resolve get a single record with no destination). window and packetsPerSecond are totals,
+            # shared out between the workers that are started.
+            def getOptions(workerCount):
+                return {"count": count, "window": max(1, window // workerCount),
+                        "packetsPerSecond": packetsPerSecond / workerCount, "timeout": timeout}
+
+            return self.__run("sweep", targets, getOptions)
+
+        def traceRoutes(self, targets, maxTtl=30, timeout=None, resolveHopNames=False, maxSilentHops=5,
+                        concurrency=64):
+            # Traces every target, each worker running up to concurrency pipelined traces at once. Yields one
+            # IcmpResultRecord per reported hop, the hops of each trace together and in order.
+            options = {"maxTtl": maxTtl, "timeout": timeout, "resolveHopNames": resolveHopNames,
+                       "maxSilentHops": maxSilentHops, "concurrency": concurrency}
+            return self.__run("trace", targets, lambda workerCount: options)
+
+        def close(self):
+            # Gives the workers' identifiers back to this process's registry
+            if self.__identifiers is not None:
+                IcmpHelperLibrary.IcmpProbeEngine.releaseIdentifiers(self.__identifiers)
+                self.__identifiers = None
+
+        @staticmethod
+        def runShard(task, targets, options, identifiers, kernelTimestamps, workerIndex, resultQueue):
+            # Body of a worker process. A fresh resolver is used since the parent's thread pool does not survive
+            # a fork. A forked worker inherits the parent's reservation of its identifiers, which is dropped here
+            # so its own engine can take them.
+            IcmpHelperLibrary.IcmpProbeEngine.releaseIdentifiers(identifiers)
+            resolver = IcmpHelperLibrary.IcmpResolver()
+            library = IcmpHelperLibrary(kernelTimestamps, resolver, identifiers)
+            statistics = IcmpHelperLibrary.IcmpRttStatistics()
+            batch = []
+
+            def emit(record):
+                batch.append(record.getValues())
+                if len(batch) >= IcmpHelperLibrary.IcmpShardPool.__batchSize:
+                    resultQueue.put(("records", list(batch)))
+                    batch.clear()
+
+            try:
+                if task == "sweep":
+                    for pingResult in library.sweep(targets, **options):
+                        if pingResult.getDestinationIpAddress() is None:
+                            emit(IcmpHelperLibrary.IcmpResultRecord(pingResult.getTarget(), None, None, None, None,
+                                                                    None))
+                        for probe in pingResult.getProbes():
+                            emit(IcmpHelperLibrary.IcmpResultRecord.fromProbe(pingResult.getTarget(), probe))
+                            statistics.recordSent()
+                            if probe.getIcmpType() == 0:
+                                statistics.recordRtt(probe.getRtt())
+                else:
+                    concurrency = options.pop("concurrency")
+
+                    async def traceAll():
+                        semaphore = asyncio.Semaphore(concurrency)
+
+                        async def traceOne(target):
+                            async with semaphore:
+                                try:
+                                    return target, await library.traceRouteAsync(target, **options)
+                                except OSError:
+                                    return target, None         # Did not resolve
+
+                        for traceFuture in asyncio.as_completed([traceOne(target) for target in targets]):
+                            target, traceResult = await traceFuture
+                            statistics.recordSent()
+                            if traceResult is None:
+                                emit(IcmpHelperLibrary.IcmpResultRecord(target, None, None, None, None, None))
+                                continue
+                            hops = traceResult.getHops()
+                            for hop, (probe, hopName) in enumerate(zip(hops, traceResult.getHopNames()), 1):
+                                emit(IcmpHelperLibrary.IcmpResultRecord.fromProbe(target, probe, hop, hopName))
+                            if hops and hops[-1].getIcmpType() == 0:
+                                statistics.recordRtt(hops[-1].getRtt())
+
+                    asyncio.run(traceAll())
+
+                if batch:
+                    resultQueue.put(("records", batch))
+                resultQueue.put(("done", workerIndex, statistics.getState(), library.getStrayPacketCount()))
+            except Exception as exception:
+                resultQueue.put(("error", workerIndex, repr(exception)))
+            finally:
+                library.close()
+                resolver.close()
+
+    # ################################################################################################################ #
+    # Class IcmpTopologyCache                                                                                          #
+    #                                                                                                                  #
+    # Interfaces discovered by earlier traces from this vantage point, keyed by the TTL they answered at, each with    #
+    # the hops that led to it. traceRouteBatch uses it Doubletree style: once a backward probe reaches a known         #
+    # interface, the rest of the path towards us is copied instead of probed.                                          #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpTopologyCache:
+        # ############################################################################################################ #
+        # IcmpTopologyCache Class Scope Variables                                                                      #
+        # ############################################################################################################ #
+        __defaultStartTtl = 8                           # Used until a destination has been reached
+        __destinationHitRate = 0.05                     # Share of traces whose first probe may reach the destination
+        __maxDistance = 256
+
+        # ############################################################################################################ #
+        # IcmpTopologyCache Constructors                                                                               #
+        # ############################################################################################################ #
+        def __init__(self):
+            self.__paths = {}                           # (ttl, interface) -> responders at TTL 1..ttl-1 (None = silent)
+            self.__destinationDistances = [0] * self.__maxDistance     # hop count -> destinations that far away
+            self.__copiedHopCount = 0
+            self.__lock = threading.Lock()
+
+        # ############################################################################################################ #
+        # IcmpTopologyCache Getters                                                                                    #
+        # ############################################################################################################ #
+        def getInterfaceCount(self):
+            return len(self.__paths)
+
+        def getInterfaces(self, ttl):
+            return [interface for interfaceTtl, interface in list(self.__paths) if interfaceTtl == ttl]
+
+        def isKnown(self, ttl, interface):
+            return (ttl, interface) in self.__paths
+
+        def getPathTo(self, ttl, interface):
+            # Responders at TTL 1..ttl-1 on the way to the interface, or None if it is not known at that TTL
+            return self.__paths.get((ttl, interface))
+
+        def getCopiedHopCount(self):
+            # Hops filled in from the cache rather than probed
+            return self.__copiedHopCount
+
+        def getStartTtl(self, maxTtl):
+            # The TTL just short of all but the nearest 5% of destinations reached so far (Doubletree's p = 0.05):
+            # deep enough to skip most of the shared hops, yet rarely past the destination
+            reached = sum(self.__destinationDistances)
+            if reached == 0:
+                return min(maxTtl, self.__defaultStartTtl)
+            seen = 0
+            for distance, count in enumerate(self.__destinationDistances):
+                seen += count
+                if seen > reached * self.__destinationHitRate:
+                    return max(1, min(maxTtl, distance - 1))
+
+        # ############################################################################################################ #
+        # IcmpTopologyCache Public Functions                                                                           #
+        # ############################################################################################################ #
+        def addPath(self, responders, destinationReached):
+            # responders has one entry per TTL from 1 (None for a hop that did not answer); when the destination
+            # was reached it is the last entry and is not cached as a router
+            with self.__lock:
+                routers = len(responders) - 1 if destinationReached else len(responders)
+                for ttl in range(1, routers + 1):
+                    interface = responders[ttl - 1]
+                    if interface is not None and (ttl, interface) not in self.__paths:
+                        self.__paths[(ttl, interface)] = tuple(responders[:ttl - 1])
+                if destinationReached:
+                    self.__destinationDistances[min(len(responders), self.__maxDistance - 1)] += 1
+
+        def addCopiedHops(self, count):
+            with self.__lock:
+                self.__copiedHopCount += count
+
+    # ################################################################################################################ #
+    # Class IcmpSimulatedNetwork                                                                                       #
+    #                                                                                                                  #
+    # In-process stand-in for the network, so the library can be exercised and benchmarked without root. Echo          #
+    # requests sent through one of its sockets are answered with the Echo Reply, Time Exceeded or Destination          #
+    # Unreachable datagram a real path would produce, after the configured per-hop latency and subject to loss.        #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpSimulatedNetwork:
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Class Scope Variables                                                                   #
+        # ############################################################################################################ #
+        __ipHeaderStruct = struct.Struct("!BBHHHBBH4s4s")
+        __sourceAddress = inet_aton("10.255.255.254")  # Our address as quoted in error messages
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Constructors                                                                            #
+        # ############################################################################################################ #
+        def __init__(self, pathLength=8, hopLatency=0.0, loss=0.0, sharedHops=4, seed=None):
+            # Defaults for every destination; see setPath for overrides. hopLatency is the RTT in seconds each hop
+            # adds and loss the chance that any one probe goes unanswered. Routers within sharedHops of us are the
+            # same for every destination; further out they are shared by destinations in the same /16.
+            self.__defaultPath = (pathLength, hopLatency, loss, False, frozenset(), {})
+            self.__paths = {}                           # destination -> (pathLength, hopLatency, loss, unreachable,
+                                                        #                 silent TTLs, {ttl: load-balanced routers})
+            self.__sharedHops = sharedHops
+            self.__random = random.Random(seed)
+            self.__deliveryQueue = []                   # heap of (delivery time, sequence, socket, datagram)
+            self.__deliveryCounter = itertools.count()
+            self.__deliveryCondition = threading.Condition()
+            self.__deliveryThread = None
+            self.__sentCount = 0
+            self.__answeredCount = 0
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Getters                                                                                 #
+        # ############################################################################################################ #
+        def getSentCount(self):
+            return self.__sentCount
+
+        def getAnsweredCount(self):
+            return self.__answeredCount
+
+        def getHopAddress(self, destinationIpAddress, ttl, branch=0):
+            # Address of the router ttl hops along the path to the destination; branch picks one of the routers a
+            # load balancer spreads flows over at that TTL
+            if branch:
+                octets = destinationIpAddress.split(".")
+                return "10.%d.%s.%d" % (100 + branch, octets[1], ttl)
+            if ttl <= self.__sharedHops:
+                return "10.0.0.%d" % ttl
+            octets = destinationIpAddress.split(".")
+            return "10.%s.%s.%d" % (octets[0], octets[1], ttl)
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Setters                                                                                 #
+        # ############################################################################################################ #
+        def setPath(self, destinationIpAddress, pathLength=None, hopLatency=None, loss=None, unreachable=None,
+                    silentTtls=None, loadBalancedTtls=None):
+            # Overrides the defaults for one destination. With unreachable, the last router answers Destination
+            # Unreachable instead of the destination replying. Routers at silentTtls never answer. loadBalancedTtls
+            # maps a TTL to a number of parallel routers, between which each flow (the request's type, code and
+            # checksum) is hashed the way a per-flow ECMP load balancer does.
+            path = list(self.__paths.get(destinationIpAddress, self.__defaultPath))
+            for i, value in enumerate((pathLength, hopLatency, loss, unreachable)):
+                if value is not None:
+                    path[i] = value
+            if silentTtls is not None:
+                path[4] = frozenset(silentTtls)
+            if loadBalancedTtls is not None:
+                path[5] = dict(loadBalancedTtls)
+            self.__paths[destinationIpAddress] = tuple(path)
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Private Functions                                                                       #
+        # ############################################################################################################ #
+        def __buildIpDatagram(self, sourceAddress, destinationAddress, icmpMessage):
+            ipHeader = self.__ipHeaderStruct.pack(0x45, 0, 20 + len(icmpMessage), 0, 0, 64, IPPROTO_ICMP, 0,
+                                                  sourceAddress, destinationAddress)
+            return ipHeader + icmpMessage
+
+        def __buildErrorMessage(self, icmpType, icmpCode, destinationAddress, echoRequest):
+            # Error messages quote the IP header of the request and the first 8 bytes of its ICMP header
+            quotedIpHeader = self.__ipHeaderStruct.pack(0x45, 0, 20 + len(echoRequest), 0, 0, 1, IPPROTO_ICMP, 0,
+                                                        self.__sourceAddress, destinationAddress)
+            message = bytearray(struct.pack("!BBHI", icmpType, icmpCode, 0, 0) + quotedIpHeader + echoRequest[:8])
+            struct.pack_into("!H", message, 2, IcmpHelperLibrary.IcmpChecksum.calculate(message))
+            return bytes(message)
+
+        def __runDelivery(self):
+            # Hands delayed responses to their sockets once they are due
+            with self.__deliveryCondition:
+                while True:
+                    if not self.__deliveryQueue:
+                        self.__deliveryCondition.wait()
+                        continue
+                    waitTime = self.__deliveryQueue[0][0] - time.monotonic()
+                    if waitTime > 0:
+                        self.__deliveryCondition.wait(waitTime)
+                        continue
+                    _, _, simulatedSocket, datagram = heapq.heappop(self.__deliveryQueue)
+                    simulatedSocket.deliver(datagram)
+
+        # ############################################################################################################ #
+        # IcmpSimulatedNetwork Public Functions                                                                        #
+        # ############################################################################################################ #
+        def createSocket(self):
+            # Socket-like transport for IcmpProbeEngine(transport=...) or IcmpHelperLibrary(network=...)
+            return IcmpHelperLibrary.IcmpSimulatedSocket(self)
+
+        def transmit(self, simulatedSocket, echoRequest, destinationIpAddress, ttl):
+            # Works out what the path does with an ICMP message sent with the given TTL
+            self.__sentCount += 1
+            if len(echoRequest) < 8 or echoRequest[0] != 8:
+                return                                  # Only echo requests are answered
+            pathLength, hopLatency, loss, unreachable, silentTtls, loadBalancedTtls = \
+                self.__paths.get(destinationIpAddress, self.__defaultPath)
+            if loss > 0 and self.__random.random() < loss:
+                return
+
+            destinationAddress = inet_aton(destinationIpAddress)
+            if unreachable and ttl >= pathLength - 1:
+                hop, icmpType, icmpCode = max(1, pathLength - 1), 3, 1     # Host Unreachable from the last router
+            elif ttl < pathLength:
+                hop, icmpType, icmpCode = ttl, 11, 0
+            else:
+                hop, icmpType, icmpCode = pathLength, 0, 0
+
+            if icmpType == 0:
+                response = bytearray(echoRequest)
+                response[0] = 0                         # Echo Reply; the checksum is adjusted for the type change
+                struct.pack_into("!H", response, 2, IcmpHelperLibrary.IcmpChecksum.update(
+                    struct.unpack_from("!H", echoRequest, 2)[0], 0x0800, 0x0000))
+                responderAddress = destinationAddress
+            elif hop in silentTtls:
+                return
+            else:
+                response = self.__buildErrorMessage(icmpType, icmpCode, destinationAddress, echoRequest)
+                branch = 0
+                if hop in loadBalancedTtls:
+                    flowHash = (int.from_bytes(echoRequest[:4], "big") * 0x9e3779b1 + hop * 0x85ebca6b) & 0xffffffff
+                    branch = (flowHash >> 16) % loadBalancedTtls[hop]
+                responderAddress = inet_aton(self.getHopAddress(destinationIpAddress, hop, branch))
+            datagram = self.__buildIpDatagram(responderAddress, self.__sourceAddress, bytes(response))
+            self.__answeredCount += 1
+
+            latency = hopLatency * hop
+            if latency <= 0:
+                simulatedSocket.deliver(datagram)
+                return
+            with self.__deliveryCondition:
+                heapq.heappush(self.__deliveryQueue, (time.monotonic() + latency, next(self.__deliveryCounter),
+                                                      simulatedSocket, datagram))
+                self.__deliveryCondition.notify()
+                if self.__deliveryThread is None:
+                    self.__deliveryThread = threading.Thread(target=self.__runDelivery,
+                                                             name="IcmpSimulatedNetwork", daemon=True)
+                    self.__deliveryThread.start()
+
+    # ################################################################################################################ #
+    # Class IcmpSimulatedSocket                                                                                        #
+    #                                                                                                                  #
+    # The part of a raw ICMP socket IcmpProbeEngine uses, backed by an IcmpSimulatedNetwork. Received datagrams wait   #
+    # in a queue and a byte on a local socket pair makes fileno() readable, so select and asyncio work unchanged.      #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpSimulatedSocket:
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Constructors                                                                             #
+        # ############################################################################################################ #
+        def __init__(self, network):
+            self.__network = network
+            self.__wakeupReader, self.__wakeupWriter = socketpair()
+            self.__wakeupReader.setblocking(False)
+            self.__receiveQueue = collections.deque()
+            self.__queuedBytes = 0
+            self.__receiveBufferSize = 212992           # Linux's default SO_RCVBUF
+            self.__signalled = False                    # A wakeup byte is waiting on the socket pair
+            self.__lock = threading.Lock()
+            self.__ttl = 64
+            self.__droppedCount = 0
+
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Getters                                                                                  #
+        # ############################################################################################################ #
+        def getDroppedCount(self):
+            # Datagrams dropped because the receive buffer was full
+            return self.__droppedCount
+
+        def fileno(self):
+            return self.__wakeupReader.fileno()
+
+        # ############################################################################################################ #
+        # IcmpSimulatedSocket Public Functions                                                                         #
+        # ############################################################################################################ #
+        def setblocking(self, flag):
+            if flag:
+                raise OSError(errno.EOPNOTSUPP, "Simulated sockets are always non-blocking")
+
+        def bind(self, address):
+            pass
+
+        def setsockopt(self, level, option, value):
+            if level == IPPROTO_IP and option == IP_TTL:
+                self.__ttl = struct.unpack("I", value)[0] if isinstance(value, bytes) else value
+            elif level == SOL_SOCKET and option == SO_RCVBUF:
+                self.__receiveBufferSize = value
+            else:
+                raise OSError(errno.ENOPROTOOPT, "Option not supported by the simulated network")
+
+        def sendto(self, data, address):
+            self.__network.transmit(self, bytes(data), address[0], self.__ttl)
+            return len(data)
+
+        def recvfrom_into(self, buffer, nbytes=0):
+            # Like a raw socket: the whole IP datagram, and the sender taken from its source address
+            with self.__lock:
+                if not self.__receiveQueue:
+                    if self.__signalled:
+                        self.__wakeupReader.recv(1)
+                        self.__signalled = False
+                    raise BlockingIOError(errno.EAGAIN, "No datagram queued")
+                datagram = self.__receiveQueue.popleft()
+                self.__queuedBytes -= len(datagram)
+            size = min(len(datagram), nbytes or len(buffer))
+            buffer[:size] = datagram[:size]
+            return size, (inet_ntoa(datagram[12:16]), 0)
+
+        def deliver(self, datagram):
+            with self.__lock:
+                if self.__queuedBytes + len(datagram) > self.__receiveBufferSize:
+                    self.__droppedCount += 1
+                    return
+                self.__receiveQueue.append(datagram)
+                self.__queuedBytes += len(datagram)
+                if not self.__signalled:
+                    self.__wakeupWriter.send(b"\0")
+                    self.__signalled = True
+
+        def close(self):
+            self.__wakeupReader.close()
+            self.__wakeupWriter.close()
+
+    # ################################################################################################################ #
+    # Class IcmpTokenBucket                                                                                            #
+    #                                                                                                                  #
+    # Global packets-per-second budget. Tokens refill continuously at the given rate up to the burst size; each sent   #
+    # packet takes one.                                                                                                #
+    #                                                                                                                  #
+    # ################################################################################################################ #
+    class IcmpTokenBucket:
+        # ############################################################################################################ #
+        # IcmpTokenBucket Constructors                                                                                 #
+        # ############################################################################################################ #
+        def __init__(self, rate, burst=None):
+            if rate <= 0:
+                raise ValueError("rate must be positive")
+            self.__rate = float(rate)
+            self.__burst = float(burst if burst is not None else max(1.0, rate / 100))  # ~10 ms of traffic
+            self.__tokens = self.__burst
+            self.__lastRefill = time.monotonic()
+
+        # ############################################################################################################ #
+        # IcmpTokenBucket Private Functions                                                                            #
+        # ############################################################################################################ #
+        def __refill(self):
+            now = time.monotonic()
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__lastRefill) * self.__rate)
+            self.__lastRefill = now
+
+        # ############################################################################################################ #
+        # IcmpTokenBucket Public Functions                                                                             #
+        # ############################################################################################################ #
+        def tryConsume(self, tokens=1):
+            self.__refill()
+            if self.__tokens >= tokens:
+                self.__tokens -= tokens
+                return True
+            return False
+
+        def getDelay(self, tokens=1):
+            # Seconds until the given number of tokens will be available
+            self.__refill()
+            return max(0.0, (tokens - self.__tokens) / self.__rate)
+
+    # ################################################################################################################ #
+    # Class IcmpHelperLibrary                                                                                          #
+    # ################################################################################################################ #
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Class Scope Variables                                                                          #
+    # ################################################################################################################ #
+    __probeEngine = None                            # Shared raw socket engine, created on first use
+    __reverseLookupTimeout = 2                      # Seconds a finished trace waits for outstanding hop names
+    __resolveBatchSize = 256                        # Sweep targets resolved together
+    __maxProbeTimeout = 30                          # Upper bound in seconds on any adaptive wait
+
+    # Reference: https://www.iana.org/assignments/icmp-parameters/icmp-parameters.xhtml
+    icmpCodes = {
+        3 : {
+            0 : 'Net Unreachable',
+            1 : 'Host Unreachable',
+            2 : 'Protocol Unreachable',
+            3 : 'Port Unreachable',
+            4 : 'Fragmentation Needed and Don\'t Fragment was Set',
+            5 : 'Source Route Failed',
+            6 : 'Destination Network Unknown',
+            7 : 'Destination Host Unknown',
+            8 : 'Source Host Isolated',
+            9 : 'Communication with Destination Network is Administratively Prohibited',
+            10 : 'Communication with Destination Host is Administratively Prohibited',
+            11 : 'Destination Network Unreachable for Type of Service',
+            12 : 'Destination Host Unreachable for Type of Service',
+            13 : 'Communication Administratively Prohibited',
+            14 : 'Host Precedence Violation',
+            15 : 'Precedence cutoff in effect'
+        },
+        11 : {
+            0 : 'Time to Live exceeded in Transit',
+            1 : 'Fragment Reassembly Time Exceeded'
+        }
+    }
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Constructors                                                                                   #
+    # ################################################################################################################ #
+    def __init__(self, kernelTimestamps=False, resolver=None, identifiers=None, network=None, instrumentation=None,
+                 capture=None, prefixIndex=None):
+        # kernelTimestamps takes receive times from the kernel (SO_TIMESTAMPNS) so RTTs exclude our own scheduling.
+        # resolver is an IcmpResolver; by default the process-wide one is shared. identifiers fixes the ICMP
+        # identifiers the probe engine uses instead of deriving one from the pid. network is an
+        # IcmpSimulatedNetwork to probe instead of the real one, which needs no privileges. instrumentation is an
+        # IcmpInstrumentation that profiles every stage of this session's probes; see getInstrumentation(). capture
+        # is an IcmpPcapWriter that every packet sent and received is written to, for IcmpPcapAnalysis later on.
+        # prefixIndex is an IcmpPrefixIndex used to annotate every responder with its origin ASN and prefix.
+        self.__kernelTimestamps = kernelTimestamps
+        self.__prefixIndex = prefixIndex
+        self.__instrumentation = instrumentation
+        self.__capture = capture
+        self.__network = network
+        self.__identifiers = identifiers
+        self.__resolver = resolver if resolver is not None else IcmpHelperLibrary.IcmpResolver.getDefaultResolver()
+        self.__statistics = {}                      # target host -> IcmpRttStatistics for this session
+        self.__retransmitTimers = {}                # destination address -> IcmpRetransmitTimer
+        self.__topologyCache = None                 # IcmpTopologyCache shared by this session's batch traces
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Private Functions                                                                              #
+    # ################################################################################################################ #
+    def __getProbeEngine(self):
+        # One engine (and therefore one raw socket) is kept for the life of this library instance
+        if self.__probeEngine is None:
+            transport = self.__network.createSocket() if self.__network is not None else None
+            self.__probeEngine = IcmpHelperLibrary.IcmpProbeEngine(kernelTimestamps=self.__kernelTimestamps,
+                                                                   identifiers=self.__identifiers,
+                                                                   transport=transport,
+                                                                   instrumentation=self.__instrumentation,
+                                                                   capture=self.__capture)
+        return self.__probeEngine
+
+    def __resolve(self, host):
+        if self.__instrumentation is None:
+            return self.__resolver.resolve(host)
+        resolveStart = time.perf_counter_ns()
+        destinationIpAddress = self.__resolver.resolve(host)
+        self.__instrumentation.recordStage("resolve", time.perf_counter_ns() - resolveStart)
+        return destinationIpAddress
+
+    def __resolveMany(self, hosts):
+        # A whole batch is timed as one resolve sample, since its names are looked up concurrently
+        if self.__instrumentation is None:
+            return self.__resolver.resolveMany(hosts)
+        resolveStart = time.perf_counter_ns()
+        resolved = list(self.__resolver.resolveMany(hosts))
+        self.__instrumentation.recordStage("resolve", time.perf_counter_ns() - resolveStart)
+        return resolved
+
+    def __annotate(self, address):
+        # (origin ASN, prefix) of a responder address, or (None, None) without a prefix index or a covering prefix
+        if self.__prefixIndex is None or address is None:
+            return None, None
+        return self.__prefixIndex.lookup(address) or (None, None)
+
+    def __createRecord(self, target, probe, hop=None, responderName=None, expectedPayload=None):
+        # IcmpResultRecord.fromProbe, which validates echo replies, timed as the validate stage
+        responderAsn = responderPrefix = None
+        if self.__prefixIndex is not None and probe.getResponderAddress() is not None:
+            responderAsn, responderPrefix = self.__annotate(probe.getResponderAddress()[0])
+        if self.__instrumentation is None:
+            return IcmpHelperLibrary.IcmpResultRecord.fromProbe(target, probe, hop, responderName, expectedPayload,
+                                                                responderAsn, responderPrefix)
+        validateStart = time.perf_counter_ns()
+        record = IcmpHelperLibrary.IcmpResultRecord.fromProbe(target, probe, hop, responderName, expectedPayload,
+                                                              responderAsn, responderPrefix)
+        self.__instrumentation.recordStage("validate", time.perf_counter_ns() - validateStart)
+        if not record.isValidResponse():
+            self.__instrumentation.increment("invalid")
+        return record
+
+    def __report(self, writer, record):
+        if self.__instrumentation is None:
+            writer.write(record)
+            return
+        reportStart = time.perf_counter_ns()
+        writer.write(record)
+        self.__instrumentation.recordStage("report", time.perf_counter_ns() - reportStart)
+
+    def __getTargetStatistics(self, host):
+        statistics = self.__statistics.get(host)
+        if statistics is None:
+            statistics = self.__statistics[host] = IcmpHelperLibrary.IcmpRttStatistics()
+        return statistics
+
+    def __getRetransmitTimer(self, destinationIpAddress):
+        retransmitTimer = self.__retransmitTimers.get(destinationIpAddress)
+        if retransmitTimer is None:
+            retransmitTimer = IcmpHelperLibrary.IcmpRetransmitTimer(maxTimeout=self.__maxProbeTimeout)
+            self.__retransmitTimers[destinationIpAddress] = retransmitTimer
+        return retransmitTimer
+
+    def __learnTraceTimeout(self, retransmitTimer, hops):
+        # The slowest answer (the furthest hop's, when every hop was probed at once) bounds how long the next trace
+        # waits; a trace that got no answer at all backs off
+        rtts = [probe.getRtt() for probe in hops if probe.isComplete()]
+        if rtts:
+            retransmitTimer.recordRtt(max(rtts) / 1000)
+        else:
+            retransmitTimer.backOff()
+
+    @staticmethod
+    def __countReportedHops(hops, maxSilentHops):
+        # Number of leading hops a trace reports: it gives up after maxSilentHops unanswered hops in a row
+        silentHops = 0
+        for i, probe in enumerate(hops):
+            silentHops = 0 if probe.isComplete() else silentHops + 1
+            if maxSilentHops is not None and silentHops >= maxSilentHops:
+                return i + 1
+        return len(hops)
+
+    async def __resolveAsync(self, eventLoop, host):
+        # Cache misses are resolved on the loop's executor, so resolving one target never stalls the others
+        address = self.__resolver.getCached(host)
+        if address is None:
+            address = await eventLoop.run_in_executor(None, self.__resolver.resolve, host)
+        return address
+
+    def __sendIcmpEchoRequest(self, host, count, interval, deadline, maxInFlight, flood, timeout):
+        consoleWriter = IcmpHelperLibrary.IcmpConsoleWriter()
+        runStatistics = IcmpHelperLibrary.IcmpRttStatistics()
+
+        for record in self.pingRecords(host, count, interval, timeout, deadline, maxInFlight, flood):
+            self.__report(consoleWriter, record)
+            runStatistics.recordSent()
+            if record.getIcmpType() == 0:
+                runStatistics.recordRtt(record.getRtt())
+
+        # Displaying this run's RTT statistics; pingRecords has already added them to the session totals
+        min_rtt = round(runStatistics.getMinRtt()) if runStatistics.getReceivedCount() else 0
+        max_rtt = round(runStatistics.getMaxRtt()) if runStatistics.getReceivedCount() else 0
+        avg_rtt = round(runStatistics.getAvgRtt()) if runStatistics.getReceivedCount() else 0
+
+        packet_loss = runStatistics.getPacketLoss()
+
+        print(f'Ping Complete - Min RTT:{min_rtt} ms, Max RTT: {max_rtt} ms, Avg RTT: {avg_rtt} ms, Packet Loss: {packet_loss} %')
+
+    def __sendIcmpTraceRoute(self, host, maxTtl, maxSilentHops):
+        # Build code for trace route here
+        probeEngine = self.__getProbeEngine()
+        retransmitTimer = self.__getRetransmitTimer(self.__resolve(host))
+
+        # One hop at a time, each waiting as long as the learnt timeout. The trace ends at the destination (echo
+        # reply or unreachable), at maxTtl, or after maxSilentHops hops in a row did not answer.
+        silentHops = 0
+        for trace_counter in range(1, maxTtl + 1):
+
+            icmpPacket = IcmpHelperLibrary.IcmpPacket()
+            icmpPacket.setTtl(trace_counter)
+
+            packetIdentifier, packetSequenceNumber = probeEngine.allocateProbeId()
+
+            if self.__instrumentation is None:
+                icmpPacket.buildPacket_echoRequest(packetIdentifier, packetSequenceNumber)
+            else:
+                buildStart = time.perf_counter_ns()
+                icmpPacket.buildPacket_echoRequest(packetIdentifier, packetSequenceNumber)
+                self.__instrumentation.recordStage("build", time.perf_counter_ns() - buildStart)
+            icmpPacket.setIcmpTarget(host, self.__resolver)
+            icmpType = icmpPacket.sendEchoRequest(probeEngine, retransmitTimer=retransmitTimer)
+
+            if icmpType in (0, 3):
+                break
+            silentHops = silentHops + 1 if icmpType is None else 0
+            if maxSilentHops is not None and silentHops >= maxSilentHops:
+                break
+
+    def __sendIcmpTraceRoutePipelined(self, host, maxTtl, timeout, maxSilentHops):
+        print("Tracing route to (" + host + ") " + self.__resolve(host))
+        consoleWriter = IcmpHelperLibrary.IcmpConsoleWriter()
+        for record in self.traceRouteRecords(host, maxTtl, timeout, maxSilentHops=maxSilentHops):
+            self.__report(consoleWriter, record)
+
+    def __sendIcmpTraceRouteMultipath(self, host, maxTtl, alpha, timeout, maxFlows, maxSilentHops):
+        graph = self.traceRouteMultipathGraph(host, maxTtl, alpha, timeout, maxFlows, maxSilentHops)
+        print("Multipath trace to (" + host + ") " + graph.getDestinationIpAddress())
+        for ttl in graph.getTtls():
+            if not graph.getInterfaces(ttl):
+                print("  TTL=%d    *        *        *        *        *      Request timed out." % ttl)
+            for address in graph.getInterfaces(ttl):
+                successors = graph.getSuccessors(ttl, address)
+                print("  TTL=%d    RTT=%.0f ms    Type=%d    %s%s" %
+                      (ttl, graph.getStatistics(ttl, address).getAvgRtt(), graph.getIcmpType(ttl, address), address,
+                       "  -> " + ", ".join(successors) if successors else ""))
+        print("Multipath Trace Complete - %d paths, %d probes over %d flows" %
+              (graph.getPathCount(), graph.getProbeCount(), graph.getFlowCount()))
+
+    # ################################################################################################################ #
+    # IcmpHelperLibrary Public Functions                                                                               #
+    # ################################################################################################################ #
+    def sendPing(self, targetHost, count=4, interval=0, deadline=None, maxInFlight=1, flood=False, timeout=None):
+        # Prints a line per probe and a summary. The defaults send 4 echo requests, each as soon as the previous one
+        # is answered; see pingRecords for the other options.
+        self.__sendIcmpEchoRequest(targetHost, count, interval, deadline, maxInFlight, flood, timeout)
+
+    def traceRoute(self, targetHost, maxTtl=30, maxSilentHops=5):
+        # Each hop waits for the adaptive timeout of the destination, so silent hops cost about a second each
+        self.__sendIcmpTraceRoute(targetHost, maxTtl, maxSilentHops)
+
+    def traceRoutePipelined(self, targetHost, maxTtl=30, timeout=None, maxSilentHops=5):
+        # Sends every TTL probe at once, so the trace takes about one path RTT plus the timeout. Without a
+        # timeout, the wait adapts to the RTTs seen on earlier traces and pings of the same destination.
+        self.__sendIcmpTraceRoutePipelined(targetHost, maxTtl, timeout, maxSilentHops)
+
+    def traceRouteMultipath(self, targetHost, maxTtl=30, alpha=0.05, timeout=None, maxFlows=256, maxSilentHops=5):
+        # Prints every interface per TTL with the interfaces it leads to; see traceRouteMultipathGraph
+        self.__sendIcmpTraceRouteMultipath(targetHost, maxTtl, alpha, timeout, maxFlows, maxSilentHops)
+
+    def sweep(self, targets, count=1, window=1024, packetsPerSecond=10000, timeout=2):
+        # Pings every target in the iterable (consumed lazily) and yields an IcmpPingResult per host as soon as all
+        # of its probes have been answered or timed out. At most window probes are in flight at once and sends are
+        # paced by a token bucket so our own bursts do not overrun the receive buffer or the network.
+        probeEngine = self.__getProbeEngine()
+        tokenBucket = IcmpHelperLibrary.IcmpTokenBucket(packetsPerSecond)
+        targets = iter(targets)
+
+        sendQueue = collections.deque()     # (hostState) for hosts that still have probes to send
+        expiryQueue = collections.deque()   # (deadline, probe, hostState) in send order, so deadlines are sorted
+        hostStates = {}                     # IcmpProbe -> hostState
+        inFlight = 0
+        targetsExhausted = False
+
+        while True:
+            # Refill the send queue from the target iterator while the window has room. Names are resolved a
+            # batch at a time, concurrently, by the resolver.
+            while not targetsExhausted and len(sendQueue) == 0 and inFlight < window:
+                batch = list(itertools.islice(targets, self.__resolveBatchSize))
+                if len(batch) == 0:
+                    targetsExhausted = True
+                    break
+                for target, destinationIpAddress in self.__resolveMany(batch):
+                    if destinationIpAddress is None:
+                        yield IcmpHelperLibrary.IcmpPingResult(target, None, [])
+                        continue
+                    # hostState: [target, destinationIpAddress, probes, probes left to send, probes outstanding]
+                    sendQueue.append([target, destinationIpAddress, [], count, 0])
+
+            # Send as much as the window and the token bucket allow
+            while sendQueue and inFlight < window and tokenBucket.tryConsume():
+                hostState = sendQueue[0]
+                probe = probeEngine.sendEchoRequest(hostState[1])
+                hostState[2].append(probe)
+                hostState[3] -= 1
+                hostState[4] += 1
+                if hostState[3] == 0:
+                    sendQueue.popleft()
+                hostStates[probe] = hostState
+                expiryQueue.append((time.monotonic() + timeout, probe, hostState))
+                inFlight += 1
+
+            if inFlight == 0 and not sendQueue and targetsExhausted:
+                return
+
+            # Wait for replies, but no longer than the next send slot or the oldest probe's deadline
+            waitTime = timeout
+            if sendQueue and inFlight < window:
+                waitTime = tokenBucket.getDelay()
+            if expiryQueue:
+                waitTime = min(waitTime, expiryQueue[0][0] - time.monotonic())
+
+            # Probes past their deadline time out. A probe can also have been completed by another caller's receive
+            # on the shared engine, so every probe leaving the queue is finished whether or not it is complete.
+            finishedProbes = probeEngine.receive(waitTime)
+            now = time.monotonic()
+            while expiryQueue and (expiryQueue[0][1].isComplete() or expiryQueue[0][0] <= now):
+                probe = expiryQueue.popleft()[1]
+                if not probe.isComplete():
+                    probeEngine.cancel(probe)
+                finishedProbes.append(probe)
+
+            for probe in finishedProbes:
+                hostState = hostStates.pop(probe, None)
+                if hostState is None:
+                    continue
+                inFlight -= 1
+                hostState[4] -= 1
+                if hostState[3] == 0 and hostState[4] == 0:
+                    yield IcmpHelperLibrary.IcmpPingResult(hostState[0], hostState[1], hostState[2])
+
+    def traceRouteBatch(self, targets, maxTtl=30, startTtl=None, maxSilentHops=5, window=256, timeout=None,
+                        topologyCache=None):
+        # Traces every target (the iterable is consumed lazily), up to window traces at once with one probe in
+        # flight each, and yields each trace's IcmpResultRecords in hop order as soon as it is finished. Targets
+        # that do not resolve get a single record with no destination.
+        #
+        # Doubletree: a trace first probes forward from startTtl (by default just short of all but the nearest 5% of
+        # the destinations reached so far) to the destination, then backward from startTtl - 1 until it reaches an
+        # interface already in the topology cache at the same TTL. The hops before it are copied from the cache
+        # (their records have no RTT). Without a timeout, each wait is the trace's adaptive timeout, which starts
+        # from the destination's when one has been learnt.
+        probeEngine = self.__getProbeEngine()
+        if topologyCache is None:
+            topologyCache = self.getTopologyCache()
+        targets = iter(targets)
+
+        expiryHeap = []                     # (deadline, sequence, probe); timeouts differ between destinations
+        expiryCounter = itertools.count()
+        traceStates = {}                    # IcmpProbe -> traceState
+        activeTraces = 0
+        targetsExhausted = False
+
+        # traceState: [target, destinationIpAddress, start TTL, next TTL, probing forward, silent hops in a row,
+        #              destination TTL, {ttl: IcmpResultRecord}, IcmpRetransmitTimer, [IcmpProbe],
+        #              learnt IcmpRetransmitTimer or None]
+        def sendNextProbe(traceState):
+            probe = probeEngine.sendEchoRequest(traceState[1], traceState[3])
+            traceStates[probe] = traceState
+            probeTimeout = timeout if timeout is not None else traceState[8].getTimeout()
+            heapq.heappush(expiryHeap, (time.monotonic() + probeTimeout, next(expiryCounter), probe))
+
+        def copyKnownPath(traceState, ttl):
+            # Fills in the hops before ttl from the cache if the interface that answered there is known
+            record = traceState[7][ttl]
+            if record.getIcmpType() != 11 or not topologyCache.isKnown(ttl, record.getResponder()):
+                return False
+            for hopTtl, interface in enumerate(topologyCache.getPathTo(ttl, record.getResponder()), 1):
+                responderAsn, responderPrefix = self.__annotate(interface)
+                traceState[7][hopTtl] = IcmpHelperLibrary.IcmpResultRecord(
+                    traceState[0], traceState[1], hopTtl, hopTtl, None, None, interface,
+                    icmpType=11 if interface is not None else None, icmpCode=0 if interface is not None else None,
+                    responderAsn=responderAsn, responderPrefix=responderPrefix)
+            topologyCache.addCopiedHops(ttl - 1)
+            return True
+
+        def advance(traceState, probe):
+            # Records the probe's outcome and picks the next TTL; returns True once the trace is finished
+            ttl = probe.getTtl()
+            traceState[7][ttl] = self.__createRecord(traceState[0], probe, ttl)
+            traceState[9].append(probe)
+            if probe.isComplete():
+                traceState[8].recordRtt(probe.getRtt() / 1000)
+                if probe.getIcmpType() != 11:
+                    traceState[6] = min(traceState[6], ttl)
+
+            if traceState[4]:
+                traceState[5] = traceState[5] + 1 if not probe.isComplete() else 0
+                if traceState[6] > ttl and ttl < maxTtl and (maxSilentHops is None or traceState[5] < maxSilentHops):
+                    traceState[3] = ttl + 1
+                    return False
+                # Forward part done; go back from the start unless the start hop is already known
+                traceState[4] = False
+                if copyKnownPath(traceState, traceState[2]):
+                    return True
+                traceState[3] = traceState[2] - 1
+            elif copyKnownPath(traceState, ttl):
+                return True
+            else:
+                traceState[3] = ttl - 1
+            return traceState[3] < 1
+
+        def finishTrace(traceState):
+            if traceState[10] is not None:
+                self.__learnTraceTimeout(traceState[10], traceState[9])
+            hops = traceState[7]
+            lastTtl = min(traceState[6], max(hops))
+            records = [hops[ttl] for ttl in range(1, lastTtl + 1)]
+            topologyCache.addPath([record.getResponder() for record in records], records[-1].getIcmpType() == 0)
+            return records
+
+        while True:
+            # Start new traces while the window has room. Names are resolved a batch at a time, concurrently.
+            while not targetsExhausted and activeTraces < window:
+                batch = list(itertools.islice(targets, min(self.__resolveBatchSize, window - activeTraces)))
+                if len(batch) == 0:
+                    targetsExhausted = True
+                    break
+                for target, destinationIpAddress in self.__resolveMany(batch):
+                    if destinationIpAddress is None:
+                        yield IcmpHelperLibrary.IcmpResultRecord(target, None, None, None, None, None)
+                        continue
+                    traceStartTtl = min(startTtl, maxTtl) if startTtl is not None else topologyCache.getStartTtl(maxTtl)
+                    # Each trace has its own timer, a copy of what was learnt before the batch, so traces of
+                    # the same destination do not change each other's. A learnt timer is updated (or backed off)
+                    # from each trace as it finishes; none is created, so a large batch does not leave a timer
+                    # behind for every destination.
+                    learntTimer = self.__retransmitTimers.get(destinationIpAddress)
+                    if learntTimer is not None:
+                        retransmitTimer = learntTimer.copy()
+                    else:
+                        retransmitTimer = IcmpHelperLibrary.IcmpRetransmitTimer(maxTimeout=self.__maxProbeTimeout)
+                    traceState = [target, destinationIpAddress, traceStartTtl, traceStartTtl, True, 0, maxTtl + 1,
+                                  {}, retransmitTimer, [], learntTimer]
+                    sendNextProbe(traceState)
+                    activeTraces += 1
+
+            if activeTraces == 0:
+                return
+
+            # Probes completed by another caller's receive on the shared engine leave the heap complete; they are
+            # finished here like the ones that timed out
+            finishedProbes = probeEngine.receive(expiryHeap[0][0] - time.monotonic())
+            now = time.monotonic()
+            while expiryHeap and (expiryHeap[0][2].isComplete() or expiryHeap[0][0] <= now):
+                probe = heapq.heappop(expiryHeap)[2]
+                if not probe.isComplete():
+                    probeEngine.cancel(probe)
+                finishedProbes.append(probe)
+
+            for probe in finishedProbes:
+                traceState = traceStates.pop(probe, None)
+                if traceState is None:
+                    continue
+                if advance(traceState, probe):
+                    activeTraces -= 1
+                    yield from finishTrace(traceState)
+                else:
+                    sendNextProbe(traceState)
+
+    def pingRecords(self, targetHost, count=4, interval=1.0, timeout=None, deadline=None, maxInFlight=1, flood=False):
+        # Generator of one IcmpResultRecord per echo request, each yielded as soon as it is answered or times out.
+        # Nothing is printed; pass the records to a writer such as IcmpConsoleWriter or IcmpNdjsonWriter.
+        #
+        # Requests go out every interval seconds (fractions of a millisecond work) with at most maxInFlight of them
+        # unanswered at once, so sends and receives overlap; with more than one in flight, records can come back out
+        # of sequence order. flood ignores interval and sends whenever the window has room, i.e. as soon as a reply
+        # arrives with the default window of one. count=None pings until the deadline, in seconds from the first
+        # send, after which requests still outstanding are reported as timed out. Without a timeout, each request
+        # waits for the destination's adaptive retransmission timeout as it stood when the request was sent.
+        probeEngine = self.__getProbeEngine()
+        destinationIpAddress = self.__resolve(targetHost)
+        expectedPayload = probeEngine.getEchoRequestTemplate().getPayload()
+        statistics = self.__getTargetStatistics(targetHost)
+        retransmitTimer = self.__getRetransmitTimer(destinationIpAddress)
+
+        expiryHeap = []                     # (deadline, sequence, probe); adaptive timeouts are not monotonic
+        expiryCounter = itertools.count()
+        outstanding = set()
+        sentCount = 0
+        startTime = time.monotonic()
+        nextSendTime = startTime
+        deadlineTime = startTime + deadline if deadline is not None else None
+
+        while True:
+            now = time.monotonic()
+            if deadlineTime is not None and now >= deadlineTime:
+                break
+
+            # Send whatever is due while the window has room
+            while (count is None or sentCount < count) and len(outstanding) < maxInFlight and \
+                    (flood or now >= nextSendTime):
+                probe = probeEngine.sendEchoRequest(destinationIpAddress)
+                statistics.recordSent()
+                sentCount += 1
+                outstanding.add(probe)
+                probeTimeout = timeout if timeout is not None else retransmitTimer.getTimeout()
+                heapq.heappush(expiryHeap, (now + probeTimeout, next(expiryCounter), probe))
+                nextSendTime = max(nextSendTime, now - interval) + interval   # Falling behind never causes a burst
+                now = time.monotonic()
+
+            if not outstanding and count is not None and sentCount >= count:
+                break
+
+            # Wait for replies, but no longer than the next send, the oldest probe's expiry or the deadline
+            waitTime = expiryHeap[0][0] - now if expiryHeap else interval
+            if (count is None or sentCount < count) and len(outstanding) < maxInFlight and not flood:
+                waitTime = min(waitTime, nextSendTime - now)
+            if deadlineTime is not None:
+                waitTime = min(waitTime, deadlineTime - now)
+
+            # Probes completed by another caller's receive on the shared engine leave the heap complete; they are
+            # finished here like the ones that timed out. A probe can show up twice, so only the first counts.
+            finishedProbes = probeEngine.receive(waitTime)
+            now = time.monotonic()
+            while expiryHeap and (expiryHeap[0][2].isComplete() or expiryHeap[0][0] <= now):
+                probe = heapq.heappop(expiryHeap)[2]
+                if not probe.isComplete():
+                    probeEngine.cancel(probe)
+                finishedProbes.append(probe)
+
+            for probe in finishedProbes:
+                if probe not in outstanding:
+                    continue
+                outstanding.discard(probe)
+                if not probe.isComplete():
+                    retransmitTimer.backOff()
+                else:
+                    retransmitTimer.recordRtt(probe.getRtt() / 1000)
+                    if probe.getIcmpType() == 0:
+                        statistics.recordRtt(probe.getRtt())
+                yield self.__createRecord(targetHost, probe, expectedPayload=expectedPayload)
+
+        # Stopped by the deadline: whatever is still outstanding counts as lost
+        for expiry, sequence, probe in sorted(expiryHeap):
+            if probe in outstanding:
+                probeEngine.cancel(probe)
+                yield self.__createRecord(targetHost, probe, expectedPayload=expectedPayload)
+
+    def traceRouteRecords(self, targetHost, maxTtl=30, timeout=None, resolveHopNames=True, maxSilentHops=5):
+        # Generator of one IcmpResultRecord per hop, in hop order, ending at the destination, at maxTtl or after
+        # maxSilentHops unanswered hops in a row. Every TTL is probed at once; each gets its own sequence number,
+        # so the engine can map a response back to its hop through the echo request quoted in the error. Without
+        # a timeout, the wait is the destination's adaptive retransmission timeout.
+        probeEngine = self.__getProbeEngine()
+        destinationIpAddress = self.__resolve(targetHost)
+        retransmitTimer = self.__getRetransmitTimer(destinationIpAddress)
+        if timeout is None:
+            timeout = retransmitTimer.getTimeout()
+        hopNames = {}                   # ttl -> Future of the responder's host name
+        probes = []
+        for ttl in range(1, maxTtl + 1):
+            probes.append(probeEngine.sendEchoRequest(destinationIpAddress, ttl))
+
+        # Collect responses until every TTL up to the destination has answered or the timeout expires. The engine
+        # is shared, so a receive can complete other callers' probes and another caller's receive can complete
+        # ours: only this trace's own probes are looked at, whichever call completed them.
+        destinationTtl = maxTtl + 1
+        pendingProbes = list(probes)
+        deadline = time.monotonic() + timeout
+        while True:
+            for probe in [probe for probe in pendingProbes if probe.isComplete()]:
+                pendingProbes.remove(probe)
+                if probe.getIcmpType() != 11:
+                    destinationTtl = min(destinationTtl, probe.getTtl())
+                # Hop names are looked up on the resolver's thread pool while the remaining hops are still answering
+                if resolveHopNames:
+                    hopNames[probe.getTtl()] = self.__resolver.reverseResolve(probe.getResponderAddress()[0])
+
+            timeLeft = deadline - time.monotonic()
+            if timeLeft <= 0:
+                break
+            if all(probe.isComplete() for probe in probes[:destinationTtl - 1]):
+                break
+            probeEngine.receive(timeLeft)
+
+        for probe in probes:
+            if not probe.isComplete():
+                probeEngine.cancel(probe)
+
+        hops = probes[:min(destinationTtl, maxTtl)]
+        self.__learnTraceTimeout(retransmitTimer, hops)
+        nameDeadline = time.monotonic() + self.__reverseLookupTimeout
+        for probe in hops[:self.__countReportedHops(hops, maxSilentHops)]:
+            hopName = None
+            if probe.getTtl() in hopNames:
+                try:
+                    hopName = hopNames[probe.getTtl()].result(timeout=max(nameDeadline - time.monotonic(), 0))
+                except concurrent.futures.TimeoutError:
+                    pass
+            yield self.__createRecord(targetHost, probe, hop=probe.getTtl(), responderName=hopName)
+
+    def traceRouteMultipathGraph(self, targetHost, maxTtl=30, alpha=0.05, timeout=None, maxFlows=256, maxSilentHops=5):
+        # Paris-style multipath trace using the Multipath Detection Algorithm, returned as an IcmpHopGraph. Every
+        # probe of a flow carries the same ICMP checksum, so per-flow load balancers keep it on one path, and each
+        # flow has a different checksum so flows spread over all of them. At each TTL, every interface of the
+        # previous TTL gets enough flows through it to find all of its successors with probability 1 - alpha:
+        # once k successors are seen, n_k = ceil(ln(alpha / (k + 1)) / ln(k / (k + 1))) flows must have been
+        # probed (6 for k = 1 at alpha = 0.05). When too few known flows reach an interface, new flows are probed
+        # at the previous TTL as well, up to maxFlows in all. All the probes a round needs are sent at once.
+        # Without a timeout, each round waits for the destination's adaptive retransmission timeout.
+        probeEngine = self.__getProbeEngine()
+        destinationIpAddress = self.__resolve(targetHost)
+        retransmitTimer = self.__getRetransmitTimer(destinationIpAddress)
+        graph = IcmpHelperLibrary.IcmpHopGraph(targetHost, destinationIpAddress)
+        answers = {}                    # ttl -> {flow: IcmpProbe}; a flow is identified by its checksum
+        stoppingPoints = {}             # k -> n_k
+        flowCount = 0
+
+        def getStoppingPoint(k):
+            if k not in stoppingPoints:
+                stoppingPoints[k] = math.ceil(math.log(alpha / (k + 1)) / math.log(k / (k + 1)))
+            return stoppingPoints[k]
+
+        def getResponder(probe):
+            return probe.getResponderAddress()[0] if probe.isComplete() else None
+
+        def probeFlows(requests):
+            # Sends a (ttl, flow) probe for every request at once and waits for all of them
+            probes = [probeEngine.sendEchoRequest(destinationIpAddress, ttl, flow) for ttl, flow in requests]
+            probeEngine.waitFor(probes, timeout if timeout is not None else retransmitTimer.getTimeout())
+            self.__learnTraceTimeout(retransmitTimer, probes)
+            for (ttl, flow), probe in zip(requests, probes):
+                answers.setdefault(ttl, {})[flow] = probe
+                graph.addProbes(ttl, [probe])
+
+        silentHops = 0
+        for ttl in range(1, maxTtl + 1):
+            answers.setdefault(ttl, {})
+            while True:
+                # Group the flows by the interface that answered them one TTL earlier. Every flow passes the one
+                # source at TTL 1, and after a hop where nothing answered, the flows cannot be told apart either.
+                previousAnswers = answers.get(ttl - 1, {})
+                isSingleGroup = not any(probe.isComplete() for probe in previousAnswers.values())
+                groups = {}
+                if isSingleGroup:
+                    groups[None] = list(range(flowCount))
+                else:
+                    for flow, probe in previousAnswers.items():
+                        if probe.isComplete() and probe.getIcmpType() == 11:
+                            groups.setdefault(getResponder(probe), []).append(flow)
+
+                requests = []
+                newFlowsNeeded = 0
+                for flows in groups.values():
+                    probedFlows = [flow for flow in flows if flow in answers[ttl]]
+                    successors = {getResponder(answers[ttl][flow]) for flow in probedFlows} - {None}
+                    flowsNeeded = getStoppingPoint(max(len(successors), 1)) - len(probedFlows)
+                    unprobedFlows = [flow for flow in flows if flow not in answers[ttl]]
+                    requests += [(ttl, flow) for flow in unprobedFlows[:max(flowsNeeded, 0)]]
+                    newFlowsNeeded += max(flowsNeeded - len(unprobedFlows), 0)
+
+                # New flows are probed at both TTLs, so the interface they pass one TTL earlier is known too
+                for flow in range(flowCount, min(flowCount + newFlowsNeeded, maxFlows)):
+                    if not isSingleGroup:
+                        requests.append((ttl - 1, flow))
+                    requests.append((ttl, flow))
+                flowCount = min(flowCount + newFlowsNeeded, maxFlows)
+                if not requests:
+                    break
+                probeFlows(requests)
+
+            # Done once every flow has reached the destination, or after maxSilentHops TTLs without an answer
+            answered = [probe for probe in answers[ttl].values() if probe.isComplete()]
+            if answered and all(probe.getIcmpType() != 11 for probe in answered):
+                break
+            silentHops = silentHops + 1 if not answered else 0
+            if maxSilentHops is not None and silentHops >= maxSilentHops:
+                break
+
+        # A flow answered at two consecutive TTLs shows the link between the two interfaces
+        for ttl, flows in answers.items():
+            for flow, probe in flows.items():
+                previousProbe = answers.get(ttl - 1, {}).get(flow)
+                if probe.isComplete() and previousProbe is not None and previousProbe.isComplete() and \
+                        previousProbe.getIcmpType() == 11:
+                    graph.addEdge(ttl - 1, getResponder(previousProbe), getResponder(probe))
+        graph.setFlowCount(flowCount)
+        return graph
+
+    async def sendPingAsync(self, targetHost, count=4, interval=1.0, timeout=None):
+        # Sends count echo requests interval seconds apart and returns an IcmpPingResult. Nothing is printed, and
+        # any number of these can run at once on the same event loop. Without a timeout, each probe waits for the
+        # destination's adaptive retransmission timeout as it stood when the probe was sent.
+        probeEngine = self.__getProbeEngine()
+        eventLoop = asyncio.get_running_loop()
+        probeEngine.attachEventLoop(eventLoop)
+        destinationIpAddress = await self.__resolveAsync(eventLoop, targetHost)
+        retransmitTimer = self.__getRetransmitTimer(destinationIpAddress)
+
+        async def waitForProbe(probe, probeTimeout):
+            await probeEngine.waitForAsync([probe], probeTimeout)
+            if not probe.isComplete():
+                retransmitTimer.backOff()
+            else:
+                retransmitTimer.recordRtt(probe.getRtt() / 1000)
+
+        probes = []
+        waiters = []
+        for i in range(count):
+            if i > 0 and interval > 0:
+                await asyncio.sleep(interval)
+            probe = probeEngine.sendEchoRequest(destinationIpAddress)
+            probes.append(probe)
+            probeTimeout = timeout if timeout is not None else retransmitTimer.getTimeout()
+            waiters.append(asyncio.ensure_future(waitForProbe(probe, probeTimeout)))
+        await asyncio.gather(*waiters)
+
+        pingResult = IcmpHelperLibrary.IcmpPingResult(targetHost, destinationIpAddress, probes)
+        self.__getTargetStatistics(targetHost).merge(pingResult.getStatistics())
+        return pingResult
+
+    async def traceRouteAsync(self, targetHost, maxTtl=30, timeout=None, resolveHopNames=False, maxSilentHops=5):
+        # Pipelined trace: every TTL is probed at once and the IcmpTraceRouteResult lists the hops in order, up to
+        # the destination or maxSilentHops unanswered hops in a row. With resolveHopNames, hop addresses are
+        # reverse resolved on the resolver's thread pool as they answer. Without a timeout, the wait is the
+        # destination's adaptive retransmission timeout.
+        probeEngine = self.__getProbeEngine()
+        eventLoop = asyncio.get_running_loop()
+        probeEngine.attachEventLoop(eventLoop)
+        destinationIpAddress = await self.__resolveAsync(eventLoop, targetHost)
+        retransmitTimer = self.__getRetransmitTimer(destinationIpAddress)
+        if timeout is None:
+            timeout = retransmitTimer.getTimeout()
+
+        probes = [probeEngine.sendEchoRequest(destinationIpAddress, ttl) for ttl in range(1, maxTtl + 1)]
+        pending = set(probeEngine.getProbeFuture(probe) for probe in probes)
+        hopNames = {}                   # IcmpProbe -> concurrent.futures.Future of the responder's host name
+
+        # Stop as soon as every hop up to the destination has answered
+        destinationTtl = maxTtl + 1
+        deadline = eventLoop.time() + timeout
+        while pending and not all(probe.isComplete() for probe in probes[:destinationTtl - 1]):
+            timeLeft = deadline - eventLoop.time()
+            if timeLeft <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeLeft, return_when=asyncio.FIRST_COMPLETED)
+            for probeFuture in done:
+                probe = probeFuture.result()
+                if probe.isComplete() and probe.getIcmpType() != 11:
+                    destinationTtl = min(destinationTtl, probe.getTtl())
+                if probe.isComplete() and resolveHopNames:
+                    hopNames[probe] = self.__resolver.reverseResolve(probe.getResponderAddress()[0])
+
+        for probe in probes:
+            if not probe.isComplete():
+                probeEngine.cancel(probe)
+
+        hops = probes[:min(destinationTtl, maxTtl)]
+        self.__learnTraceTimeout(retransmitTimer, hops)
+        hops = hops[:self.__countReportedHops(hops, maxSilentHops)]
+        names = [None] * len(hops)
+        lookups = [asyncio.wrap_future(hopNames[probe]) for probe in hops if probe in hopNames]
+        if lookups:
+            await asyncio.wait(lookups, timeout=self.__reverseLookupTimeout)
+            for i, probe in enumerate(hops):
+                if probe in hopNames and hopNames[probe].done() and not hopNames[probe].cancelled():
+                    names[i] = hopNames[probe].result()
+        return IcmpHelperLibrary.IcmpTraceRouteResult(targetHost, destinationIpAddress, hops, names)
+
+    def monitor(self, targets, interval=1.0, timeout=1.0, historySize=300, metricsPort=None,
+                metricsAddress="127.0.0.1", duration=None):
+        # Pings every target each interval seconds until duration passes (or forever), reusing this library's
+        # socket and resolver. With a metricsPort, aggregates are served at http://metricsAddress:metricsPort/metrics.
+        # Returns the IcmpMonitor once it stops.
+        monitor = IcmpHelperLibrary.IcmpMonitor(self.__getProbeEngine(), self.__resolver, interval, timeout,
+                                                historySize)
+        monitor.addTargets(targets)
+        if metricsPort is not None:
+            monitor.startMetricsServer(metricsPort, metricsAddress)
+        try:
+            monitor.run(duration)
+        finally:
+            monitor.stopMetricsServer()
+        return monitor
+
+    def getStatistics(self, targetHost):
+        # IcmpRttStatistics accumulated by sendPing and sendPingAsync for the target during this session, or None
+        return self.__statistics.get(targetHost)
+
+    def getAllStatistics(self):
+        return dict(self.__statistics)
+
+    def getInstrumentation(self):
+        # IcmpInstrumentation given to the constructor, or None; getSnapshot() on it reads the profile so far
+        return self.__instrumentation
+
+    def getPrefixIndex(self):
+        return self.__prefixIndex
+
+    def getTopologyCache(self):
+        # IcmpTopologyCache that traceRouteBatch fills and reuses across calls on this library instance
+        if self.__topologyCache is None:
+            self.__topologyCache = IcmpHelperLibrary.IcmpTopologyCache()
+        return self.__topologyCache
+
+    def getStrayPacketCount(self):
+        # ICMP packets this library's socket received that matched no probe
+        return self.__probeEngine.getStrayPacketCount() if self.__probeEngine is not None else 0
 
-    def traceRoute(self, targetHost):
-        print("traceRoute Started...") if self.__DEBUG_IcmpHelperLibrary else 0
-        self.__sendIcmpTraceRoute(targetHost)
+    def close(self):
+        # Releases the raw socket held by this library instance and flushes the capture, which the caller closes
+        if self.__probeEngine is not None:
+            self.__probeEngine.close()
+            self.__probeEngine = None
+        if self.__capture is not None:
+            self.__capture.flush()
 
 
 # #################################################################################################################### #
@@ -0,0 +1,79 @@
+# #################################################################################################################### #
+# Imports                                                                                                              #
+# #################################################################################################################### #
+import random
+import unittest
+
+from IcmpHelperLibrary import IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpChecksumTest                                                                                               #
+#                                                                                                                      #
+# Checks IcmpChecksum against the original two-bytes-at-a-time loop from IcmpPacket.__recalculateChecksum for every   #
+# buffer length from empty to a full Ethernet MTU, and checks the incremental updates against full recalculation.     #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpChecksumTest(unittest.TestCase):
+    # ################################################################################################################ #
+    # IcmpChecksumTest Class Scope Variables                                                                           #
+    # ################################################################################################################ #
+    __mtu = 1500
+    __seed = 1071
+
+    # ################################################################################################################ #
+    # IcmpChecksumTest Private Functions                                                                               #
+    # ################################################################################################################ #
+    @staticmethod
+    def __baselineChecksum(packetAsByteData):
+        # The original loop, less its debug output
+        checksum = 0
+        countTo = (len(packetAsByteData) // 2) * 2
+
+        count = 0
+        while count < countTo:
+            thisVal = packetAsByteData[count + 1] * 256 + packetAsByteData[count]
+            checksum = checksum + thisVal
+            checksum = checksum & 0xffffffff
+            count = count + 2
+
+        if countTo < len(packetAsByteData):
+            thisVal = packetAsByteData[len(packetAsByteData) - 1]
+            checksum = checksum + thisVal
+            checksum = checksum & 0xffffffff
+
+        checksum = (checksum >> 16) + (checksum & 0xffff)
+        checksum = (checksum >> 16) + checksum
+
+        answer = ~checksum
+        answer = answer & 0xffff
+        answer = answer >> 8 | (answer << 8 & 0xff00)
+        return answer
+
+    # ################################################################################################################ #
+    # IcmpChecksumTest Public Functions                                                                                #
+    # ################################################################################################################ #
+    def testCalculateMatchesBaselineForEveryLength(self):
+        rng = random.Random(self.__seed)
+        for length in range(self.__mtu + 1):
+            for data in (rng.randbytes(length), bytes(length), b'\xff' * length):
+                with self.subTest(length=length, data=data[:4]):
+                    self.assertEqual(IcmpHelperLibrary.IcmpChecksum.calculate(data), self.__baselineChecksum(data))
+
+    def testUpdateFieldMatchesRecalculation(self):
+        rng = random.Random(self.__seed)
+        for length in range(2, self.__mtu + 1):
+            data = bytearray(rng.randbytes(length))
+            checksum = IcmpHelperLibrary.IcmpChecksum.calculate(data)
+            offset = rng.randrange(0, length - 1) & ~1          # Fields start at an even offset
+            size = rng.randint(1, min(8, length - offset))
+            oldBytes = bytes(data[offset:offset + size])
+            newBytes = rng.randbytes(size)
+            data[offset:offset + size] = newBytes
+            with self.subTest(length=length, offset=offset, size=size):
+                self.assertEqual(IcmpHelperLibrary.IcmpChecksum.updateField(checksum, oldBytes, newBytes),
+                                 IcmpHelperLibrary.IcmpChecksum.calculate(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
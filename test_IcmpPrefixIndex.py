@@ -0,0 +1,55 @@
+# #################################################################################################################### #
+# Imports                                                                                                              #
+# #################################################################################################################### #
+import os
+import re
+import tempfile
+import unittest
+
+from IcmpHelperLibrary import IcmpHelperLibrary
+
+
+# #################################################################################################################### #
+# Class IcmpPrefixIndexTest                                                                                            #
+#                                                                                                                      #
+# Checks that IcmpPrefixIndex.fromPrefixFile reads both dump formats and reports malformed lines as a ValueError      #
+# naming the file and line.                                                                                            #
+#                                                                                                                      #
+# #################################################################################################################### #
+class IcmpPrefixIndexTest(unittest.TestCase):
+    # ################################################################################################################ #
+    # IcmpPrefixIndexTest Private Functions                                                                            #
+    # ################################################################################################################ #
+    def __writePrefixFile(self, text):
+        fileDescriptor, path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fileDescriptor, "w") as prefixFile:
+            prefixFile.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def __assertBadLine(self, line):
+        path = self.__writePrefixFile("# comment\n1.0.0.0/24 13335\n" + line + "\n")
+        with self.assertRaisesRegex(ValueError, re.escape("%s line 3: " % path) + ".*" + re.escape(repr(line))):
+            IcmpHelperLibrary.IcmpPrefixIndex.fromPrefixFile(path)
+
+    # ################################################################################################################ #
+    # IcmpPrefixIndexTest Public Functions                                                                             #
+    # ################################################################################################################ #
+    def testReadsBothFormats(self):
+        path = self.__writePrefixFile("1.0.0.0/16 AS13335\n\n; comment\n1.0.4.0\t22\t4826_7545\n2001:db8::/32 64500\n")
+        index = IcmpHelperLibrary.IcmpPrefixIndex.fromPrefixFile(path)
+        self.assertEqual(index.getPrefixCount(), 2)
+        self.assertEqual(index.lookup("1.0.1.1"), (13335, "1.0.0.0/16"))
+        self.assertEqual(index.lookup("1.0.5.1"), (4826, "1.0.4.0/22"))
+        self.assertIsNone(index.lookup("2.0.0.1"))
+
+    def testAsnWithoutDigitsIsRejected(self):
+        self.__assertBadLine("1.0.0.0/24 AS")
+
+    def testNonNumericLengthIsRejected(self):
+        self.__assertBadLine("1.0.0.0/x 13335")
+        self.__assertBadLine("1.0.0.0 x 13335")
+
+
+if __name__ == "__main__":
+    unittest.main()